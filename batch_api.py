@@ -0,0 +1,391 @@
+# batch_api.py
+
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from tqdm import tqdm
+from gemini_client import safe_upload
+from generation import unwrap_answer
+from openai_client import build_audio_messages
+from prompt_registry import prompt_hash
+from result_writer import get_writer
+from retry import DEFAULT_RETRY_POLICY
+
+# 各家的任务状态 -> "running" / "done"（结果可读，可能只有一部分）/ "failed"（没有结果）
+_GEMINI_STATES = {
+    "JOB_STATE_SUCCEEDED": "done",
+    "JOB_STATE_FAILED": "failed",
+    "JOB_STATE_CANCELLED": "failed",
+    "JOB_STATE_EXPIRED": "failed",
+}
+_OPENAI_STATES = {
+    "completed": "done",
+    "expired": "done",      # 24h 内没跑完：已完成的部分照样在 output 文件里
+    "cancelled": "done",
+    "failed": "failed",
+}
+
+
+def _write_jsonl(lines) -> str:
+    # 请求文件可能很大（openai 内联 base64 音频）：逐行写临时文件，不整个放内存
+    fd, path = tempfile.mkstemp(suffix=".jsonl", prefix="batch_requests_")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        for line in lines:
+            f.write(json.dumps(line, ensure_ascii=False) + "\n")
+    return path
+
+
+# -------- Gemini Batch API --------
+def _gemini_text(response: dict) -> str:
+    candidates = response.get("candidates") or [{}]
+    parts = candidates[0].get("content", {}).get("parts", [])
+    text = "".join(p.get("text", "") for p in parts if not p.get("thought"))
+    return text.strip().lower() or "error"
+
+
+class GeminiBatchBackend:
+    """
+    Gemini Batch API (client.batches). Audio goes through the Files API
+    once per file (reusing upload_cache, upload_workers at a time); the
+    requests go up as one JSONL file and come back as one, keyed by item.
+
+    poll_interval: seconds between status checks. timeout: give up waiting
+    after this many seconds (None = until the job ends); the job keeps
+    running and a rerun collects it.
+    """
+
+    name = "gemini"
+
+    def __init__(
+        self,
+        client,
+        upload_cache=None,
+        retry_policy=None,
+        upload_workers: int = 8,
+        poll_interval: float = 30.0,
+        timeout: float | None = None,
+    ):
+        self.client = client
+        self.upload_cache = upload_cache
+        self.retry_policy = retry_policy or DEFAULT_RETRY_POLICY
+        self.upload_workers = upload_workers
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+
+    def _upload(self, wav_path: str):
+        return safe_upload(
+            self.client, wav_path, cache=self.upload_cache, retry_policy=self.retry_policy
+        )
+
+    def submit(self, model_name: str, prompt: str, items: list, generation=None, display_name=None) -> str:
+        """
+        Create one job for items [(key, wav_path)]; returns the job name.
+        """
+        config = generation.gemini_config(model_name) if generation is not None else None
+        with ThreadPoolExecutor(max_workers=self.upload_workers) as pool:
+            uploads = list(tqdm(
+                pool.map(self._upload, [wav_path for _, wav_path in items]),
+                total=len(items),
+                desc="Uploading",
+            ))
+
+        def lines():
+            for (key, _), uploaded in zip(items, uploads):
+                request = {
+                    "contents": [{
+                        "role": "user",
+                        "parts": [
+                            {"text": prompt},
+                            {"file_data": {"file_uri": uploaded.uri, "mime_type": uploaded.mime_type}},
+                        ],
+                    }],
+                }
+                if config:
+                    request["generation_config"] = config
+                yield {"key": key, "request": request}
+
+        path = _write_jsonl(lines())
+        try:
+            requests_file = self.retry_policy.call(
+                lambda: self.client.files.upload(file=path, config={"mime_type": "jsonl"}),
+                label="[Batch] requests file",
+            )
+        finally:
+            os.remove(path)
+
+        job = self.retry_policy.call(
+            lambda: self.client.batches.create(
+                model=model_name,
+                src=requests_file.name,
+                config={"display_name": display_name or "gemini-eval"},
+            ),
+            label="[Batch] create",
+        )
+        return job.name
+
+    def _get(self, job_name: str):
+        return self.retry_policy.call(
+            lambda: self.client.batches.get(name=job_name), label="[Batch] status"
+        )
+
+    def state(self, job_name: str) -> str:
+        state = self._get(job_name).state
+        return _GEMINI_STATES.get(getattr(state, "value", state), "running")
+
+    def results(self, job_name: str):
+        """
+        Yields (key, raw_output) per item; "error" for items that failed.
+        """
+        dest = self._get(job_name).dest
+        if dest is None:
+            return
+        if dest.inlined_responses:
+            for i, item in enumerate(dest.inlined_responses):
+                key = (item.metadata or {}).get("key", str(i))
+                text = item.response.text if item.response is not None else None
+                yield key, text.strip().lower() if text else "error"
+            return
+
+        data = self.retry_policy.call(
+            lambda: self.client.files.download(file=dest.file_name), label="[Batch] download"
+        )
+        for line in data.decode("utf-8").splitlines():
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            if "response" in item:
+                yield item["key"], _gemini_text(item["response"])
+            else:
+                print(f"[Batch] {item.get('key')}: {item.get('error')}")
+                yield item["key"], "error"
+
+
+# -------- OpenAI 兼容 Batch API --------
+class OpenAIBatchBackend:
+    """
+    OpenAI-style Batch API (files + batches, endpoint /v1/chat/completions).
+    Audio is inlined as base64 in the request file, as in live requests.
+    """
+
+    name = "openai"
+
+    def __init__(
+        self,
+        client,
+        retry_policy=None,
+        poll_interval: float = 30.0,
+        timeout: float | None = None,
+    ):
+        self.client = client
+        self.retry_policy = retry_policy or DEFAULT_RETRY_POLICY
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+
+    def submit(self, model_name: str, prompt: str, items: list, generation=None, display_name=None) -> str:
+        params = generation.openai_params(model_name) if generation is not None else {}
+        path = _write_jsonl(
+            {
+                "custom_id": key,
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": {
+                    "model": model_name,
+                    "messages": build_audio_messages(prompt, wav_path),
+                    **params,
+                },
+            }
+            for key, wav_path in tqdm(items, desc="Encoding")
+        )
+        try:
+            def upload():
+                with open(path, "rb") as f:
+                    return self.client.files.create(file=f, purpose="batch")
+
+            input_file = self.retry_policy.call(upload, label="[Batch] requests file")
+        finally:
+            os.remove(path)
+
+        batch = self.retry_policy.call(
+            lambda: self.client.batches.create(
+                input_file_id=input_file.id,
+                endpoint="/v1/chat/completions",
+                completion_window="24h",
+                metadata={"description": display_name or "gemini-eval"},
+            ),
+            label="[Batch] create",
+        )
+        return batch.id
+
+    def _get(self, batch_id: str):
+        return self.retry_policy.call(
+            lambda: self.client.batches.retrieve(batch_id), label="[Batch] status"
+        )
+
+    def state(self, batch_id: str) -> str:
+        return _OPENAI_STATES.get(self._get(batch_id).status, "running")
+
+    def results(self, batch_id: str):
+        batch = self._get(batch_id)
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if not file_id:
+                continue
+            content = self.retry_policy.call(
+                lambda: self.client.files.content(file_id), label="[Batch] download"
+            )
+            for line in content.text.splitlines():
+                if not line.strip():
+                    continue
+                item = json.loads(line)
+                response = item.get("response") or {}
+                if response.get("status_code") == 200:
+                    text = response["body"]["choices"][0]["message"]["content"]
+                    yield item["custom_id"], unwrap_answer(text.strip().lower())
+                else:
+                    print(f"[Batch] {item['custom_id']}: {item.get('error') or response.get('body')}")
+                    yield item["custom_id"], "error"
+
+
+def get_batch_backend(backend: str, client, upload_cache=None, retry_policy=None, **kwargs):
+    """
+    Batch backend for a live backend name and its (sync) client; kwargs:
+    poll_interval, timeout (+ upload_workers for gemini).
+    """
+    if backend == "gemini":
+        return GeminiBatchBackend(
+            client, upload_cache=upload_cache, retry_policy=retry_policy, **kwargs
+        )
+    if backend == "openai":
+        return OpenAIBatchBackend(client, retry_policy=retry_policy, **kwargs)
+    raise ValueError(f"No Batch API for backend: {backend}")
+
+
+# -------- 提交 / 等待 / 取回 --------
+def _state_path(output_jsonl: str) -> str:
+    return output_jsonl + ".batch.json"
+
+
+def _load_state(path: str) -> dict | None:
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception:
+        return None
+
+
+def wait_for_job(batch_api, job: str) -> str | None:
+    """
+    Poll until the job ends; returns "done" / "failed", or None once
+    batch_api.timeout has passed.
+    """
+    start = time.monotonic()
+    last = None
+    while True:
+        state = batch_api.state(job)
+        if state != last:
+            print(f"[Batch] {job}: {state} ({time.monotonic() - start:.0f}s)")
+            last = state
+        if state != "running":
+            return state
+        if batch_api.timeout is not None and time.monotonic() - start >= batch_api.timeout:
+            return None
+        time.sleep(batch_api.poll_interval)
+
+
+def run_batch_job(
+    batch_api,
+    model_name: str,
+    prompt: str,
+    items: list,
+    output_jsonl: str,
+    make_result,
+    generation=None,
+    retries: int = 1,
+) -> list:
+    """
+    Evaluate items [(key, wav_path)] as one offline job; each returned item
+    is turned into make_result(key, raw_output) and appended to output_jsonl
+    as it is read back. Returns the new records.
+
+    The job id is kept in <output_jsonl>.batch.json until its results are
+    written, so a run that is interrupted (or hits the backend's timeout)
+    collects the same job on the next call instead of submitting it again;
+    items that job does not cover then go out as a new job. Items that
+    failed inside the job are resubmitted as a follow-up job up to
+    `retries` times before being written as "error"; items the job
+    returned nothing for stay pending for the next run.
+    A saved job for another backend, model or prompt is not collected:
+    its state file is dropped (the job itself is left alone) and the
+    items go out as a new job.
+    """
+    state_path = _state_path(output_jsonl)
+    pending = dict(items)
+    job_of = {"backend": batch_api.name, "model": model_name, "prompt_hash": prompt_hash(prompt)}
+    state = _load_state(state_path)
+    if state is not None and any(state.get(k) != v for k, v in job_of.items()):
+        # 换了模型 / prompt：旧任务的结果不能写进这个输出
+        print(
+            f"[Batch] ignoring saved job {state.get('job')}: it was submitted for "
+            f"{state.get('backend')} / {state.get('model')} / prompt {str(state.get('prompt_hash'))[:12]}"
+        )
+        os.remove(state_path)
+        state = None
+    resumed = state is not None
+
+    if resumed:
+        print(f"[Batch] resuming {state['job']} ({len(state['keys'])} items)")
+    else:
+        if not pending:
+            return []
+        job = batch_api.submit(
+            model_name, prompt, list(pending.items()), generation,
+            display_name=os.path.splitext(os.path.basename(output_jsonl))[0],
+        )
+        state = {**job_of, "job": job, "keys": sorted(pending)}
+        with open(state_path, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        print(f"[Batch] submitted {job} with {len(pending)} items")
+
+    status = wait_for_job(batch_api, state["job"])
+    if status is None:
+        print(f"[Batch] {state['job']} still running; rerun later to collect it.")
+        return []
+
+    records = []
+    failed = set()
+    if status == "failed":
+        print(f"[Batch] {state['job']} failed; its items will be resubmitted on the next run.")
+    else:
+        writer = get_writer(output_jsonl)
+        for key, raw_output in batch_api.results(state["job"]):
+            if key not in pending:
+                continue  # 上次取回时已经写过
+            if raw_output == "error" and retries > 0:
+                failed.add(key)
+                continue
+            record = make_result(key, raw_output)
+            writer.write(record)
+            records.append(record)
+            del pending[key]
+        print(
+            f"[Batch] {len(records)} results written, {len(failed)} failed, "
+            f"{len(pending) - len(failed)} items without a result"
+        )
+    os.remove(state_path)
+
+    covered = set(state["keys"])
+    follow_ups = (
+        ([(k, p) for k, p in items if k in failed], retries - 1),
+        ([(k, p) for k, p in items if resumed and k in pending and k not in covered], retries),
+    )
+    for rest, rest_retries in follow_ups:
+        if rest:
+            records += run_batch_job(
+                batch_api, model_name, prompt, rest, output_jsonl, make_result,
+                generation, rest_retries,
+            )
+    return records
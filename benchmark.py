@@ -0,0 +1,329 @@
+# benchmark.py
+
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+import tracemalloc
+import urllib.request
+import wave
+
+import gemini_gtzan_eval
+import gemini_pop_eval
+from batch_api import get_batch_backend
+from client_registry import get_client
+from concurrency import AdaptiveConcurrency
+from context_cache import ContextCache
+from evaluate import evaluate_style_score_folder
+from generation import SCORE_PROFILE, score_profile
+from mock_server import GTZAN_GENRES, MockConfig, MockServer
+from prompt import build_vocal_style_prompt
+from retry import RetryPolicy
+
+SCENARIOS = (
+    "style-openai", "style-gemini",
+    "style-openai-async", "style-gemini-async",
+    "gtzan", "pop",
+)
+
+# 对着本地 mock 跑，退避时间缩短到毫秒级；重试次数的开销照样体现在统计里
+BENCH_RETRY_POLICY = RetryPolicy(
+    max_attempts=4, base_delay=0.05, quota_delay=0.2, max_delay=2, deadline=60
+)
+
+
+# -------- mock server（独立进程，内存不算进被测进程） --------
+def _serve(config: MockConfig, conn) -> None:
+    server = MockServer(config)
+    conn.send(server.url)
+    server.httpd.serve_forever()
+
+
+def start_mock_server(config: MockConfig):
+    parent, child = multiprocessing.Pipe()
+    process = multiprocessing.Process(target=_serve, args=(config, child), daemon=True)
+    process.start()
+    return process, parent.recv()
+
+
+def _server_call(url: str, path: str, method: str = "GET") -> dict:
+    data = b"{}" if method == "POST" else None
+    with urllib.request.urlopen(urllib.request.Request(url + path, data=data, method=method)) as r:
+        return json.loads(r.read())
+
+
+# -------- 合成数据 --------
+def write_clip(path: str, seconds: float, sample_rate: int = 16000) -> None:
+    with wave.open(path, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(sample_rate)
+        w.writeframes(os.urandom(int(seconds * sample_rate) * 2))
+
+
+def make_dataset(root: str, num_items: int, clip_sec: float) -> dict:
+    """
+    Synthetic clips laid out like the real data: a vocal-style genre folder,
+    a GTZAN folder (genre.xxxxx.wav) and a pop folder + pop_test.jsonl.
+    """
+    style_dir = os.path.join(root, "suno_bench", "rock")
+    gtzan_dir = os.path.join(root, "gtzan_test")
+    pop_dir = os.path.join(root, "pop_test")
+    for d in (style_dir, gtzan_dir, pop_dir):
+        os.makedirs(d, exist_ok=True)
+
+    manifest = os.path.join(root, "pop_test.jsonl")
+    with open(manifest, "w", encoding="utf-8") as f:
+        for i in range(num_items):
+            write_clip(os.path.join(style_dir, f"rock_bench_{i:04d}.wav"), clip_sec)
+            genre = GTZAN_GENRES[i % len(GTZAN_GENRES)]
+            write_clip(os.path.join(gtzan_dir, f"{genre}.{i:05d}.wav"), clip_sec)
+            music = f"pop_{i:04d}.wav"
+            write_clip(os.path.join(pop_dir, music), clip_sec)
+            f.write(json.dumps({"music": music, "genre_id": i % 10 + 1}) + "\n")
+
+    return {"style": style_dir, "gtzan": gtzan_dir, "pop": pop_dir, "pop_jsonl": manifest}
+
+
+# -------- 场景 --------
+def _read_jsonl(path: str) -> list:
+    if not os.path.exists(path):
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _batch_api(backend: str, client, args):
+    # 对着 mock 轮询间隔缩短到 0.2s
+    if not args.offline_batch:
+        return None
+    return get_batch_backend(backend, client, retry_policy=BENCH_RETRY_POLICY, poll_interval=0.2)
+
+
+def _generation(args):
+    if args.stream:
+        # 不带 schema：模型可以在答案后面继续说，靠流式提前关闭
+        return score_profile(schema=False, stream=True)
+    return SCORE_PROFILE if args.generation else None
+
+
+def _context_cache(backend: str, args):
+    # openai 后端没有显式上下文缓存，照常内联
+    if not args.context_cache or backend != "gemini":
+        return None
+    return ContextCache()
+
+
+def run_scenario(name: str, data: dict, out_dir: str, url: str, args) -> list:
+    """
+    Run one scenario from scratch; returns the records it wrote.
+    """
+    output_jsonl = os.path.join(out_dir, f"{name}.jsonl")
+    if os.path.exists(output_jsonl):
+        os.remove(output_jsonl)
+
+    if name.startswith("style-"):
+        backend = name.split("-")[1]
+        use_async = name.endswith("-async")
+        if backend == "openai":
+            client = get_client(
+                "openai_async" if use_async else "openai",
+                api_key="mock",
+                base_url=url + "/v1",
+                pool_size=args.pool_size,
+            )
+        else:
+            client = get_client("gemini", api_key="mock", base_url=url, pool_size=args.pool_size)
+        evaluate_style_score_folder(
+            wav_dir=data["style"],
+            client=client,
+            model_name="gemini-2.5-flash",
+            prompt=build_vocal_style_prompt(genre="rock"),
+            output_jsonl=output_jsonl,
+            backend=backend,
+            max_in_flight=args.max_in_flight,
+            batch_size=1 if use_async else args.batch_size,
+            use_async=use_async,
+            concurrency=(
+                AdaptiveConcurrency(initial=args.max_in_flight, max_limit=args.pool_size)
+                if args.adaptive else None
+            ),
+            retry_policy=BENCH_RETRY_POLICY,
+            generation=_generation(args),
+            batch_api=None if use_async else _batch_api(backend, client, args),
+            context_cache=_context_cache(backend, args),
+        )
+
+    elif name == "gtzan":
+        gemini_gtzan_eval.retry_policy = BENCH_RETRY_POLICY
+        gemini_gtzan_eval.MAX_IN_FLIGHT = args.max_in_flight
+        gemini_gtzan_eval.evaluate_folder(
+            data["gtzan"], output_jsonl,
+            batch_api=_batch_api("gemini", gemini_gtzan_eval.get_gemini(), args),
+        )
+
+    elif name == "pop":
+        gemini_pop_eval.retry_policy = BENCH_RETRY_POLICY
+        gemini_pop_eval.MAX_IN_FLIGHT = args.max_in_flight
+        gemini_pop_eval.rate_limiter = None  # 不限速
+        gemini_pop_eval.evaluate_from_jsonl(
+            data["pop_jsonl"], data["pop"], output_jsonl,
+            batch_api=_batch_api("gemini", gemini_pop_eval.get_gemini(), args),
+        )
+
+    else:
+        raise ValueError(f"Unknown scenario: {name}")
+
+    return _read_jsonl(output_jsonl)
+
+
+def measure(name: str, data: dict, out_dir: str, url: str, args) -> dict:
+    _server_call(url, "/_reset", method="POST")
+    tracemalloc.start()
+    start = time.perf_counter()
+    records = run_scenario(name, data, out_dir, url, args)
+    wall_sec = time.perf_counter() - start
+    _, py_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    server = _server_call(url, "/_stats")
+    model_calls = server["generate"] + server["chat"] + server["batch_items"]
+    retries = sum(r.get("metrics", {}).get("retries", 0) for r in records)
+    return {
+        "scenario": name,
+        "items": len(records),
+        "errors": sum(1 for r in records if r.get("pred") == "error" or r.get("score") == -1),
+        "wall_sec": round(wall_sec, 3),
+        "items_per_sec": round(len(records) / wall_sec, 2) if wall_sec > 0 else 0.0,
+        "py_peak_mb": round(py_peak / 1e6, 2),
+        # ru_maxrss 是整个进程到目前为止的峰值（KB），只增不减
+        "rss_peak_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1e3, 1),
+        "model_calls": model_calls,
+        "uploads": server["uploads"],
+        "injected_429": server["injected_429"],
+        "injected_503": server["injected_503"],
+        "retry_overhead": round(model_calls / len(records) - 1, 3) if records else 0.0,
+        "recorded_retries": retries,
+        "mb_sent": round(server["bytes_in"] / 1e6, 2),
+        "streams_closed_early": server["streams_closed_early"],
+        "cached_requests": server["cached_requests"],
+    }
+
+
+def print_report(rows: list) -> None:
+    columns = [
+        ("scenario", 13), ("items", 6), ("errors", 6), ("items_per_sec", 13),
+        ("py_peak_mb", 10), ("rss_peak_mb", 11), ("model_calls", 11),
+        ("uploads", 7), ("injected_429", 12), ("injected_503", 12),
+        ("retry_overhead", 14), ("mb_sent", 7), ("streams_closed_early", 20),
+        ("cached_requests", 15),
+    ]
+    print("\n" + " ".join(f"{c:>{w}}" for c, w in columns))
+    for row in rows:
+        print(" ".join(f"{row[c]!s:>{w}}" for c, w in columns))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark against a local mock server")
+    parser.add_argument("--scenarios", nargs="+", default=list(SCENARIOS), choices=SCENARIOS)
+    parser.add_argument("--items", type=int, default=40)
+    parser.add_argument("--clip-sec", type=float, default=10.0)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--jitter", type=float, default=0.05)
+    parser.add_argument("--upload-latency", type=float, default=0.05)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--quota-rate", type=float, default=0.0)
+    parser.add_argument("--capacity", type=int, help="mock serves this many model calls at once")
+    parser.add_argument(
+        "--thinking-latency",
+        type=float,
+        default=0.0,
+        help="mock adds this much per call unless thinking is turned off",
+    )
+    parser.add_argument(
+        "--generation",
+        action="store_true",
+        help="style scenarios: send generation.SCORE_PROFILE (no thinking, 1-5 schema)",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="style scenarios: no schema, stream and stop once the score is read",
+    )
+    parser.add_argument("--chatter-words", type=int, default=0, help="mock keeps talking after the answer")
+    parser.add_argument("--chatter-latency", type=float, default=0.0, help="seconds per chatter word")
+    parser.add_argument(
+        "--offline-batch",
+        action="store_true",
+        help="sync scenarios: submit everything as one Batch API job instead of live calls",
+    )
+    parser.add_argument("--batch-latency", type=float, default=1.0, help="mock batch job turnaround")
+    parser.add_argument(
+        "--context-cache",
+        action="store_true",
+        help="gemini style scenarios: cache the prompt once (context_cache.ContextCache)",
+    )
+    parser.add_argument(
+        "--prompt-latency",
+        type=float,
+        default=0.0,
+        help="mock adds this much per 1000 prompt tokens not served from a cache",
+    )
+    parser.add_argument(
+        "--cache-min-tokens", type=int, default=0, help="mock refuses smaller context caches"
+    )
+    parser.add_argument("--max-in-flight", type=int, default=4)
+    parser.add_argument(
+        "--adaptive",
+        action="store_true",
+        help="style scenarios: AIMD concurrency from --max-in-flight up to --pool-size",
+    )
+    parser.add_argument("--batch-size", type=int, default=1)
+    parser.add_argument("--pool-size", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="also write the report rows to this file")
+    args = parser.parse_args()
+
+    config = MockConfig(
+        latency=args.latency,
+        jitter=args.jitter,
+        upload_latency=args.upload_latency,
+        error_rate=args.error_rate,
+        quota_rate=args.quota_rate,
+        seed=args.seed,
+        capacity=args.capacity,
+        thinking_latency=args.thinking_latency,
+        chatter_words=args.chatter_words,
+        chatter_latency=args.chatter_latency,
+        batch_latency=args.batch_latency,
+        prompt_latency=args.prompt_latency,
+        cache_min_tokens=args.cache_min_tokens,
+    )
+    process, url = start_mock_server(config)
+    print(f"Mock server: {url}")
+
+    # 旧脚本（gtzan / pop）自己建 gemini client：用环境变量指到 mock
+    os.environ["GEMINI_API_KEY"] = "mock"
+    os.environ["GOOGLE_GEMINI_BASE_URL"] = url
+
+    rows = []
+    try:
+        with tempfile.TemporaryDirectory(prefix="gemini_bench_") as root:
+            data = make_dataset(root, args.items, args.clip_sec)
+            for name in args.scenarios:
+                print(f"\n=== {name} ===")
+                rows.append(measure(name, data, root, url, args))
+    finally:
+        process.terminate()
+
+    print_report(rows)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(rows, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+# client_registry.py
+
+import inspect
+import threading
+
+import httpx
+from google.genai import types
+
+from gemini_client import init_gemini_client
+from openai_client import init_async_openai_client, init_openai_client
+
+# 连接池默认配置：所有 worker 共用同一批 keep-alive 连接
+POOL_SIZE = 32
+TIMEOUT_SEC = 120.0
+CONNECT_TIMEOUT_SEC = 10.0
+KEEPALIVE_SEC = 60.0
+
+_CLIENTS = {}
+_LOCK = threading.Lock()
+
+
+def _limits(pool_size: int, keepalive_sec: float) -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=pool_size,
+        max_keepalive_connections=pool_size,
+        keepalive_expiry=keepalive_sec,
+    )
+
+
+def _build_gemini(api_key, base_url, pool_size, timeout_sec, connect_timeout_sec, keepalive_sec):
+    timeout_ms = int(timeout_sec * 1000)
+    try:
+        http_options = types.HttpOptions(
+            base_url=base_url,
+            timeout=timeout_ms,
+            client_args={
+                "limits": _limits(pool_size, keepalive_sec),
+                "timeout": httpx.Timeout(timeout_sec, connect=connect_timeout_sec),
+            },
+        )
+    except Exception:
+        # 旧版 google-genai 的 HttpOptions 没有 client_args，只能设超时
+        http_options = types.HttpOptions(base_url=base_url, timeout=timeout_ms)
+    return init_gemini_client(api_key=api_key, http_options=http_options)
+
+
+def _build_openai(api_key, base_url, pool_size, timeout_sec, connect_timeout_sec, keepalive_sec):
+    http_client = httpx.Client(
+        limits=_limits(pool_size, keepalive_sec),
+        timeout=httpx.Timeout(timeout_sec, connect=connect_timeout_sec),
+    )
+    # 重试统一交给 retry.RetryPolicy，SDK 自带的重试关掉，避免叠加
+    return init_openai_client(
+        api_key=api_key,
+        base_url=base_url,
+        http_client=http_client,
+        max_retries=0,
+    )
+
+
+def _build_openai_async(api_key, base_url, pool_size, timeout_sec, connect_timeout_sec, keepalive_sec):
+    limits = _limits(pool_size, keepalive_sec)
+    # 装了 aiohttp 就走 aiohttp：httpx 的异步连接池在几百个并发时 CPU 开销很大
+    # （这条路只接受一个总超时，openai 不同版本的 Timeout 类型不通用）
+    try:
+        from openai import DefaultAioHttpClient
+        http_client = DefaultAioHttpClient(limits=limits, timeout=timeout_sec)
+    except (ImportError, RuntimeError):
+        http_client = httpx.AsyncClient(
+            limits=limits,
+            timeout=httpx.Timeout(timeout_sec, connect=connect_timeout_sec),
+        )
+    return init_async_openai_client(
+        api_key=api_key,
+        base_url=base_url,
+        http_client=http_client,
+        max_retries=0,
+    )
+
+
+def get_client(
+    backend: str,
+    api_key: str | None = None,
+    base_url: str | None = None,
+    pool_size: int = POOL_SIZE,
+    timeout_sec: float = TIMEOUT_SEC,
+    connect_timeout_sec: float = CONNECT_TIMEOUT_SEC,
+    keepalive_sec: float = KEEPALIVE_SEC,
+):
+    """
+    One shared, pooled keep-alive client per (backend, base_url, api_key).
+
+    backend: "gemini" (its .aio serves the async path too), "openai", or
+    "openai_async" (AsyncOpenAI, for the *_async functions; use it from one
+    event loop). The pool settings only apply when the client is first created.
+    api_key / base_url None fall back to the same environment variables
+    as init_gemini_client / init_openai_client (for gemini, base_url None
+    is the public endpoint, or GOOGLE_GEMINI_BASE_URL if set).
+    """
+    cache_key = (backend, base_url, api_key)
+    with _LOCK:
+        client = _CLIENTS.get(cache_key)
+        if client is not None:
+            return client
+
+        if backend == "gemini":
+            client = _build_gemini(
+                api_key, base_url, pool_size, timeout_sec, connect_timeout_sec, keepalive_sec
+            )
+        elif backend == "openai":
+            client = _build_openai(
+                api_key, base_url, pool_size, timeout_sec, connect_timeout_sec, keepalive_sec
+            )
+        elif backend == "openai_async":
+            client = _build_openai_async(
+                api_key, base_url, pool_size, timeout_sec, connect_timeout_sec, keepalive_sec
+            )
+        else:
+            raise ValueError(f"Unknown backend: {backend}")
+
+        _CLIENTS[cache_key] = client
+        return client
+
+
+def close_all_clients() -> None:
+    with _LOCK:
+        clients = list(_CLIENTS.values())
+        _CLIENTS.clear()
+    for client in clients:
+        close = getattr(client, "close", None)
+        # AsyncOpenAI 的 close 要在它自己的事件循环里 await，这里跳过
+        if close is not None and not inspect.iscoroutinefunction(close):
+            close()
+
+
+async def close_async_clients() -> None:
+    """
+    Close the AsyncOpenAI clients; await it on the loop that used them.
+    """
+    with _LOCK:
+        keys = [
+            k for k, c in _CLIENTS.items()
+            if inspect.iscoroutinefunction(getattr(c, "close", None))
+        ]
+        clients = [_CLIENTS.pop(k) for k in keys]
+    for client in clients:
+        await client.close()
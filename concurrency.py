@@ -0,0 +1,199 @@
+# concurrency.py
+
+import asyncio
+import threading
+import time
+from collections import deque
+
+
+class AdaptiveConcurrency:
+    """
+    AIMD limit on requests in flight, driven by what the backend returns.
+
+    Each request that finishes healthy (no 429 / 5xx, latency under target)
+    counts towards one window of `limit` requests; a full window while the
+    limit was actually in use raises the limit by `increase` (additive).
+    A 429 / 5xx cuts it to limit * error_backoff; a latency above target
+    (the backend is queueing) cuts it to limit * latency_backoff. Requests
+    started before the last cut do not cut it again, so one burst of errors
+    counts once.
+
+    latency_target None: latency_tolerance x the lowest smoothed latency
+    seen so far. Every change is logged as "[AIMD] ...".
+
+        concurrency = AdaptiveConcurrency(initial=4, max_limit=64)
+        evaluate_style_score_folder(..., concurrency=concurrency)
+    """
+
+    def __init__(
+        self,
+        initial: int = 4,
+        min_limit: int = 1,
+        max_limit: int = 64,
+        increase: int = 1,
+        error_backoff: float = 0.5,
+        latency_backoff: float = 0.9,
+        latency_target: float | None = None,
+        latency_tolerance: float = 2.0,
+        smoothing: float = 0.3,
+    ):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = min(max(initial, min_limit), max_limit)
+        self.increase = increase
+        self.error_backoff = error_backoff
+        self.latency_backoff = latency_backoff
+        self.latency_target = latency_target
+        self.latency_tolerance = latency_tolerance
+        self.smoothing = smoothing
+
+        self.in_flight = 0
+        self.healthy_in_window = 0
+        self.busy_in_window = False
+        self.last_cut = 0.0
+        self.latency = None   # EWMA
+        self.baseline = None  # 观察到的最低 EWMA
+        self.cond = threading.Condition()
+        self.async_waiters = deque()  # (loop, future)，acquire_async 里排队的协程
+
+    # -------- 占位 / 归还 --------
+    def _take(self) -> float:
+        self.in_flight += 1
+        if self.in_flight >= self.limit:
+            self.busy_in_window = True
+        return time.monotonic()
+
+    def try_acquire(self) -> float | None:
+        """
+        Take a slot if one is free; returns the start time to hand back to
+        release(), or None when the limit is reached.
+        """
+        with self.cond:
+            if self.in_flight >= self.limit:
+                return None
+            return self._take()
+
+    def acquire(self) -> float:
+        with self.cond:
+            while self.in_flight >= self.limit:
+                self.cond.wait()
+            return self._take()
+
+    async def acquire_async(self) -> float:
+        """
+        acquire() for coroutines: waits on a future that release() resolves
+        (through call_soon_threadsafe, so releases from worker threads work
+        too) instead of polling the event loop.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            with self.cond:
+                if self.in_flight < self.limit:
+                    return self._take()
+                waiter = loop.create_future()
+                self.async_waiters.append((loop, waiter))
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                # 被唤醒后又取消：把这次唤醒让给下一个等待者
+                with self.cond:
+                    if (loop, waiter) in self.async_waiters:
+                        self.async_waiters.remove((loop, waiter))
+                    self._wake_async()
+                raise
+            # 被唤醒不代表抢到了槽位（同步 acquire 也在抢）：回到循环再看
+
+    def _wake_async(self) -> None:
+        # 在 self.cond 里调用：有几个空槽就按先来后到唤醒几个协程
+        free = self.limit - self.in_flight
+        while free > 0 and self.async_waiters:
+            loop, waiter = self.async_waiters.popleft()
+            if loop.is_closed():
+                continue
+            loop.call_soon_threadsafe(_resolve, waiter)
+            free -= 1
+
+    def release(self, started: float, throttled: bool = False, latency: float | None = None) -> None:
+        """
+        Hand back a slot. throttled: the request hit a 429 / 5xx (even if a
+        retry then succeeded). latency: seconds of one model call, or None
+        when there is nothing to judge (cache hit, local error).
+        """
+        with self.cond:
+            self.in_flight -= 1
+            if throttled:
+                self._cut(started, self.error_backoff, "429/5xx from backend")
+            elif latency is not None:
+                self._observe_latency(started, latency)
+            self.cond.notify_all()
+            self._wake_async()
+
+    # -------- AIMD --------
+    def target(self) -> float | None:
+        if self.latency_target is not None:
+            return self.latency_target
+        if self.baseline is None:
+            return None
+        return self.baseline * self.latency_tolerance
+
+    def _observe_latency(self, started: float, latency: float) -> None:
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency += self.smoothing * (latency - self.latency)
+        self.baseline = self.latency if self.baseline is None else min(self.baseline, self.latency)
+
+        target = self.target()
+        if target is not None and self.latency > target:
+            self._cut(
+                started,
+                self.latency_backoff,
+                f"latency {self.latency:.2f}s over target {target:.2f}s",
+            )
+            return
+
+        self.healthy_in_window += 1
+        if self.healthy_in_window < self.limit:
+            return
+        # 一整个窗口都健康：只有上限真的被用满过才加，否则加了也没意义
+        if self.busy_in_window and self.limit < self.max_limit:
+            old = self.limit
+            self.limit = min(self.max_limit, self.limit + self.increase)
+            latency_note = f"latency {self.latency:.2f}s" + (
+                f" / target {target:.2f}s" if target is not None else ""
+            )
+            print(f"[AIMD] in-flight limit {old} -> {self.limit} ({latency_note})")
+        self.healthy_in_window = 0
+        self.busy_in_window = self.in_flight >= self.limit
+
+    def _cut(self, started: float, factor: float, reason: str) -> None:
+        if started < self.last_cut:
+            return  # 上次降之前发出的请求，不重复惩罚
+        old = self.limit
+        self.limit = max(self.min_limit, int(self.limit * factor))
+        self.last_cut = time.monotonic()
+        self.healthy_in_window = 0
+        self.busy_in_window = False
+        if self.limit != old:
+            print(f"[AIMD] in-flight limit {old} -> {self.limit} ({reason})")
+
+
+def _resolve(waiter) -> None:
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+def release_for_results(concurrency: AdaptiveConcurrency, started: float, results) -> None:
+    """
+    release() from the result dict(s) a task returned, using their "metrics":
+    any throttled count marks the request throttled; latency is the model
+    time of a request that needed no retry.
+    """
+    records = results if isinstance(results, list) else [results]
+    measured = [
+        r["metrics"] for r in records
+        if isinstance(r, dict) and r.get("metrics") and not r["metrics"].get("cache_hit")
+    ]
+    throttled = any(m.get("throttled") for m in measured)
+    latencies = [m["model_sec"] for m in measured if m.get("model_sec") and not m.get("retries")]
+    concurrency.release(started, throttled=throttled, latency=max(latencies) if latencies else None)
@@ -0,0 +1,135 @@
+# context_cache.py
+
+import asyncio
+import datetime
+import threading
+
+from prompt_registry import prompt_hash
+from retry import BAD_INPUT, classify_error
+
+# 不能建缓存时（prompt 太短、模型不支持）之后一直内联发送
+_NEVER = datetime.datetime.max.replace(tzinfo=datetime.timezone.utc)
+
+
+def _now() -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+class ContextCache:
+    """
+    Gemini context caches (client.caches) for the prompt every request of a
+    folder shares, one per (client, model, prompt hash). Requests then
+    reference the cache by name and send only the audio.
+
+    Caches belong to the API key / project that created them, so entries
+    are kept per client and one ContextCache can serve several endpoints
+    (router.Router) without handing one key's cache to another. Each cache lives ttl_sec and is extended while still in use once
+    less than refresh_margin_sec is left; unused ones simply expire. When a
+    cache cannot be created (prompt below the model's minimum cacheable
+    size, model without caching, ...) that (model, prompt) is sent inline
+    from then on; other failures are retried after retry_after_sec.
+    """
+
+    def __init__(self, ttl_sec: int = 900, refresh_margin_sec: int = 120, retry_after_sec: int = 300):
+        self.ttl_sec = ttl_sec
+        self.refresh_margin = datetime.timedelta(seconds=refresh_margin_sec)
+        self.retry_after = datetime.timedelta(seconds=retry_after_sec)
+        self.lock = threading.Lock()
+        self.entries = {}       # (client, model, prompt hash) -> {"name", "expire_time"}
+        self.inline_until = {}  # (client, model, prompt hash) -> 这个时间之前直接内联
+        self.rejected = {}      # (client, model, prompt hash) -> 请求被拒的次数
+        self.key_locks = {}
+
+    @staticmethod
+    def _key(client, model_name: str, prompt: str) -> tuple:
+        # 缓存属于建它的 key / project：不同 client 各自一份
+        return (id(client), model_name, prompt_hash(prompt))
+
+    def _fresh(self, key, now) -> str | None:
+        entry = self.entries.get(key)
+        if entry is not None and entry["expire_time"] - self.refresh_margin > now:
+            return entry["name"]
+        return None
+
+    def lookup(self, client, model_name: str, prompt: str) -> str | None:
+        """
+        Name of a live cache holding `prompt` for model_name, created or
+        extended as needed; None means send the prompt inline.
+        """
+        key = self._key(client, model_name, prompt)
+        now = _now()
+        with self.lock:
+            if self.inline_until.get(key, now) > now:
+                return None
+            name = self._fresh(key, now)
+            if name is not None:
+                return name
+            key_lock = self.key_locks.setdefault(key, threading.Lock())
+
+        # 同一个 prompt 只让一个线程去建 / 续期，其余等它的结果
+        with key_lock:
+            with self.lock:
+                if self.inline_until.get(key, now) > now:
+                    return None
+                name = self._fresh(key, now)
+                entry = self.entries.get(key)
+            if name is not None:
+                return name
+            try:
+                cached = self._refresh(client, entry, now)
+                if cached is None:
+                    cached = client.caches.create(
+                        model=model_name,
+                        config={
+                            "contents": [prompt],
+                            "ttl": f"{self.ttl_sec}s",
+                            "display_name": f"prompt-{key[2][:12]}",
+                        },
+                    )
+            except Exception as e:
+                self._fall_back(key, e)
+                return None
+
+            expires = cached.expire_time or now + datetime.timedelta(seconds=self.ttl_sec)
+            if expires.tzinfo is None:
+                expires = expires.replace(tzinfo=datetime.timezone.utc)
+            with self.lock:
+                self.entries[key] = {"name": cached.name, "expire_time": expires}
+            return cached.name
+
+    async def lookup_async(self, client, model_name: str, prompt: str) -> str | None:
+        # 只有建 / 续期时才真的发请求，放到线程里做
+        return await asyncio.to_thread(self.lookup, client, model_name, prompt)
+
+    def _refresh(self, client, entry, now):
+        # 还没过期：延长 TTL；已过期或续期失败（被删了）：返回 None 重新建
+        if entry is None or entry["expire_time"] <= now:
+            return None
+        try:
+            return client.caches.update(name=entry["name"], config={"ttl": f"{self.ttl_sec}s"})
+        except Exception as e:
+            print(f"[ContextCache] could not extend {entry['name']}, recreating: {e}")
+            return None
+
+    def _fall_back(self, key, e) -> None:
+        permanent = classify_error(e) == BAD_INPUT
+        with self.lock:
+            self.entries.pop(key, None)
+            self.inline_until[key] = _NEVER if permanent else _now() + self.retry_after
+        print(
+            f"[ContextCache] no cache for {key[1]} / prompt {key[2][:12]}, "
+            f"sending it inline{'' if permanent else ' for now'}: {e}"
+        )
+
+    def invalidate(self, client, model_name: str, prompt: str) -> None:
+        """
+        A request naming the cache was rejected (deleted / expired early):
+        drop it so the next lookup creates a new one; a second rejection
+        switches this (client, model, prompt) to inline prompts.
+        """
+        key = self._key(client, model_name, prompt)
+        with self.lock:
+            self.entries.pop(key, None)
+            self.rejected[key] = self.rejected.get(key, 0) + 1
+            if self.rejected[key] >= 2:
+                self.inline_until[key] = _NEVER
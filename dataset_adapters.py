@@ -0,0 +1,110 @@
+# dataset_adapters.py
+
+import json
+import os
+from dataclasses import dataclass
+
+AUDIO_EXTENSIONS = (".wav", ".mp3")
+
+
+@dataclass(frozen=True)
+class DatasetItem:
+    key: str                 # 结果 jsonl 里的 key（文件名去掉扩展名）
+    path: str
+    true: str | None = None  # 标签，和模型答案同样的写法（小写 genre / "3"）
+
+
+def _clip_key(file_name: str) -> str:
+    return os.path.splitext(file_name)[0]
+
+
+def record_key(record: dict) -> str | None:
+    """
+    Key of a result record. Old pop result files store the file name
+    (with extension) under "music" instead.
+    """
+    if "key" in record:
+        return record["key"]
+    if "music" in record:
+        return _clip_key(record["music"])
+    return None
+
+
+class ClipFolder:
+    """
+    A flat folder of unlabelled clips (e.g. samples_for_gemini/suno_visinger2/rock).
+    """
+
+    def __init__(self, wav_dir: str):
+        self.wav_dir = wav_dir
+
+    def items(self) -> list:
+        return [
+            DatasetItem(_clip_key(f), os.path.join(self.wav_dir, f))
+            for f in sorted(os.listdir(self.wav_dir))
+            if f.endswith(AUDIO_EXTENSIONS)
+        ]
+
+
+class GenreFolderDataset:
+    """
+    One sub-folder per genre: root/<genre>/<clip>.wav, labelled with the
+    lowercased folder name.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def items(self) -> list:
+        items = []
+        for genre in sorted(os.listdir(self.root)):
+            genre_dir = os.path.join(self.root, genre)
+            if not os.path.isdir(genre_dir):
+                continue
+            items += [
+                DatasetItem(item.key, item.path, genre.lower())
+                for item in ClipFolder(genre_dir).items()
+            ]
+        return items
+
+
+class GTZANDataset:
+    """
+    GTZAN layout: one folder of genre.xxxxx.wav, labelled with the part of
+    the name before the first dot.
+    """
+
+    def __init__(self, wav_dir: str):
+        self.wav_dir = wav_dir
+
+    def items(self) -> list:
+        return [
+            DatasetItem(item.key, item.path, item.key.split(".")[0].lower())
+            for item in ClipFolder(self.wav_dir).items()
+        ]
+
+
+class PopManifestDataset:
+    """
+    pop_test.jsonl manifest: one {"music": file name, "genre_id": 1..10}
+    per line, clips in audio_folder; labelled with str(genre_id). Entries
+    whose file is missing are reported and skipped.
+    """
+
+    def __init__(self, manifest: str, audio_folder: str):
+        self.manifest = manifest
+        self.audio_folder = audio_folder
+
+    def items(self) -> list:
+        items = []
+        with open(self.manifest, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                path = os.path.join(self.audio_folder, entry["music"])
+                if not os.path.exists(path):
+                    print(f"⚠️ Missing file: {path}")
+                    continue
+                items.append(DatasetItem(_clip_key(entry["music"]), path, str(entry["genre_id"])))
+        return items
@@ -2,11 +2,30 @@
 
 import os
 import json
+import asyncio
+import atexit
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from tqdm import tqdm
-from task import run_audio_task
+from batch_api import run_batch_job
+from client_registry import close_async_clients
+from concurrency import release_for_results
+from dataset_adapters import ClipFolder, GenreFolderDataset, record_key
+from hash_utils import in_shard
+from metrics import print_summary, summarize
+from prompt_registry import prompt_hash
+from rate_limiter import DailyQuotaExceeded
+from result_writer import close_writer
+from preprocess import preprocess_audio
+from task import build_result, run_audio_batch_task, run_audio_task_async
 
 
 def load_existing_results(jsonl_path: str) -> dict:
+    """
+    {key: record} from a result jsonl; unparseable lines (e.g. a line cut
+    short by a crash) are skipped and will be re-evaluated.
+    """
     results = {}
     if not os.path.exists(jsonl_path):
         return results
@@ -15,63 +34,329 @@ def load_existing_results(jsonl_path: str) -> dict:
         for line in f:
             try:
                 data = json.loads(line)
-                results[data["key"]] = data
+                results[record_key(data)] = data
             except Exception:
                 continue
     return results
 
 
-def evaluate_folder(
-    wav_dir: str,
+def run_tasks(fn, tasks: list, max_in_flight: int = 1, desc: str = "", concurrency=None):
+    """
+    Run fn(*args) for every args tuple in tasks, yielding results as they finish.
+
+    max_in_flight <= 1 keeps the original sequential loop; otherwise a thread
+    pool holds at most max_in_flight requests in flight at once.
+    concurrency: optional concurrency.AdaptiveConcurrency; it then decides
+    how many run at once (up to its max_limit) from the "metrics" of the
+    result dicts fn returns, and max_in_flight is ignored.
+    """
+    if concurrency is not None:
+        max_in_flight = concurrency.max_limit
+        inner = fn
+
+        def fn(*args):
+            started = concurrency.acquire()
+            results = None
+            try:
+                results = inner(*args)
+                return results
+            finally:
+                release_for_results(concurrency, started, results)
+
+    if max_in_flight <= 1:
+        for args in tqdm(tasks, desc=desc):
+            yield fn(*args)
+        return
+
+    with ThreadPoolExecutor(max_workers=max_in_flight) as pool:
+        futures = [pool.submit(fn, *args) for args in tasks]
+        try:
+            for future in tqdm(as_completed(futures), total=len(futures), desc=desc):
+                yield future.result()
+        finally:
+            # 出错或提前停止时，不再启动尚未开始的任务
+            for future in futures:
+                future.cancel()
+
+
+_LOOP = None
+
+
+def run_async(coro):
+    """
+    Run coro on one process-wide event loop. The loop is kept open between
+    calls: pooled async connections (AsyncOpenAI, genai client.aio) are bound
+    to the loop that opened them and break under a fresh asyncio.run().
+    """
+    global _LOOP
+    if _LOOP is None or _LOOP.is_closed():
+        _LOOP = asyncio.new_event_loop()
+    return _LOOP.run_until_complete(coro)
+
+
+@atexit.register
+def _close_loop() -> None:
+    # 异步 client 的连接只能在自己的循环里关
+    if _LOOP is not None and not _LOOP.is_closed():
+        _LOOP.run_until_complete(close_async_clients())
+        _LOOP.close()
+
+
+async def run_tasks_async(fn, tasks: list, max_in_flight: int = 1, desc: str = "", concurrency=None):
+    """
+    Async counterpart of run_tasks for a coroutine function: at most
+    max_in_flight calls (or concurrency's current limit) are awaited at
+    once, all on the event loop thread.
+    """
+    limit = asyncio.Semaphore(max(max_in_flight, 1))
+
+    async def guarded(args):
+        if concurrency is not None:
+            started = await concurrency.acquire_async()
+            results = None
+            try:
+                results = await fn(*args)
+                return results
+            finally:
+                release_for_results(concurrency, started, results)
+        async with limit:
+            return await fn(*args)
+
+    futures = [asyncio.ensure_future(guarded(args)) for args in tasks]
+    try:
+        for future in tqdm(asyncio.as_completed(futures), total=len(futures), desc=desc):
+            yield await future
+    finally:
+        for future in futures:
+            future.cancel()
+
+
+def _run_items(
+    items: list,
+    task_type: str,
     client,
     model_name: str,
     prompt: str,
     output_jsonl: str,
-) -> float:
-    existing_results = load_existing_results(output_jsonl)
+    backend: str,
+    max_in_flight: int,
+    batch_size: int,
+    use_async: bool,
+    concurrency,
+    batch_api,
+    result_store,
+    store_meta: dict,
+    task_kwargs: dict,
+) -> list:
+    """
+    Evaluate dataset_adapters.DatasetItems as live requests (thread pool,
+    multi-clip batches or asyncio) or as one offline Batch API job. Each
+    result is appended to output_jsonl (and result_store) as it finishes;
+    request metrics are printed at the end. Returns the new records.
+    """
+    run = os.path.splitext(os.path.basename(output_jsonl))[0]
+    true_labels = {item.key: item.true for item in items}
+    quota_hit = threading.Event()
+    batches = [
+        (items[i:i + batch_size],) for i in range(0, len(items), max(batch_size, 1))
+    ]
 
-    tasks = []
-    for genre_folder in os.listdir(wav_dir):
-        genre_path = os.path.join(wav_dir, genre_folder)
-        if not os.path.isdir(genre_path):
-            continue
+    def run_batch(batch):
+        if quota_hit.is_set():
+            return []
+        try:
+            return run_audio_batch_task(
+                backend=backend,
+                client=client,
+                model_name=model_name,
+                prompt=prompt,
+                wav_paths=[item.path for item in batch],
+                output_jsonl=output_jsonl,
+                true_labels=[item.true for item in batch],
+                task_type=task_type,
+                **task_kwargs,
+            )
+        except DailyQuotaExceeded as e:
+            if not quota_hit.is_set():
+                quota_hit.set()
+                print(f"\n[Quota] {e}; stopping, rerun later to resume.")
+            return []
 
-        true_genre = genre_folder.lower()
-        for file in os.listdir(genre_path):
-            if not file.endswith((".wav", ".mp3")):
-                continue
+    async def run_one(item):
+        if quota_hit.is_set():
+            return []
+        try:
+            result = await run_audio_task_async(
+                backend=backend,
+                client=client,
+                model_name=model_name,
+                prompt=prompt,
+                wav_path=item.path,
+                output_jsonl=output_jsonl,
+                true_label=item.true,
+                task_type=task_type,
+                **task_kwargs,
+            )
+        except DailyQuotaExceeded as e:
+            if not quota_hit.is_set():
+                quota_hit.set()
+                print(f"\n[Quota] {e}; stopping, rerun later to resume.")
+            return []
+        return [result]
 
-            key = os.path.splitext(file)[0]
-            if key in existing_results:
-                continue
+    new_results = []
+    src_bytes = sent_bytes = 0
+
+    def collect_results(batch_results):
+        nonlocal src_bytes, sent_bytes
+        if result_store is not None and batch_results:
+            result_store.put_many(run, batch_results, **store_meta)
+        new_results.extend(batch_results)
+        for res in batch_results:
+            if "preprocess" in res:
+                src_bytes += res["preprocess"]["src_bytes"]
+                sent_bytes += res["preprocess"]["sent_bytes"]
+
+    async def run_all_async():
+        async for batch_results in run_tasks_async(
+            run_one,
+            [(item,) for item in items],
+            max_in_flight,
+            desc="Evaluating",
+            concurrency=concurrency,
+        ):
+            collect_results(batch_results)
 
-            wav_path = os.path.join(genre_path, file)
-            tasks.append((wav_path, true_genre))
-
-    correct = 0
-    for wav_path, true_genre in tqdm(tasks, desc="Classifying"):
-        res = classify_genre_task(
-            client=client,
-            model_name=model_name,
-            prompt=prompt,
-            wav_path=wav_path,
-            true_genre=true_genre,
-            output_jsonl=output_jsonl,
+    def run_offline():
+        preprocess = task_kwargs.get("preprocess")
+        return run_batch_job(
+            batch_api,
+            model_name,
+            prompt,
+            [
+                (item.key, preprocess_audio(item.path, preprocess)[0] if preprocess else item.path)
+                for item in items
+            ],
+            output_jsonl,
+            lambda key, raw_output: build_result(key, raw_output, task_type, true_labels[key]),
+            generation=task_kwargs.get("generation"),
         )
-        if res["pred"] == res["true"]:
-            correct += 1
 
-    total_preds = len(existing_results) + len(tasks)
-    total_correct = (
-        sum(1 for r in existing_results.values() if r["pred"] == r["true"])
-        + correct
+    start = time.perf_counter()
+    if batch_api is not None:
+        collect_results(run_offline())
+    elif use_async:
+        if batch_size > 1:
+            raise ValueError("use_async does not support batch_size > 1")
+        run_async(run_all_async())
+    else:
+        for batch_results in run_tasks(
+            run_batch, batches, max_in_flight, desc="Evaluating", concurrency=concurrency
+        ):
+            collect_results(batch_results)
+
+    wall_sec = time.perf_counter() - start
+
+    close_writer(output_jsonl)
+    if result_store is not None and os.path.exists(output_jsonl):
+        result_store.mark_synced(run, output_jsonl)
+
+    if new_results:
+        print_summary(summarize(new_results, wall_sec))
+
+    if src_bytes > 0:
+        print(
+            f"\nPreprocess: sent {sent_bytes / 1e6:.1f} MB "
+            f"of {src_bytes / 1e6:.1f} MB ({1 - sent_bytes / src_bytes:.0%} smaller)"
+        )
+
+    return new_results
+
+
+def _load_done(output_jsonl: str, result_store, store_meta: dict):
+    # 已有结果（断点存续）：有索引库时只查 key，否则读整个 jsonl
+    # "pred": "error" 的条目不算完成，重跑时再请求（同 key 的新结果追加在后面，读取时覆盖旧的）
+    run = os.path.splitext(os.path.basename(output_jsonl))[0]
+    if result_store is not None:
+        result_store.sync_jsonl(run, output_jsonl, **store_meta)
+        return result_store.done_keys(run)
+    return {
+        key: record for key, record in load_existing_results(output_jsonl).items()
+        if record.get("pred") != "error"
+    }
+
+
+def evaluate_dataset(
+    dataset,
+    client,
+    model_name: str,
+    prompt: str,
+    output_jsonl: str,
+    backend: str = "gemini",
+    max_in_flight: int = 1,
+    batch_size: int = 1,
+    result_store=None,
+    genre: str | None = None,
+    use_async: bool = False,
+    shard: tuple | None = None,
+    concurrency=None,
+    batch_api=None,
+    **task_kwargs,
+) -> float:
+    """
+    Genre classification over a labelled dataset adapter (dataset_adapters:
+    GenreFolderDataset, GTZANDataset, PopManifestDataset, ...). Same
+    arguments, resume and concurrency / batching / async / offline modes
+    as evaluate_style_score_folder; results are {"key", "true", "pred"}.
+
+    Returns:
+        accuracy over all (existing + new) labelled results (float)
+    """
+    run = os.path.splitext(os.path.basename(output_jsonl))[0]
+    store_meta = {"model": model_name, "prompt_hash": prompt_hash(prompt), "genre": genre}
+    existing_results = _load_done(output_jsonl, result_store, store_meta)
+
+    items = [
+        item for item in dataset.items()
+        if item.key not in existing_results and in_shard(item.key, shard)
+    ]
+    new_results = _run_items(
+        items, "classification", client, model_name, prompt, output_jsonl, backend,
+        max_in_flight, batch_size, use_async, concurrency, batch_api, result_store,
+        store_meta, task_kwargs,
     )
 
-    acc = total_correct / total_preds if total_preds > 0 else 0.0
-    print(f"\nTotal: {total_preds}, Correct: {total_correct}, Accuracy: {acc:.2%}")
+    if result_store is not None:
+        stats = result_store.stats(run)
+        total, correct = stats["labelled"], stats["correct"]
+    else:
+        # 旧的 pop 结果 true 是数字：统一按字符串比较
+        records = list(existing_results.values()) + new_results
+        labelled = [r for r in records if r.get("true") is not None and r.get("pred") is not None]
+        total = len(labelled)
+        correct = sum(1 for r in labelled if str(r["pred"]) == str(r["true"]))
 
+    acc = correct / total if total > 0 else 0.0
+    print(f"\nTotal: {total}, Correct: {correct}, Accuracy: {acc:.2%}")
     return acc
 
+
+def evaluate_folder(
+    wav_dir: str,
+    client,
+    model_name: str,
+    prompt: str,
+    output_jsonl: str,
+    **kwargs,
+) -> float:
+    """
+    Genre classification of wav_dir/<genre>/<clip>.wav (the folder name is
+    the label); kwargs as for evaluate_dataset.
+    """
+    return evaluate_dataset(
+        GenreFolderDataset(wav_dir), client, model_name, prompt, output_jsonl, **kwargs
+    )
+
 '''
 jsonl 数据格式（隐含约定）
 
@@ -82,6 +367,7 @@ jsonl 数据格式（隐含约定）
   "score": 4
 }
 '''
+
 def evaluate_style_score_folder(
     wav_dir: str,
     client,
@@ -89,65 +375,91 @@ def evaluate_style_score_folder(
     prompt: str,
     output_jsonl: str,
     backend: str = "gemini",
+    max_in_flight: int = 1,
+    batch_size: int = 1,
+    result_store=None,
+    genre: str | None = None,
+    use_async: bool = False,
+    shard: tuple | None = None,
+    concurrency=None,
+    batch_api=None,
+    **task_kwargs,
 ) -> float:
     """
     Evaluate vocal-style score for all wav files in a folder.
     Supports resume from existing jsonl results.
 
+    result_store: optional result_store.ResultStore. The jsonl is imported
+    into it only when the file changed since the last run; resume checks
+    and totals then come from the index instead of re-parsing the jsonl.
+    Rows are tagged with model_name, the prompt hash and `genre`.
+
+    max_in_flight > 1 scores files concurrently; each result is still
+    appended to output_jsonl as soon as it finishes.
+    batch_size > 1 packs that many clips into one model request
+    (run_audio_batch_task); unparseable answers fall back to single calls.
+    use_async runs the requests as coroutines on one event loop
+    (run_audio_task_async), so max_in_flight can be in the hundreds without
+    a thread each; the client must then be async-capable (a genai.Client,
+    or get_client("openai_async")). Not combinable with batch_size > 1.
+    concurrency: optional concurrency.AdaptiveConcurrency that replaces the
+    fixed max_in_flight, growing / shrinking it from latency and 429 / 5xx.
+    shard: optional (index, num_shards); only files whose key hashes to
+    that shard are evaluated (see shard.py for running and merging shards).
+    batch_api: optional batch_api backend (get_batch_backend); all pending
+    files then go out as ONE offline Batch API job instead of live requests
+    (see batch_api.run_batch_job; rate_limiter / response_cache unused).
+    task_kwargs (preprocess, rate_limiter, upload_cache, response_cache, ...)
+    are passed to run_audio_task.
+    Latency percentiles / throughput of the new requests are printed at the end.
+    When a rate_limiter's daily budget runs out the run stops early; the
+    remaining files are picked up on resume.
+
     Returns:
         mean_score (float)
     """
 
     # 1. 读取已有结果（断点存续）
-    existing_results = load_existing_results(output_jsonl)
+    run = os.path.splitext(os.path.basename(output_jsonl))[0]
+    store_meta = {"model": model_name, "prompt_hash": prompt_hash(prompt), "genre": genre}
+    existing_results = _load_done(output_jsonl, result_store, store_meta)
 
     # 2. 构建待评测任务
-    tasks = []
-    for fname in sorted(os.listdir(wav_dir)):
-        if not fname.endswith((".wav", ".mp3")):
-            continue
-
-        key = os.path.splitext(fname)[0]
-        if key in existing_results:
-            continue
-
-        wav_path = os.path.join(wav_dir, fname)
-        tasks.append((key, wav_path))
-
-    # 3. 执行新的评测
-    new_scores = []
-    for key, wav_path in tqdm(tasks, desc="Scoring"):
-        res = run_audio_task(
-            backend=backend,
-            client=client,
-            model_name=model_name,
-            prompt=prompt,
-            wav_path=wav_path,
-            output_jsonl=output_jsonl,
-            task_type="score",
-        )
+    items = [
+        item for item in ClipFolder(wav_dir).items()
+        if item.key not in existing_results and in_shard(item.key, shard)
+    ]
 
-        score = res.get("score", -1)
-        if score > 0:
-            new_scores.append(score)
+    # 3. 执行新的评测（可并发 / 可批量 / 异步 / 离线 batch）
+    new_results = _run_items(
+        items, "score", client, model_name, prompt, output_jsonl, backend,
+        max_in_flight, batch_size, use_async, concurrency, batch_api, result_store,
+        store_meta, task_kwargs,
+    )
+    new_scores = [r["score"] for r in new_results if r.get("score", -1) > 0]
 
     # 4. 统计所有（已有 + 新算）的 score
-    all_scores = []
+    if result_store is not None:
+        stats = result_store.stats(run)
+        num_scored, mean_score = stats["scored"], stats["mean_score"]
+    else:
+        all_scores = []
 
-    for r in existing_results.values():
-        s = r.get("score", -1)
-        if isinstance(s, (int, float)) and s > 0:
-            all_scores.append(s)
+        for r in existing_results.values():
+            s = r.get("score", -1)
+            if isinstance(s, (int, float)) and s > 0:
+                all_scores.append(s)
 
-    all_scores.extend(new_scores)
+        all_scores.extend(new_scores)
 
-    if len(all_scores) == 0:
-        mean_score = 0.0
-    else:
-        mean_score = sum(all_scores) / len(all_scores)
+        num_scored = len(all_scores)
+        if num_scored == 0:
+            mean_score = 0.0
+        else:
+            mean_score = sum(all_scores) / num_scored
 
     print(
-        f"\nTotal files: {len(all_scores)}, "
+        f"\nTotal files: {num_scored}, "
         f"Mean vocal-style score: {mean_score:.1f}"
     )
 
@@ -1,28 +1,321 @@
 # gemini_client.py
 
+import asyncio
 import os
-import time
 from google import genai
-from google.genai.errors import ServerError
+from google.genai.errors import ClientError
+from hash_utils import file_sha256
+from metrics import record, timed
+from rate_limiter import DailyQuotaExceeded
+from retry import BAD_INPUT, DEFAULT_RETRY_POLICY, TRANSIENT, classify_error
 
 
-def init_gemini_client(api_key: str | None = None):
+class StaleUploadError(RuntimeError):
+    """A cached upload was rejected by the server; retry with a fresh upload."""
+
+    retry_kind = TRANSIENT
+
+
+class StaleContextError(RuntimeError):
+    """A cached prompt was rejected by the server; retry without it."""
+
+    retry_kind = TRANSIENT
+
+
+def init_gemini_client(api_key: str | None = None, http_options=None):
     if api_key is None:
         api_key = os.environ.get("GEMINI_API_KEY")
     if not api_key:
         raise RuntimeError("GEMINI_API_KEY is not set")
 
-    return genai.Client(api_key=api_key)
+    return genai.Client(api_key=api_key, http_options=http_options)
+
+
+def upload_file(client, file_path: str, cache=None, digest: str | None = None):
+    """
+    Upload a file once (no retries), reusing a still-valid handle from
+    `cache` (UploadCache) when the same content was uploaded before.
+    Returns (uploaded, from_cache).
+    """
+    if cache is not None:
+        if digest is None:
+            digest = file_sha256(file_path)
+        cached = cache.get(digest)
+        if cached is not None:
+            return cached, True
+
+    with timed("upload_sec"):
+        uploaded = client.files.upload(file=file_path)
+    record(input_bytes=os.path.getsize(file_path))
+    if cache is not None:
+        cache.put(digest, uploaded)
+    return uploaded, False
+
+
+async def upload_file_async(client, file_path: str, cache=None, digest: str | None = None):
+    """
+    upload_file through the SDK's async interface (client.aio).
+    """
+    if cache is not None:
+        if digest is None:
+            digest = await asyncio.to_thread(file_sha256, file_path)
+        cached = cache.get(digest)
+        if cached is not None:
+            return cached, True
+
+    with timed("upload_sec"):
+        uploaded = await client.aio.files.upload(file=file_path)
+    record(input_bytes=os.path.getsize(file_path))
+    if cache is not None:
+        cache.put(digest, uploaded)
+    return uploaded, False
+
+
+def safe_upload(client, file_path: str, cache=None, digest: str | None = None, retry_policy=None):
+    """
+    upload_file with retries according to `retry_policy`.
+    """
+    policy = retry_policy or DEFAULT_RETRY_POLICY
+    uploaded, _ = policy.call(
+        lambda: upload_file(client, file_path, cache=cache, digest=digest),
+        label="[Upload]",
+    )
+    return uploaded
+
+
+def _build_contents(prompt: str | None, uploaded_files: list, labelled: bool) -> list:
+    # prompt 为 None：已在上下文缓存里，只发音频
+    contents = [] if prompt is None else [prompt]
+    if not labelled:
+        return contents + list(uploaded_files)
+
+    for i, uploaded in enumerate(uploaded_files, start=1):
+        contents += [f"Clip {i}:", uploaded]
+    return contents
+
+
+def _drop_stale_uploads(e, uploaded, from_cache, digests, upload_cache) -> None:
+    # 缓存里的文件可能已被服务端删除：作废后重新上传
+    if not any(from_cache) or classify_error(e) != BAD_INPUT:
+        raise e
+    for i, digest in enumerate(digests):
+        if from_cache[i]:
+            upload_cache.invalidate(digest)
+            uploaded[i], from_cache[i] = None, False
+    raise StaleUploadError(f"cached upload rejected: {e}") from e
+
+
+def _drop_stale_context(e, cache_name, context_cache, client, model_name, prompt) -> None:
+    # 上下文缓存可能已过期 / 被删：作废后重试（重新建，或改回内联 prompt）
+    if cache_name is not None and classify_error(e) == BAD_INPUT:
+        context_cache.invalidate(client, model_name, prompt)
+        raise StaleContextError(f"cached prompt {cache_name} rejected: {e}") from e
+
+
+def _request_config(config, cache_name):
+    if cache_name is None:
+        return config
+    return {**(config or {}), "cached_content": cache_name}
+
+
+def _record_usage(response) -> None:
+    usage = getattr(response, "usage_metadata", None)
+    if usage is not None:
+        record(
+            prompt_tokens=usage.prompt_token_count or 0,
+            output_tokens=usage.candidates_token_count or 0,
+            cached_tokens=usage.cached_content_token_count or 0,
+        )
+
+
+def _response_text(response) -> str:
+    _record_usage(response)
+    if response.text is None:
+        # 思考把输出额度用完 / 被安全过滤：重试也一样，当作无效回答
+        candidates = response.candidates or []
+        reason = candidates[0].finish_reason if candidates else None
+        raise ValueError(f"empty reply (finish_reason={reason})")
+    return response.text.strip().lower()
+
+
+def _stream_text(stream, generation) -> str:
+    """
+    Read a generate_content_stream until the reply starts with a complete
+    answer (generation.early_answer), then close it; the rest of the reply
+    is never waited for. Token usage only arrives with the last chunk, so
+    a stopped stream records none.
+    """
+    text = ""
+    try:
+        for chunk in stream:
+            _record_usage(chunk)
+            text += chunk.text or ""
+            answer = generation.early_answer(text.lower())
+            if answer is not None:
+                record(early_stop=1)
+                return answer
+    finally:
+        stream.close()
+    return text.strip().lower()
+
+
+async def _stream_text_async(stream, generation) -> str:
+    text = ""
+    try:
+        async for chunk in stream:
+            _record_usage(chunk)
+            text += chunk.text or ""
+            answer = generation.early_answer(text.lower())
+            if answer is not None:
+                record(early_stop=1)
+                return answer
+    finally:
+        await stream.aclose()
+    return text.strip().lower()
 
 
-def safe_upload(client, file_path: str, retries: int = 3, sleep_sec: int = 3):
-    for attempt in range(retries):
+def _classify_files(
+    client,
+    model_name: str,
+    prompt: str,
+    wav_paths: list,
+    labelled: bool,
+    retry_policy,
+    upload_cache,
+    raise_errors: bool = False,
+    generation=None,
+    context_cache=None,
+    rate_limiter=None,
+) -> str:
+    """
+    Upload (at most once per file) + generate, retried as ONE unit under a
+    single deadline so uploads and generation share the attempt budget.
+    On give-up returns "error", or re-raises the last error if raise_errors.
+    generation: optional generation.GenerationProfile (thinking budget,
+    output cap, temperature, response schema); with generation.stream the
+    reply is streamed and closed as soon as it starts with an answer.
+    context_cache: optional context_cache.ContextCache; the prompt is sent
+    once as a cached context and each request only names it (inline when
+    no cache can be made).
+    rate_limiter: optional rate_limiter.QuotaScheduler, acquired before
+    every generate call, retries included; DailyQuotaExceeded is always
+    re-raised.
+    """
+    policy = retry_policy or DEFAULT_RETRY_POLICY
+    config = generation.gemini_config(model_name) if generation is not None else None
+    stream = generation is not None and generation.stream
+    digests = [
+        file_sha256(p) if upload_cache is not None else None for p in wav_paths
+    ]
+    uploaded = [None] * len(wav_paths)
+    from_cache = [False] * len(wav_paths)
+
+    def attempt():
+        for i, wav_path in enumerate(wav_paths):
+            if uploaded[i] is None:
+                uploaded[i], from_cache[i] = upload_file(
+                    client, wav_path, cache=upload_cache, digest=digests[i]
+                )
+        cache_name = None
+        if context_cache is not None:
+            cache_name = context_cache.lookup(client, model_name, prompt)
+        contents = _build_contents(None if cache_name else prompt, uploaded, labelled)
+        request_config = _request_config(config, cache_name)
+        if rate_limiter is not None:
+            with timed("queue_sec"):
+                rate_limiter.acquire(model_name)
+        try:
+            with timed("model_sec"):
+                if stream:
+                    return _stream_text(
+                        client.models.generate_content_stream(
+                            model=model_name, contents=contents, config=request_config
+                        ),
+                        generation,
+                    )
+                response = client.models.generate_content(
+                    model=model_name, contents=contents, config=request_config
+                )
+        except ClientError as e:
+            _drop_stale_context(e, cache_name, context_cache, client, model_name, prompt)
+            _drop_stale_uploads(e, uploaded, from_cache, digests, upload_cache)
+        return _response_text(response)
+
+    try:
+        return policy.call(attempt, label=f"[Gemini] {os.path.basename(wav_paths[0])}")
+    except Exception as e:
+        if raise_errors or isinstance(e, DailyQuotaExceeded):
+            raise
+        print(f"[Gemini] giving up on {wav_paths[0]}: {e}")
+        return "error"
+
+
+async def _classify_files_async(
+    client,
+    model_name: str,
+    prompt: str,
+    wav_paths: list,
+    labelled: bool,
+    retry_policy,
+    upload_cache,
+    raise_errors: bool = False,
+    generation=None,
+    context_cache=None,
+    rate_limiter=None,
+) -> str:
+    """
+    _classify_files on client.aio; backoff uses asyncio.sleep, so many
+    requests can wait concurrently on one thread.
+    """
+    policy = retry_policy or DEFAULT_RETRY_POLICY
+    config = generation.gemini_config(model_name) if generation is not None else None
+    stream = generation is not None and generation.stream
+    digests = [None] * len(wav_paths)
+    if upload_cache is not None:
+        digests = await asyncio.to_thread(lambda: [file_sha256(p) for p in wav_paths])
+    uploaded = [None] * len(wav_paths)
+    from_cache = [False] * len(wav_paths)
+
+    async def attempt():
+        for i, wav_path in enumerate(wav_paths):
+            if uploaded[i] is None:
+                uploaded[i], from_cache[i] = await upload_file_async(
+                    client, wav_path, cache=upload_cache, digest=digests[i]
+                )
+        cache_name = None
+        if context_cache is not None:
+            cache_name = await context_cache.lookup_async(client, model_name, prompt)
+        contents = _build_contents(None if cache_name else prompt, uploaded, labelled)
+        request_config = _request_config(config, cache_name)
+        if rate_limiter is not None:
+            with timed("queue_sec"):
+                await rate_limiter.acquire_async(model_name)
         try:
-            return client.files.upload(file=file_path)
-        except Exception as e:
-            print(f"[Upload] failed ({attempt + 1}/{retries}): {e}")
-            time.sleep(sleep_sec)
-    raise RuntimeError("File upload failed after retries")
+            with timed("model_sec"):
+                if stream:
+                    return await _stream_text_async(
+                        await client.aio.models.generate_content_stream(
+                            model=model_name, contents=contents, config=request_config
+                        ),
+                        generation,
+                    )
+                response = await client.aio.models.generate_content(
+                    model=model_name, contents=contents, config=request_config
+                )
+        except ClientError as e:
+            _drop_stale_context(e, cache_name, context_cache, client, model_name, prompt)
+            _drop_stale_uploads(e, uploaded, from_cache, digests, upload_cache)
+        return _response_text(response)
+
+    try:
+        return await policy.call_async(
+            attempt, label=f"[Gemini] {os.path.basename(wav_paths[0])}"
+        )
+    except Exception as e:
+        if raise_errors or isinstance(e, DailyQuotaExceeded):
+            raise
+        print(f"[Gemini] giving up on {wav_paths[0]}: {e}")
+        return "error"
 
 
 def classify_audio_with_gemini(
@@ -30,26 +323,71 @@ def classify_audio_with_gemini(
     model_name: str,
     prompt: str,
     wav_path: str,
-    retries: int = 3,
-    wait_sec: int = 30,
+    retry_policy=None,
+    upload_cache=None,
+    raise_errors: bool = False,
+    generation=None,
+    context_cache=None,
+    rate_limiter=None,
 ) -> str:
     """
     输入 wav 路径，返回预测 genre（lowercase string）
+
+    retry_policy: retry.RetryPolicy (DEFAULT_RETRY_POLICY if None).
+    upload_cache: optional UploadCache; the file is uploaded at most once
+    across retries and across runs until the uploaded copy expires.
+    raise_errors: re-raise the final error instead of returning "error"
+    (used by router.Router to judge endpoint health).
+    generation: optional generation.GenerationProfile.
+    context_cache: optional context_cache.ContextCache for the prompt.
+    rate_limiter: optional rate_limiter.QuotaScheduler, acquired once per
+    attempt (a retried request takes another slot).
     """
-    for attempt in range(retries):
-        try:
-            uploaded = safe_upload(client, wav_path)
-            response = client.models.generate_content(
-                model=model_name,
-                contents=[prompt, uploaded],
-            )
-            return response.text.strip().lower()
-
-        except ServerError:
-            print(
-                f"[Gemini] server overloaded "
-                f"({attempt + 1}/{retries}), retrying in {wait_sec}s..."
-            )
-            time.sleep(wait_sec)
-
-    return "error"
+    return _classify_files(
+        client, model_name, prompt, [wav_path], False, retry_policy, upload_cache,
+        raise_errors, generation, context_cache, rate_limiter,
+    )
+
+
+def classify_audio_batch_with_gemini(
+    client,
+    model_name: str,
+    prompt: str,
+    wav_paths: list,
+    retry_policy=None,
+    upload_cache=None,
+    raise_errors: bool = False,
+    generation=None,
+    context_cache=None,
+    rate_limiter=None,
+) -> str:
+    """
+    Send several clips in one request, each preceded by "Clip i:".
+    Returns the raw (lowercased) answer text for the caller to split.
+    """
+    return _classify_files(
+        client, model_name, prompt, wav_paths, True, retry_policy, upload_cache,
+        raise_errors, generation, context_cache, rate_limiter,
+    )
+
+
+async def classify_audio_with_gemini_async(
+    client,
+    model_name: str,
+    prompt: str,
+    wav_path: str,
+    retry_policy=None,
+    upload_cache=None,
+    raise_errors: bool = False,
+    generation=None,
+    context_cache=None,
+    rate_limiter=None,
+) -> str:
+    """
+    Async classify_audio_with_gemini (same client, via client.aio).
+    """
+    return await _classify_files_async(
+        client, model_name, prompt, [wav_path], False, retry_policy, upload_cache,
+        raise_errors, generation, context_cache, rate_limiter,
+    )
+
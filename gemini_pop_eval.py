@@ -1,10 +1,10 @@
 import os
-import json
-import time
-from tqdm import tqdm
-from google import genai
-from google.genai.errors import ServerError
-import random
+from client_registry import get_client
+from dataset_adapters import PopManifestDataset
+from evaluate import evaluate_dataset
+from generation import score_profile
+from rate_limiter import QuotaScheduler
+from retry import RetryPolicy
 
 # ====== 配置 ======
 
@@ -34,97 +34,55 @@ PROMPT = (
     "Do not output any text, explanation, or punctuation—only the number."
 )
 
-# ====== 初始化 Gemini 客户端 ======
-client = genai.Client(api_key=os.environ["GEMINI_API_KEY"])
-print(f"🎵 Using Gemini model: {MODEL_NAME}\n")
-
-
-# ====== 单条预测函数（带重试） ======
-def classify_genre_task(audio_path, true_genre_id, output_jsonl, retries=5, wait_sec=30):
-    key = os.path.basename(audio_path)
-
-    for attempt in range(retries):
-        try:
-            uploaded = client.files.upload(file=audio_path)
-            response = client.models.generate_content(
-                model=MODEL_NAME,
-                contents=[PROMPT, uploaded]
-            )
-            pred = response.text.strip()
-
-            result = {"music": key, "true": str(true_genre_id), "pred": pred, "model": MODEL_NAME}
-
-            # 写入 JSONL 文件（追加模式）
-            with open(output_jsonl, "a", encoding="utf-8") as f:
-                f.write(json.dumps(result, ensure_ascii=False) + "\n")
-
-            return result
-
-        except ServerError as e:
-            print(f"⚠️ Server error (attempt {attempt+1}/{retries}): {e}. Retrying in {wait_sec}s...")
-            time.sleep(wait_sec)
-
-        except Exception as e:
-            print(f"❌ Error processing {key}: {e}")
-            time.sleep(wait_sec)
-
-    # 超过重试次数仍失败，记录为 error
-    result = {"music": key, "true": str(true_genre_id), "pred": "error", "model": MODEL_NAME}
-    with open(output_jsonl, "a", encoding="utf-8") as f:
-        f.write(json.dumps(result, ensure_ascii=False) + "\n")
+# 只允许回答 "1".."10"，思考预算压到最低，答案最多 16 token
+GENERATION = score_profile(1, len(GENRES))
 
-    print(f"❌ Failed after {retries} attempts: {key}")
-    return result
+# 请求节奏：每分钟最多 RPM 次（代替原先每个文件后固定 sleep 5~7s）
+RPM = 10
+rate_limiter = QuotaScheduler({MODEL_NAME: {"rpm": RPM}})
 
+# 同时在途的请求数；总速度仍受 RPM 限制
+MAX_IN_FLIGHT = 4
 
-# ====== 主评测函数（支持断点续传 + 剩余进度条） ======
-def evaluate_from_jsonl(pop_jsonl, audio_folder, output_jsonl="gemini_predictions.jsonl"):
-    # 读取测试集信息
-    with open(pop_jsonl, "r", encoding="utf-8") as f:
-        data = [json.loads(line) for line in f if line.strip()]
-
-    # 读取已完成预测，避免重复
-    done_keys = set()
-    correct_keys = set()
-    if os.path.exists(output_jsonl):
-        with open(output_jsonl, "r", encoding="utf-8") as f:
-            for line in f:
-                try:
-                    result = json.loads(line)
-                    done_keys.add(result["music"])
-                    if result["pred"] == result["true"]:
-                        correct_keys.add(result["music"])
-                except:
-                    continue
-
-    # 筛选剩余未处理的文件
-    remaining_data = [item for item in data if item["music"] not in done_keys]
-
-    total, correct = len(remaining_data), len(correct_keys)
-
-    # 遍历剩余文件
-    for item in tqdm(remaining_data, desc="Classifying", unit="file"):
-        music = item["music"]
-        genre_id = item["genre_id"]
-
-        audio_path = os.path.join(audio_folder, music)
-        if not os.path.exists(audio_path):
-            print(f"⚠️ Missing file: {audio_path}")
-            continue
-
-        res = classify_genre_task(audio_path, genre_id, output_jsonl, wait_sec=45)
-
-        if res["pred"] == str(genre_id):
-            correct += 1
-
-        # 避免过快调用 API
-        time.sleep(5 + random.random() * 2)
+# ====== Gemini 客户端 ======
+# 共享的连接池 client，第一次用到时才创建（import 本模块不再建连接）
+def get_gemini():
+    return get_client("gemini", api_key=os.environ["GEMINI_API_KEY"])
+print(f"🎵 Using Gemini model: {MODEL_NAME}\n")
 
-    acc = correct / len(data) if len(data) > 0 else 0.0
-    print(f"\n✅ Evaluation complete.")
-    print(f"Total: {len(data)}, Correct: {correct}, Accuracy: {acc:.2%}")
 
-    return acc
+# ====== 重试 / 缓存 ======
+retry_policy = RetryPolicy(max_attempts=5, base_delay=5, quota_delay=30, deadline=300)
+
+# 可选：upload_cache.UploadCache / response_cache.ResponseCache / context_cache.ContextCache
+upload_cache = None
+response_cache = None
+context_cache = None
+
+
+# ====== 主评测函数（走 evaluate.evaluate_dataset：并发 + 断点续传 + 缓存） ======
+# 结果每行 {"key": 文件名去掉扩展名, "true": "genre_id", "pred": "1".."10"}；旧结果文件（"music" 字段）照样续跑
+# shard=(index, num_shards)：只评测按 key hash 落在该分片的条目（见 shard.py）
+# batch_api：batch_api 的后端（如 GeminiBatchBackend(get_gemini())），剩余条目打包成一个离线任务（不受 RPM 限制）
+def evaluate_from_jsonl(
+    pop_jsonl, audio_folder, output_jsonl="gemini_predictions.jsonl", shard=None, batch_api=None
+):
+    return evaluate_dataset(
+        PopManifestDataset(pop_jsonl, audio_folder),
+        client=get_gemini(),
+        model_name=MODEL_NAME,
+        prompt=PROMPT,
+        output_jsonl=output_jsonl,
+        max_in_flight=MAX_IN_FLIGHT,
+        shard=shard,
+        batch_api=batch_api,
+        rate_limiter=rate_limiter,
+        retry_policy=retry_policy,
+        upload_cache=upload_cache,
+        response_cache=response_cache,
+        context_cache=context_cache,
+        generation=GENERATION,
+    )
 
 
 if __name__ == "__main__":
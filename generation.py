@@ -0,0 +1,174 @@
+# generation.py
+
+import json
+import re
+from dataclasses import asdict, dataclass, replace
+
+# 2.5 pro 不能关掉思考，预算最低 128
+_MIN_THINKING = {"pro": 128}
+
+# OpenAI 兼容接口的 reasoning_effort 档位和 Gemini 实际给的思考预算（从低到高）
+_EFFORT_BUDGETS = (("none", 0), ("low", 1024), ("medium", 8192), ("high", 24576))
+
+# 回复开头的第一个词（json_schema 回复里跳过 {"answer": 前缀），后面必须已经有分隔符
+_LEADING_WORD = re.compile(r"^\W*(?:answer\W+)?(\w+)(?=\W)")
+
+
+@dataclass(frozen=True)
+class GenerationProfile:
+    """
+    How the model should answer one task.
+
+    thinking_budget: thinking tokens (0 = off; None = model default).
+    max_output_tokens: cap on the answer itself; the thinking budget is
+    added on top, since Gemini counts thinking against the same limit.
+    temperature: None = model default.
+    choices: allowed answers; sent as a response schema (Gemini enum /
+    OpenAI json_schema) so the reply is exactly one of them.
+    schema: False keeps choices out of the request (they are then only
+    used to spot the answer in a stream).
+    stream: read the reply as a stream and close it as soon as it starts
+    with one of `choices`, instead of waiting for whatever the model says
+    after the answer. Pays off when there is no schema (or the endpoint
+    ignores it) and the model keeps talking.
+    """
+
+    thinking_budget: int | None = 0
+    max_output_tokens: int | None = 16
+    temperature: float | None = 0.0
+    choices: tuple | None = None
+    schema: bool = True
+    stream: bool = False
+
+    def thinking_for(self, model_name: str) -> int | None:
+        if self.thinking_budget is None:
+            return None
+        floor = max(
+            (v for k, v in _MIN_THINKING.items() if k in model_name.lower()), default=0
+        )
+        return max(self.thinking_budget, floor)
+
+    def token_cap(self, model_name: str) -> int | None:
+        # 思考预算由模型自己决定时不设上限：思考可能把额度用完，答案变空
+        if self.max_output_tokens is None or self.thinking_budget is None:
+            return None
+        return self.max_output_tokens + self.thinking_for(model_name)
+
+    def reasoning_effort(self, model_name: str) -> str | None:
+        # 取预算不低于 thinking_for 的最低一档
+        thinking = self.thinking_for(model_name)
+        if thinking is None:
+            return None
+        for effort, budget in _EFFORT_BUDGETS:
+            if thinking <= budget:
+                return effort
+        return _EFFORT_BUDGETS[-1][0]
+
+    def for_batch(self, num_clips: int) -> "GenerationProfile":
+        """
+        Same settings for a multi-clip request: no schema (the answer is
+        "<i>: <answer>" lines), room for one line per clip and no stream
+        (every line is needed).
+        """
+        cap = None if self.max_output_tokens is None else (self.max_output_tokens + 4) * num_clips
+        return replace(self, choices=None, max_output_tokens=cap, stream=False)
+
+    def early_answer(self, text: str) -> str | None:
+        """
+        The answer a partial (lowercased) reply starts with, once the word
+        is complete and one of `choices`; None until then (or never, e.g.
+        "score: 4").
+        """
+        if not self.choices:
+            return None
+        match = _LEADING_WORD.match(text)
+        if match is None or match.group(1) not in self.choices:
+            return None
+        return match.group(1)
+
+    def digest(self) -> str:
+        return json.dumps(asdict(self), sort_keys=True)
+
+    # -------- 各后端的参数 --------
+    def gemini_config(self, model_name: str) -> dict:
+        """
+        `config` for client.models.generate_content.
+        """
+        config = {}
+        if self.temperature is not None:
+            config["temperature"] = self.temperature
+        cap = self.token_cap(model_name)
+        if cap is not None:
+            config["max_output_tokens"] = cap
+        thinking = self.thinking_for(model_name)
+        if thinking is not None:
+            config["thinking_config"] = {"thinking_budget": thinking}
+        if self.choices and self.schema:
+            config["response_mime_type"] = "text/x.enum"
+            config["response_schema"] = {"type": "STRING", "enum": list(self.choices)}
+        return config
+
+    def openai_params(self, model_name: str) -> dict:
+        """
+        Extra chat.completions.create arguments. The thinking budget maps to
+        the lowest reasoning_effort that covers it (Gemini's OpenAI-compatible
+        endpoint turns that back into its own budget: low 1024, medium 8192,
+        high 24576), and max_tokens leaves room for that whole budget, since
+        thinking counts against it; choices map to a json_schema
+        {"answer": enum}.
+        """
+        params = {}
+        if self.temperature is not None:
+            params["temperature"] = self.temperature
+        effort = self.reasoning_effort(model_name)
+        if effort is not None:
+            params["reasoning_effort"] = effort
+            if self.max_output_tokens is not None:
+                params["max_tokens"] = self.max_output_tokens + dict(_EFFORT_BUDGETS)[effort]
+        if self.choices and self.schema:
+            params["response_format"] = {
+                "type": "json_schema",
+                "json_schema": {
+                    "name": "answer",
+                    "strict": True,
+                    "schema": {
+                        "type": "object",
+                        "properties": {"answer": {"type": "string", "enum": list(self.choices)}},
+                        "required": ["answer"],
+                        "additionalProperties": False,
+                    },
+                },
+            }
+        return params
+
+
+def unwrap_answer(text: str) -> str:
+    """
+    The bare answer from a json_schema reply ('{"answer": "4"}' -> '4');
+    other text is returned unchanged.
+    """
+    if not text.startswith("{"):
+        return text
+    try:
+        answer = json.loads(text).get("answer")
+    except (ValueError, AttributeError):
+        return text
+    return text if answer is None else str(answer)
+
+
+def score_profile(low: int = 1, high: int = 5, **kwargs) -> GenerationProfile:
+    """
+    Integer score task: the answer is one of "low".."high".
+    """
+    return GenerationProfile(choices=tuple(str(i) for i in range(low, high + 1)), **kwargs)
+
+
+def genre_profile(genres, **kwargs) -> GenerationProfile:
+    """
+    Classification task: the answer is one of `genres` (lowercase tags).
+    """
+    return GenerationProfile(choices=tuple(g.lower() for g in genres), **kwargs)
+
+
+# 默认：不思考、答案最多 16 token、temperature 0
+SCORE_PROFILE = score_profile()
@@ -0,0 +1,47 @@
+# hash_utils.py
+
+import hashlib
+import os
+import threading
+
+# (path, size, mtime_ns) -> sha256，同一进程内同一文件只读一遍
+_FILE_HASHES = {}
+_LOCK = threading.Lock()
+
+
+def file_sha256(path: str, chunk_size: int = 1 << 20) -> str:
+    st = os.stat(path)
+    stamp = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    with _LOCK:
+        digest = _FILE_HASHES.get(stamp)
+    if digest is not None:
+        return digest
+
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    digest = h.hexdigest()
+
+    with _LOCK:
+        _FILE_HASHES[stamp] = digest
+    return digest
+
+
+def text_sha256(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def shard_of(key: str, num_shards: int) -> int:
+    # 不能用内置 hash()：每个进程的字符串 hash 种子不同，分片会对不上
+    return int(text_sha256(key)[:16], 16) % num_shards
+
+
+def in_shard(key: str, shard: tuple | None) -> bool:
+    """
+    shard = (index, num_shards); None means "everything".
+    """
+    if shard is None:
+        return True
+    index, num_shards = shard
+    return shard_of(key, num_shards) == index
@@ -0,0 +1,144 @@
+# metrics.py
+
+import contextvars
+import time
+from contextlib import contextmanager
+
+# 每条请求记录的字段（时间单位：秒）
+FIELDS = (
+    "queue_sec",      # 等待限速 / 配额
+    "upload_sec",     # gemini Files API 上传
+    "model_sec",      # generate_content / chat.completions 调用
+    "total_sec",      # classify_audio 总耗时
+    "retries",        # 重试次数（含 router 换 endpoint）
+    "throttled",      # 收到 429 / 5xx 的次数（含最后放弃的那次）
+    "input_bytes",    # 发送的音频字节数（上传或内联前的原始大小）
+    "prompt_tokens",
+    "output_tokens",
+    "cached_tokens",  # prompt_tokens 里命中上下文缓存（显式或隐式）的部分
+    "early_stop",     # 流式响应读到答案后提前关闭（1 / 0）
+)
+
+_current = contextvars.ContextVar("request_metrics", default=None)
+
+
+class RequestMetrics:
+    """
+    Counters for one model request, filled in by the clients while it runs.
+    """
+
+    def __init__(self):
+        self.values = dict.fromkeys(FIELDS, 0)
+        self.cache_hit = False
+
+    def add(self, **fields) -> None:
+        for name, value in fields.items():
+            if value:
+                self.values[name] += value
+
+    def to_dict(self) -> dict:
+        d = {k: round(v, 4) if isinstance(v, float) else v for k, v in self.values.items()}
+        d["cache_hit"] = self.cache_hit
+        return d
+
+
+@contextmanager
+def collect(metrics: RequestMetrics | None):
+    """
+    Make `metrics` the target of record() / timed() in this thread (or task)
+    for the duration of the block. None records nothing.
+    """
+    token = _current.set(metrics)
+    try:
+        yield metrics
+    finally:
+        _current.reset(token)
+
+
+def record(**fields) -> None:
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.add(**fields)
+
+
+@contextmanager
+def timed(field: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(**{field: time.perf_counter() - start})
+
+
+def percentile(sorted_values: list, q: float) -> float:
+    """
+    Nearest-rank percentile of an already sorted list (q in 0..100).
+    """
+    if not sorted_values:
+        return 0.0
+    rank = max(1, -(-len(sorted_values) * q // 100))
+    return sorted_values[int(rank) - 1]
+
+
+def summarize(records: list, wall_sec: float) -> dict:
+    """
+    Latency percentiles (per item), throughput and totals over result records
+    carrying a "metrics" dict. Clips sent in one batched request share its
+    metrics; counts / bytes / tokens are split between them so totals are not
+    counted twice.
+    """
+    measured = [r["metrics"] for r in records if r.get("metrics")]
+    live = [m for m in measured if not m.get("cache_hit")]
+
+    summary = {
+        "items": len(records),
+        "requests": round(sum(1 / m.get("batch_size", 1) for m in live)),
+        "cache_hits": len(measured) - len(live),
+        "wall_sec": wall_sec,
+        "items_per_sec": len(records) / wall_sec if wall_sec > 0 else 0.0,
+    }
+    for field in ("total_sec", "model_sec", "upload_sec", "queue_sec"):
+        values = sorted(m.get(field, 0) for m in live)
+        for q in (50, 95, 99):
+            summary[f"{field}_p{q}"] = percentile(values, q)
+    for field in (
+        "retries", "throttled", "input_bytes", "prompt_tokens", "output_tokens",
+        "cached_tokens", "early_stop",
+    ):
+        summary[field] = sum(m.get(field, 0) / m.get("batch_size", 1) for m in live)
+    return summary
+
+
+def print_summary(summary: dict) -> None:
+    print(
+        f"\n[Metrics] {summary['items']} items in {summary['wall_sec']:.1f}s "
+        f"({summary['items_per_sec']:.2f} items/s), "
+        f"{summary['requests']} requests, {summary['cache_hits']} cache hits"
+    )
+    if not summary["requests"]:
+        return
+    for field, label in (
+        ("total_sec", "latency"),
+        ("model_sec", "model"),
+        ("upload_sec", "upload"),
+        ("queue_sec", "queue"),
+    ):
+        if field != "total_sec" and not summary[field + "_p99"]:
+            continue  # 例如 openai 后端没有上传阶段
+        print(
+            f"[Metrics] {label:<7} p50 {summary[field + '_p50']:.2f}s  "
+            f"p95 {summary[field + '_p95']:.2f}s  p99 {summary[field + '_p99']:.2f}s"
+        )
+    print(
+        f"[Metrics] retries {summary['retries']:.0f} "
+        f"({summary['throttled']:.0f} 429/5xx), "
+        f"sent {summary['input_bytes'] / 1e6:.1f} MB, "
+        f"tokens in {summary['prompt_tokens']:.0f} / out {summary['output_tokens']:.0f}"
+    )
+    if summary["cached_tokens"]:
+        print(
+            f"[Metrics] {summary['cached_tokens']:.0f} of the input tokens "
+            f"({summary['cached_tokens'] / max(summary['prompt_tokens'], 1):.0%}) came from a context cache"
+        )
+    if summary["early_stop"]:
+        print(f"[Metrics] {summary['early_stop']:.0f} streams closed right after the answer")
@@ -0,0 +1,914 @@
+# mock_server.py
+
+import argparse
+import json
+from email.parser import BytesParser
+from email.policy import HTTP
+import random
+import re
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+GTZAN_GENRES = ["blues", "classical", "country", "disco", "hiphop",
+                "jazz", "metal", "pop", "reggae", "rock"]
+
+_GENERATE = re.compile(r"^/v1beta/models/([^/:]+):(generateContent|streamGenerateContent)$")
+_BATCH_CREATE = re.compile(r"^/v1beta/models/([^/:]+):batchGenerateContent$")
+_BATCH_GET = re.compile(r"^/v1beta/batches/([^/:]+)$")
+_DOWNLOAD = re.compile(r"files/([^/:]+):download$")
+_OPENAI_BATCH_GET = re.compile(r"/batches/([^/]+)$")
+_OPENAI_FILE_CONTENT = re.compile(r"/files/([^/]+)/content$")
+_CACHE = re.compile(r"^/v1beta/(cachedContents/[^/:]+)$")
+
+# 模型答完之后继续“解释”时说的话
+_CHATTER = ("the", "vocal", "delivery", "suggests", "this", "rating", "because", "of", "its", "style")
+
+
+class MockConfig:
+    """
+    Behaviour of the stand-in server; every model call (Gemini generate or
+    OpenAI chat) draws its latency and injected errors from here.
+
+    latency: mean seconds per model call (jitter: +/- uniform seconds).
+    upload_latency: seconds per Files API upload.
+    error_rate: fraction of model calls answered with 503 UNAVAILABLE.
+    quota_rate: fraction answered with 429 RESOURCE_EXHAUSTED.
+    capacity: model calls served at once; calls beyond it get an immediate
+    503 (counted as injected_503). None = unlimited.
+    thinking_latency: extra seconds per call unless the request turns
+    thinking off (thinkingBudget 0 / reasoning_effort "none").
+    chatter_words / chatter_latency: after a single-clip answer without a
+    response schema the model keeps talking for chatter_words more words,
+    chatter_latency seconds each. A plain response waits for all of them;
+    a stream (streamGenerateContent / "stream": true) sends them one by
+    one, so a client that closes it after the answer skips the rest.
+    batch_latency: seconds a Batch API job (Gemini batchGenerateContent /
+    OpenAI /v1/batches) stays pending + running before all of its results
+    are ready, whatever its size; items still draw injected errors.
+    prompt_latency: extra seconds per 1000 text prompt tokens a Gemini call
+    has to read (one token per word); tokens served from a cached context
+    (cachedContents) are not read again.
+    cache_min_tokens: cachedContents smaller than this are refused with 400,
+    like the real service's minimum cacheable size.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.2,
+        jitter: float = 0.05,
+        upload_latency: float = 0.05,
+        error_rate: float = 0.0,
+        quota_rate: float = 0.0,
+        seed: int | None = None,
+        capacity: int | None = None,
+        thinking_latency: float = 0.0,
+        chatter_words: int = 0,
+        chatter_latency: float = 0.0,
+        batch_latency: float = 1.0,
+        prompt_latency: float = 0.0,
+        cache_min_tokens: int = 0,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.upload_latency = upload_latency
+        self.error_rate = error_rate
+        self.quota_rate = quota_rate
+        self.capacity = capacity
+        self.thinking_latency = thinking_latency
+        self.chatter_words = chatter_words
+        self.chatter_latency = chatter_latency
+        self.batch_latency = batch_latency
+        self.prompt_latency = prompt_latency
+        self.cache_min_tokens = cache_min_tokens
+        self.random = random.Random(seed)
+
+
+def _answer(prompt: str, rng: random.Random) -> str:
+    # 按 prompt 猜任务类型，给出格式正确的随机答案
+    if "1–10" in prompt or "1-10" in prompt:
+        return str(rng.randint(1, 10))
+    if "blues, classical" in prompt:
+        return rng.choice(GTZAN_GENRES)
+    return str(rng.randint(1, 5))
+
+
+def _reply_text(prompt: str, num_clips: int, rng: random.Random) -> str:
+    if num_clips <= 1:
+        return _answer(prompt, rng)
+    return "\n".join(f"{i}: {_answer(prompt, rng)}" for i in range(1, num_clips + 1))
+
+
+def _get(d: dict, camel: str, snake: str):
+    return d.get(camel, d.get(snake))
+
+
+def _reply(prompt: str, num_clips: int, rng: random.Random, choices: list | None) -> str:
+    # 请求带了 enum schema：从允许的答案里选
+    if choices and num_clips <= 1:
+        return rng.choice(choices)
+    return _reply_text(prompt, num_clips, rng)
+
+
+def _pieces(text: str, num_clips: int, schema, config: MockConfig) -> list:
+    # 流式响应的分段：答案本身 + 之后的废话（每段之间隔 chatter_latency）
+    if num_clips > 1 or schema or config.chatter_words <= 0:
+        return [text]
+    words = [_CHATTER[i % len(_CHATTER)] for i in range(config.chatter_words)]
+    return [text, "\n\nExplanation:"] + [" " + w for w in words[1:]]
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
+
+
+def _new_id(prefix: str = "") -> str:
+    return prefix + uuid.uuid4().hex[:12]
+
+
+# -------- Gemini 请求 / 响应 --------
+def _gemini_request(request: dict) -> tuple:
+    """
+    (prompt text, file uris, generationConfig) of a generateContent request.
+    """
+    parts = [p for c in request.get("contents", []) for p in c.get("parts", [])]
+    texts = [p["text"] for p in parts if "text" in p]
+    # 真实服务 camelCase / snake_case 都接受，SDK 也会混用
+    files = [
+        _get(_get(p, "fileData", "file_data"), "fileUri", "file_uri")
+        for p in parts
+        if _get(p, "fileData", "file_data")
+    ]
+    config = _get(request, "generationConfig", "generation_config") or {}
+    return " ".join(texts), files, config
+
+
+def _gemini_response(
+    text: str, num_files: int, model: str, last: bool = True, prompt_words: int = 0, cached_words: int = 0
+) -> dict:
+    candidate = {"content": {"role": "model", "parts": [{"text": text}]}, "index": 0}
+    payload = {"candidates": [candidate], "modelVersion": model}
+    if last:
+        # 每个音频算 100 token，文本一个词一个 token；缓存里的 prompt 也计入 promptTokenCount
+        prompt_tokens = 100 * max(num_files, 1) + prompt_words + cached_words
+        candidate["finishReason"] = "STOP"
+        payload["usageMetadata"] = {
+            "promptTokenCount": prompt_tokens,
+            "candidatesTokenCount": len(text.split()),
+            "totalTokenCount": prompt_tokens + len(text.split()),
+        }
+        if cached_words:
+            payload["usageMetadata"]["cachedContentTokenCount"] = cached_words
+    return payload
+
+
+def _error_json(code: int, message: str) -> dict:
+    status = _ERROR_STATUS.get(code, "UNKNOWN")
+    return {"code": code, "message": message, "status": status, "type": status}
+
+
+# -------- OpenAI 请求 / 响应 --------
+def _chat_request(request: dict) -> tuple:
+    """
+    (prompt text, number of audio clips, answer enum or None) of a chat request.
+    """
+    content = request["messages"][0]["content"]
+    texts = [c["text"] for c in content if c.get("type") == "text"]
+    num_clips = sum(1 for c in content if c.get("type") == "input_audio")
+    schema = (request.get("response_format") or {}).get("json_schema", {}).get("schema")
+    choices = schema["properties"]["answer"]["enum"] if schema else None
+    return " ".join(texts), num_clips, choices
+
+
+def _chat_completion(request: dict, text: str, num_clips: int) -> dict:
+    prompt_tokens = 100 * max(num_clips, 1)
+    return {
+        "id": _new_id("chatcmpl-"),
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": request.get("model", ""),
+        "choices": [
+            {
+                "index": 0,
+                "message": {"role": "assistant", "content": text},
+                "finish_reason": "stop",
+            }
+        ],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": len(text.split()),
+            "total_tokens": prompt_tokens + len(text.split()),
+        },
+    }
+
+
+class MockState:
+    """
+    Uploaded files and request counters shared by all handler threads.
+    """
+
+    def __init__(self, config: MockConfig):
+        self.config = config
+        self.lock = threading.Lock()
+        self.files = {}       # name -> file json
+        self.sessions = {}    # upload id -> (bytearray, meta)
+        self.blobs = {}       # 非音频文件的内容（batch 请求 / 结果 jsonl）：name 或 id -> bytes
+        self.batches = {}     # batch id -> 任务状态 dict
+        self.caches = {}      # cachedContents/{id} -> 上下文缓存 dict（text / expire_time 等）
+        self.active = 0       # 正在处理的模型调用
+        self.reset()
+
+    def reset(self) -> None:
+        with self.lock:
+            self.stats = {
+                "uploads": 0,
+                "generate": 0,
+                "chat": 0,
+                "injected_429": 0,
+                "injected_503": 0,
+                "bytes_in": 0,
+                "streams": 0,
+                "streams_closed_early": 0,
+                "batch_jobs": 0,
+                "batch_items": 0,
+                "caches_created": 0,
+                "cached_requests": 0,
+            }
+
+    def count(self, **deltas) -> None:
+        with self.lock:
+            for k, v in deltas.items():
+                self.stats[k] += v
+
+    def draw_error(self) -> int | None:
+        cfg = self.config
+        with self.lock:
+            r = cfg.random.random()
+        if r < cfg.quota_rate:
+            self.count(injected_429=1)
+            return 429
+        if r < cfg.quota_rate + cfg.error_rate:
+            self.count(injected_503=1)
+            return 503
+        return None
+
+    def model_delay(self, thinking: bool = True, prompt_words: int = 0) -> None:
+        cfg = self.config
+        with self.lock:
+            delay = cfg.latency + cfg.random.uniform(-cfg.jitter, cfg.jitter)
+        if thinking:
+            delay += cfg.thinking_latency
+        delay += cfg.prompt_latency * prompt_words / 1000
+        time.sleep(max(delay, 0.0))
+
+    def model_call(self, thinking: bool = True, prompt_words: int = 0) -> int | None:
+        """
+        Simulate one model call; returns the error status to answer with, or None.
+        """
+        with self.lock:
+            if self.config.capacity is not None and self.active >= self.config.capacity:
+                self.stats["injected_503"] += 1
+                return 503
+            self.active += 1
+        try:
+            self.model_delay(thinking, prompt_words)
+        finally:
+            with self.lock:
+                self.active -= 1
+        return self.draw_error()
+
+    def cached_prefix(self, model: str, name: str | None) -> tuple:
+        """
+        (cached prompt text, (status, message) or None) for a request that
+        names a cachedContents entry; ("", None) when it names none.
+        """
+        if not name:
+            return "", None
+        with self.lock:
+            cache = self.caches.get(name)
+        if cache is None or cache["expire_time"] <= datetime.now(timezone.utc):
+            return "", (403, f"CachedContent not found (or permission denied): {name}")
+        if cache["model"] != model:
+            return "", (400, f"model {model} does not match cached content model {cache['model']}")
+        self.count(cached_requests=1)
+        return cache["text"], None
+
+    # -------- Batch API（离线任务，后台线程处理） --------
+    def gemini_batch_line(self, line: dict) -> dict:
+        request = line.get("request", {})
+        prompt, files, config = _gemini_request(request)
+        with self.lock:
+            missing = [uri for uri in files if uri not in self.files]
+        if missing:
+            return {"key": line.get("key"), "error": _error_json(403, f"no access to {missing[0]}")}
+        code = self.draw_error()
+        if code is not None:
+            return {"key": line.get("key"), "error": _error_json(code, "injected error")}
+        schema = _get(config, "responseSchema", "response_schema") or {}
+        with self.lock:
+            text = _reply(prompt, len(files), self.config.random, schema.get("enum"))
+        text = "".join(_pieces(text, len(files), schema, self.config))
+        model = (request.get("model") or "").split("/")[-1]
+        return {
+            "key": line.get("key"),
+            "response": _gemini_response(text, len(files), model, prompt_words=len(prompt.split())),
+        }
+
+    def openai_batch_line(self, line: dict) -> tuple:
+        """
+        (output line, failed) for one line of an OpenAI batch input file.
+        """
+        request = line["body"]
+        code = self.draw_error()
+        if code is not None:
+            response = {"status_code": code, "body": {"error": _error_json(code, "injected error")}}
+            return {"id": _new_id("batch_req_"), "custom_id": line["custom_id"], "response": response, "error": None}, True
+        prompt, num_clips, choices = _chat_request(request)
+        with self.lock:
+            text = _reply(prompt, num_clips, self.config.random, choices)
+        if choices:
+            text = json.dumps({"answer": text})
+        text = "".join(_pieces(text, num_clips, choices, self.config))
+        response = {"status_code": 200, "body": _chat_completion(request, text, num_clips)}
+        return {"id": _new_id("batch_req_"), "custom_id": line["custom_id"], "response": response, "error": None}, False
+
+    def run_batch(self, batch_id: str, lines: list, kind: str) -> None:
+        """
+        Background job: pending -> running -> done after batch_latency, then
+        the results are stored as downloadable files.
+        """
+        job = self.batches[batch_id]
+        time.sleep(self.config.batch_latency / 2)
+        with self.lock:
+            job["state"] = "running"
+        time.sleep(self.config.batch_latency / 2)
+
+        if kind == "gemini":
+            output = [self.gemini_batch_line(line) for line in lines]
+            errors = []
+        else:
+            output, errors = [], []
+            for line in lines:
+                out, failed = self.openai_batch_line(line)
+                (errors if failed else output).append(out)
+        self.count(batch_items=len(lines))
+
+        def to_bytes(rows):
+            return "".join(json.dumps(r) + "\n" for r in rows).encode("utf-8")
+
+        with self.lock:
+            output_id = _new_id("file-")
+            self.blobs[output_id] = to_bytes(output)
+            job["output_file"] = output_id
+            if errors:
+                error_id = _new_id("file-")
+                self.blobs[error_id] = to_bytes(errors)
+                job["error_file"] = error_id
+            job["counts"] = {"total": len(lines), "completed": len(output), "failed": len(errors)}
+            job["state"] = "done"
+            job["end_time"] = _now()
+
+
+_ERROR_STATUS = {
+    400: "INVALID_ARGUMENT",
+    403: "PERMISSION_DENIED",
+    404: "NOT_FOUND",
+    429: "RESOURCE_EXHAUSTED",
+    503: "UNAVAILABLE",
+}
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive，和真实服务一样复用连接
+    state: MockState = None
+
+    def log_message(self, *args):
+        pass
+
+    # -------- helpers --------
+    def _body(self) -> bytes:
+        length = int(self.headers.get("Content-Length") or 0)
+        data = self.rfile.read(length) if length else b""
+        self.state.count(bytes_in=len(data))
+        return data
+
+    def _send_json(self, code: int, payload: dict, headers: dict | None = None) -> None:
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_stream(self, events) -> None:
+        """
+        Server-sent events with chunked encoding; `events` yields (delay,
+        payload) pairs. A client that hangs up early is counted in
+        streams_closed_early.
+        """
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        self.state.count(streams=1)
+        try:
+            for delay, payload in events:
+                time.sleep(delay)
+                data = payload if isinstance(payload, str) else json.dumps(payload)
+                event = f"data: {data}\r\n\r\n".encode("utf-8")
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(event), event))
+                self.wfile.flush()
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            self.state.count(streams_closed_early=1)
+            self.close_connection = True
+
+    def _send_error(self, code: int, message: str) -> None:
+        self._send_json(code, {"error": _error_json(code, message)})
+
+    def _send_bytes(self, data: bytes) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    # -------- routes --------
+    def do_GET(self):
+        path = self.path.split("?", 1)[0]
+        if path == "/_stats":
+            with self.state.lock:
+                self._send_json(200, dict(self.state.stats))
+        elif _BATCH_GET.match(path):
+            self._gemini_batch_get(_BATCH_GET.match(path).group(1))
+        elif _DOWNLOAD.search(path):
+            self._blob("files/" + _DOWNLOAD.search(path).group(1))
+        elif _OPENAI_BATCH_GET.search(path):
+            self._openai_batch_get(_OPENAI_BATCH_GET.search(path).group(1))
+        elif _OPENAI_FILE_CONTENT.search(path):
+            self._blob(_OPENAI_FILE_CONTENT.search(path).group(1))
+        elif _CACHE.match(path):
+            self._cache_get(_CACHE.match(path).group(1))
+        else:
+            self._send_error(404, f"no route {self.path}")
+
+    def do_PATCH(self):
+        path = self.path.split("?", 1)[0]
+        body = self._body()
+        if _CACHE.match(path):
+            self._cache_update(_CACHE.match(path).group(1), body)
+        else:
+            self._send_error(404, f"no route {self.path}")
+
+    def do_DELETE(self):
+        path = self.path.split("?", 1)[0]
+        self._body()
+        if _CACHE.match(path):
+            with self.state.lock:
+                found = self.state.caches.pop(_CACHE.match(path).group(1), None)
+            if found is None:
+                self._send_error(404, f"no such cached content {path}")
+            else:
+                self._send_json(200, {})
+        else:
+            self._send_error(404, f"no route {self.path}")
+
+    def do_POST(self):
+        path = self.path.split("?", 1)[0]
+        body = self._body()
+        try:
+            self._route(path, body)
+        except Exception as e:
+            self._send_error(500, f"mock server error: {e!r}")
+
+    def _route(self, path: str, body: bytes):
+        if path == "/_reset":
+            self.state.reset()
+            self._send_json(200, {})
+        elif path == "/upload/v1beta/files":
+            self._upload_start(body)
+        elif path.startswith("/upload/session/"):
+            self._upload_chunk(path.rsplit("/", 1)[1], body)
+        elif _GENERATE.match(path):
+            model, method = _GENERATE.match(path).groups()
+            self._generate(model, body, stream=method == "streamGenerateContent")
+        elif _BATCH_CREATE.match(path):
+            self._gemini_batch_create(_BATCH_CREATE.match(path).group(1), body)
+        elif path == "/v1beta/cachedContents":
+            self._cache_create(body)
+        elif path.endswith("/chat/completions"):
+            self._chat(body)
+        elif path.endswith("/files"):
+            self._openai_file_upload(body)
+        elif path.endswith("/batches"):
+            self._openai_batch_create(body)
+        else:
+            self._send_error(404, f"no route {path}")
+
+    # Gemini Files API：resumable upload（start -> upload, finalize）
+    def _upload_start(self, body: bytes):
+        meta = json.loads(body or b"{}").get("file", {})
+        meta["mimeType"] = self.headers.get("X-Goog-Upload-Header-Content-Type", "audio/wav")
+        upload_id = uuid.uuid4().hex
+        with self.state.lock:
+            self.state.sessions[upload_id] = (bytearray(), meta)
+        host = self.headers.get("Host")
+        self._send_json(
+            200, {}, {"X-Goog-Upload-URL": f"http://{host}/upload/session/{upload_id}"}
+        )
+
+    def _upload_chunk(self, upload_id: str, body: bytes):
+        with self.state.lock:
+            session = self.state.sessions.get(upload_id)
+        if session is None:
+            self._send_error(404, "unknown upload session")
+            return
+        data, meta = session
+        data.extend(body)
+
+        if "finalize" not in self.headers.get("X-Goog-Upload-Command", ""):
+            self._send_json(200, {}, {"X-Goog-Upload-Status": "active"})
+            return
+
+        time.sleep(self.state.config.upload_latency)
+        name = f"files/{upload_id[:12]}"
+        now = datetime.now(timezone.utc)
+        file = {
+            "name": name,
+            "mimeType": meta["mimeType"],
+            "sizeBytes": str(len(data)),
+            "createTime": now.isoformat().replace("+00:00", "Z"),
+            "expirationTime": (now + timedelta(hours=48)).isoformat().replace("+00:00", "Z"),
+            "uri": f"http://{self.headers.get('Host')}/v1beta/{name}",
+            "state": "ACTIVE",
+        }
+        with self.state.lock:
+            del self.state.sessions[upload_id]
+            self.state.files[file["uri"]] = file
+            if not meta["mimeType"].startswith("audio/"):
+                self.state.blobs[name] = bytes(data)  # batch 请求文件，之后要读
+        self.state.count(uploads=1)
+        self._send_json(200, {"file": file}, {"X-Goog-Upload-Status": "final"})
+
+    def _generate(self, model: str, body: bytes, stream: bool = False):
+        self.state.count(generate=1)
+        request = json.loads(body or b"{}")
+        prompt, files, config = _gemini_request(request)
+
+        with self.state.lock:
+            missing = [uri for uri in files if uri not in self.state.files]
+        if missing:
+            self._send_error(403, f"You do not have permission to access the File {missing[0]}")
+            return
+        cached, error = self.state.cached_prefix(
+            model, _get(request, "cachedContent", "cached_content")
+        )
+        if error is not None:
+            self._send_error(*error)
+            return
+        prompt_words, cached_words = len(prompt.split()), len(cached.split())
+
+        thinking = _get(config, "thinkingConfig", "thinking_config") or {}
+        schema = _get(config, "responseSchema", "response_schema") or {}
+
+        code = self.state.model_call(
+            thinking=_get(thinking, "thinkingBudget", "thinking_budget") != 0,
+            prompt_words=prompt_words,
+        )
+        if code is not None:
+            self._send_error(code, "injected error")
+            return
+
+        with self.state.lock:
+            text = _reply(
+                f"{cached} {prompt}", len(files), self.state.config.random, schema.get("enum")
+            )
+        pieces = _pieces(text, len(files), schema, self.state.config)
+
+        delay = self.state.config.chatter_latency
+        if stream:
+            self._send_stream(
+                (
+                    delay if i else 0.0,
+                    _gemini_response(
+                        piece, len(files), model, i == len(pieces) - 1, prompt_words, cached_words
+                    ),
+                )
+                for i, piece in enumerate(pieces)
+            )
+            return
+        time.sleep(delay * (len(pieces) - 1))
+        self._send_json(
+            200, _gemini_response("".join(pieces), len(files), model, True, prompt_words, cached_words)
+        )
+
+    # Gemini 上下文缓存：cachedContents（create / get / patch ttl / delete）
+    def _cache_json(self, name: str) -> dict:
+        with self.state.lock:
+            cache = dict(self.state.caches[name])
+        return {
+            "name": name,
+            "model": f"models/{cache['model']}",
+            "displayName": cache["display_name"],
+            "createTime": cache["create_time"],
+            "updateTime": cache["update_time"],
+            "expireTime": cache["expire_time"].isoformat().replace("+00:00", "Z"),
+            "usageMetadata": {"totalTokenCount": len(cache["text"].split())},
+        }
+
+    @staticmethod
+    def _expire_time(request: dict) -> datetime:
+        ttl = request.get("ttl") or "3600s"
+        return datetime.now(timezone.utc) + timedelta(seconds=float(ttl.rstrip("s")))
+
+    def _cache_create(self, body: bytes):
+        request = json.loads(body or b"{}")
+        prompt, files, _ = _gemini_request(request)
+        tokens = len(prompt.split()) + 100 * len(files)
+        if tokens < self.state.config.cache_min_tokens:
+            self._send_error(
+                400,
+                f"Cached content is too small. total_token_count={tokens}, "
+                f"min_total_token_count={self.state.config.cache_min_tokens}",
+            )
+            return
+        name = _new_id("cachedContents/")
+        with self.state.lock:
+            self.state.caches[name] = {
+                "model": request.get("model", "").split("/")[-1],
+                "text": prompt,
+                "display_name": _get(request, "displayName", "display_name") or "",
+                "create_time": _now(),
+                "update_time": _now(),
+                "expire_time": self._expire_time(request),
+            }
+        self.state.count(caches_created=1)
+        self._send_json(200, self._cache_json(name))
+
+    def _cache_get(self, name: str):
+        with self.state.lock:
+            found = name in self.state.caches
+        if not found:
+            self._send_error(404, f"no such cached content {name}")
+            return
+        self._send_json(200, self._cache_json(name))
+
+    def _cache_update(self, name: str, body: bytes):
+        request = json.loads(body or b"{}")
+        with self.state.lock:
+            cache = self.state.caches.get(name)
+            if cache is not None:
+                cache["expire_time"] = self._expire_time(request)
+                cache["update_time"] = _now()
+        if cache is None:
+            self._send_error(404, f"no such cached content {name}")
+            return
+        self._send_json(200, self._cache_json(name))
+
+    # OpenAI 兼容接口：chat.completions（音频以 base64 内联）
+    def _chat(self, body: bytes):
+        self.state.count(chat=1)
+        request = json.loads(body or b"{}")
+        prompt, num_clips, choices = _chat_request(request)
+
+        code = self.state.model_call(thinking=request.get("reasoning_effort") != "none")
+        if code is not None:
+            self._send_error(code, "injected error")
+            return
+
+        with self.state.lock:
+            text = _reply(prompt, num_clips, self.state.config.random, choices)
+        if choices:
+            text = json.dumps({"answer": text})
+        pieces = _pieces(text, num_clips, choices, self.state.config)
+        completion = _chat_completion(request, "".join(pieces), num_clips)
+
+        delay = self.state.config.chatter_latency
+        if request.get("stream"):
+            base = {k: completion[k] for k in ("id", "created", "model")}
+
+            def chunk(delta: dict, finish_reason=None) -> dict:
+                return {
+                    **base,
+                    "object": "chat.completion.chunk",
+                    "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+                }
+
+            events = [(0.0, chunk({"role": "assistant", "content": pieces[0]}))]
+            events += [(delay, chunk({"content": piece})) for piece in pieces[1:]]
+            events.append((0.0, chunk({}, "stop")))
+            if (request.get("stream_options") or {}).get("include_usage"):
+                events.append((0.0, {**chunk({}), "choices": [], "usage": completion["usage"]}))
+            events.append((0.0, "[DONE]"))
+            self._send_stream(iter(events))
+            return
+
+        time.sleep(delay * (len(pieces) - 1))
+        self._send_json(200, completion)
+
+    # -------- Batch API --------
+    def _blob(self, name: str):
+        with self.state.lock:
+            data = self.state.blobs.get(name)
+        if data is None:
+            self._send_error(404, f"no such file {name}")
+            return
+        self._send_bytes(data)
+
+    def _start_batch(self, lines: list, kind: str, job: dict) -> str:
+        batch_id = _new_id()
+        job.update(state="pending", create_time=_now(), end_time=None, output_file=None, error_file=None,
+                   counts={"total": len(lines), "completed": 0, "failed": 0})
+        with self.state.lock:
+            self.state.batches[batch_id] = job
+        self.state.count(batch_jobs=1)
+        threading.Thread(target=self.state.run_batch, args=(batch_id, lines, kind), daemon=True).start()
+        return batch_id
+
+    @staticmethod
+    def _jsonl(data: bytes) -> list:
+        return [json.loads(line) for line in data.decode("utf-8").splitlines() if line.strip()]
+
+    # Gemini：models/{model}:batchGenerateContent，输入是上传的 jsonl 文件或内联请求
+    def _gemini_batch_create(self, model: str, body: bytes):
+        batch = json.loads(body or b"{}").get("batch", {})
+        source = _get(batch, "inputConfig", "input_config") or {}
+        file_name = _get(source, "fileName", "file_name")
+        if file_name:
+            with self.state.lock:
+                data = self.state.blobs.get(file_name)
+            if data is None:
+                self._send_error(404, f"no such file {file_name}")
+                return
+            lines = self._jsonl(data)
+        else:
+            lines = [
+                {"key": str(i), **r}
+                for i, r in enumerate(source.get("requests", {}).get("requests", []))
+            ]
+        for line in lines:
+            line.setdefault("request", {}).setdefault("model", model)
+        batch_id = self._start_batch(
+            lines, "gemini", {"model": model, "display_name": _get(batch, "displayName", "display_name")}
+        )
+        self._gemini_batch_get(batch_id)
+
+    def _gemini_batch_get(self, batch_id: str):
+        with self.state.lock:
+            job = dict(self.state.batches.get(batch_id) or {})
+        if not job:
+            self._send_error(404, f"no such batch {batch_id}")
+            return
+        states = {"pending": "BATCH_STATE_PENDING", "running": "BATCH_STATE_RUNNING", "done": "BATCH_STATE_SUCCEEDED"}
+        metadata = {
+            "@type": "type.googleapis.com/google.ai.generativelanguage.v1main.GenerateContentBatch",
+            "model": f"models/{job['model']}",
+            "displayName": job["display_name"],
+            "state": states[job["state"]],
+            "createTime": job["create_time"],
+            "updateTime": job["end_time"] or job["create_time"],
+        }
+        if job["state"] == "done":
+            metadata["endTime"] = job["end_time"]
+            output_file = "files/" + job["output_file"]
+            with self.state.lock:
+                self.state.blobs.setdefault(output_file, self.state.blobs[job["output_file"]])
+            metadata["output"] = {"responsesFile": output_file}
+        self._send_json(200, {"name": f"batches/{batch_id}", "metadata": metadata, "done": job["state"] == "done"})
+
+    # OpenAI：/v1/files（multipart 上传）+ /v1/batches
+    def _openai_file_upload(self, body: bytes):
+        message = BytesParser(policy=HTTP).parsebytes(
+            b"Content-Type: " + self.headers.get("Content-Type", "").encode() + b"\r\n\r\n" + body
+        )
+        fields = {
+            part.get_param("name", header="content-disposition"): part
+            for part in message.iter_parts()
+        }
+        data = fields["file"].get_payload(decode=True)
+        file_id = _new_id("file-")
+        with self.state.lock:
+            self.state.blobs[file_id] = data
+        self._send_json(200, {
+            "id": file_id,
+            "object": "file",
+            "bytes": len(data),
+            "created_at": int(time.time()),
+            "filename": fields["file"].get_filename() or "batch.jsonl",
+            "purpose": fields["purpose"].get_payload(decode=True).decode() if "purpose" in fields else "batch",
+            "status": "processed",
+        })
+
+    def _openai_batch_create(self, body: bytes):
+        request = json.loads(body or b"{}")
+        with self.state.lock:
+            data = self.state.blobs.get(request.get("input_file_id"))
+        if data is None:
+            self._send_error(404, f"no such file {request.get('input_file_id')}")
+            return
+        batch_id = self._start_batch(self._jsonl(data), "openai", {"request": request})
+        self._openai_batch_get(batch_id)
+
+    def _openai_batch_get(self, batch_id: str):
+        with self.state.lock:
+            job = dict(self.state.batches.get(batch_id) or {})
+        if not job:
+            self._send_error(404, f"no such batch {batch_id}")
+            return
+        request = job["request"]
+        statuses = {"pending": "validating", "running": "in_progress", "done": "completed"}
+        self._send_json(200, {
+            "id": batch_id,
+            "object": "batch",
+            "endpoint": request.get("endpoint"),
+            "input_file_id": request.get("input_file_id"),
+            "completion_window": request.get("completion_window", "24h"),
+            "status": statuses[job["state"]],
+            "created_at": int(time.time()),
+            "output_file_id": job["output_file"],
+            "error_file_id": job["error_file"],
+            "request_counts": job["counts"],
+            "metadata": request.get("metadata"),
+        })
+
+
+class _HTTPServer(ThreadingHTTPServer):
+    # 默认 backlog 只有 5：几百个并发连接同时建连会被丢 SYN，客户端要等重传
+    request_queue_size = 1024
+    daemon_threads = True
+
+
+class MockServer:
+    """
+    Local stand-in for the Gemini (upload / generateContent) and OpenAI
+    (chat.completions) endpoints, served from a background thread.
+
+        with MockServer(MockConfig(latency=0.1, quota_rate=0.05)) as server:
+            get_client("gemini", api_key="mock", base_url=server.url)
+            get_client("openai", api_key="mock", base_url=server.url + "/v1")
+    """
+
+    def __init__(self, config: MockConfig | None = None, host: str = "127.0.0.1", port: int = 0):
+        self.state = MockState(config or MockConfig())
+        handler = type("Handler", (MockHandler,), {"state": self.state})
+        self.httpd = _HTTPServer((host, port), handler)
+        self.url = f"http://{host}:{self.httpd.server_address[1]}"
+        self.thread = None
+
+    def start(self) -> "MockServer":
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local mock Gemini / OpenAI server")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--jitter", type=float, default=0.05)
+    parser.add_argument("--upload-latency", type=float, default=0.05)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--quota-rate", type=float, default=0.0)
+    parser.add_argument("--capacity", type=int)
+    parser.add_argument("--thinking-latency", type=float, default=0.0)
+    parser.add_argument("--chatter-words", type=int, default=0)
+    parser.add_argument("--chatter-latency", type=float, default=0.0)
+    parser.add_argument("--batch-latency", type=float, default=1.0)
+    parser.add_argument("--prompt-latency", type=float, default=0.0)
+    parser.add_argument("--cache-min-tokens", type=int, default=0)
+    args = parser.parse_args()
+
+    config = MockConfig(
+        latency=args.latency,
+        jitter=args.jitter,
+        upload_latency=args.upload_latency,
+        error_rate=args.error_rate,
+        quota_rate=args.quota_rate,
+        capacity=args.capacity,
+        thinking_latency=args.thinking_latency,
+        chatter_words=args.chatter_words,
+        chatter_latency=args.chatter_latency,
+        batch_latency=args.batch_latency,
+        prompt_latency=args.prompt_latency,
+        cache_min_tokens=args.cache_min_tokens,
+    )
+    server = MockServer(config, port=args.port)
+    print(f"Mock server on {server.url}  (stats: GET {server.url}/_stats)")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
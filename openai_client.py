@@ -1,18 +1,20 @@
 # openai_client.py
 
+import asyncio
 import base64
+import mmap
 import os
-import time
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
+from generation import unwrap_answer
+from metrics import record, timed
+from rate_limiter import DailyQuotaExceeded
+from retry import DEFAULT_RETRY_POLICY
 
+# input_audio 只接受 wav / mp3：扩展名 -> format
+_AUDIO_FORMATS = {".wav": "wav", ".wave": "wav", ".mp3": "mp3"}
 
-def init_openai_client(
-    api_key: str | None = None,
-    base_url: str | None = None,
-):
-    """
-    Initialize OpenAI-compatible client (for Gemini proxy / relay).
-    """
+
+def _openai_config(api_key: str | None, base_url: str | None) -> tuple:
     if api_key is None:
         api_key = os.environ.get("OPENAI_API_KEY") or os.environ.get("GOOGLE_API_KEY")
 
@@ -25,10 +27,247 @@ def init_openai_client(
     if not base_url:
         raise RuntimeError("OPENAI_BASE_URL is not set")
 
-    return OpenAI(
-        api_key=api_key,
-        base_url=base_url.rstrip("/"),
-    )
+    return api_key, base_url.rstrip("/")
+
+
+def init_openai_client(
+    api_key: str | None = None,
+    base_url: str | None = None,
+    **client_kwargs,
+):
+    """
+    Initialize OpenAI-compatible client (for Gemini proxy / relay).
+
+    client_kwargs (http_client, max_retries, timeout, ...) go to OpenAI();
+    client_registry uses them to share one pooled keep-alive client.
+    """
+    api_key, base_url = _openai_config(api_key, base_url)
+    return OpenAI(api_key=api_key, base_url=base_url, **client_kwargs)
+
+
+def init_async_openai_client(
+    api_key: str | None = None,
+    base_url: str | None = None,
+    **client_kwargs,
+):
+    """
+    Same as init_openai_client, but returns an AsyncOpenAI client.
+    """
+    api_key, base_url = _openai_config(api_key, base_url)
+    return AsyncOpenAI(api_key=api_key, base_url=base_url, **client_kwargs)
+
+
+def encode_audio_base64(wav_path: str) -> str:
+    """
+    Base64-encode a file for an inline input_audio part.
+
+    Memory is NOT bounded: the chat.completions body is one JSON document,
+    so the whole encoded clip (4/3 of the file) has to exist as bytes and
+    then as a str, and the SDK serialises another copy when it sends it.
+    The file is memory-mapped, so the raw bytes stay in the page cache
+    rather than a second heap buffer. Keep clips short (PreprocessConfig)
+    or use the gemini backend (Files API upload) for long audio.
+    """
+    if os.path.getsize(wav_path) == 0:
+        return ""
+    with open(wav_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        return base64.b64encode(mm).decode("ascii")
+
+
+def _input_audio_format(wav_path: str) -> str:
+    """
+    input_audio format for a file; other formats (flac, ogg, m4a, ...) are
+    rejected with ValueError, since the endpoint only decodes wav / mp3.
+    Convert them first, e.g. PreprocessConfig(codec="mp3").
+    """
+    ext = os.path.splitext(wav_path)[1].lower()
+    if ext not in _AUDIO_FORMATS:
+        raise ValueError(
+            f"input_audio only takes wav / mp3, got {ext or 'no extension'}: {wav_path} "
+            f'(convert it first, e.g. PreprocessConfig(codec="mp3"))'
+        )
+    return _AUDIO_FORMATS[ext]
+
+
+def _audio_part(wav_path: str) -> dict:
+    audio_format = _input_audio_format(wav_path)
+    return {
+        "type": "input_audio",
+        "input_audio": {
+            "data": encode_audio_base64(wav_path),
+            "format": audio_format,
+        },
+    }
+
+
+def build_audio_messages(prompt: str, wav_path: str) -> list:
+    """
+    Build the chat messages (prompt + inline base64 audio) for one request.
+    """
+    return [
+        {
+            "role": "user",
+            "content": [
+                {"type": "text", "text": prompt},
+                _audio_part(wav_path),
+            ],
+        }
+    ]
+
+
+def build_batch_audio_messages(prompt: str, wav_paths: list) -> list:
+    """
+    Like build_audio_messages, but with several clips labelled "Clip i:".
+    """
+    content = [{"type": "text", "text": prompt}]
+    for i, wav_path in enumerate(wav_paths, start=1):
+        content.append({"type": "text", "text": f"Clip {i}:"})
+        content.append(_audio_part(wav_path))
+    return [{"role": "user", "content": content}]
+
+
+def _record_usage(response) -> None:
+    usage = getattr(response, "usage", None)
+    if usage is not None:
+        record(
+            prompt_tokens=usage.prompt_tokens or 0,
+            output_tokens=usage.completion_tokens or 0,
+            # Gemini 2.5 对相同前缀自动（隐式）缓存，命中数在这里
+            cached_tokens=getattr(usage.prompt_tokens_details, "cached_tokens", None) or 0,
+        )
+
+
+def _response_text(response) -> str:
+    _record_usage(response)
+    choice = response.choices[0]
+    if choice.message.content is None:
+        # 思考把 max_tokens 用完等情况：重试也一样，当作无效回答
+        raise ValueError(f"empty reply (finish_reason={choice.finish_reason})")
+    # 带 response schema 时回复是 {"answer": ...}
+    return unwrap_answer(choice.message.content.strip().lower())
+
+
+def _stream_params(generation) -> dict:
+    if generation is None or not generation.stream:
+        return {}
+    # usage 只在最后一个 chunk 里；提前关闭的流拿不到
+    return {"stream": True, "stream_options": {"include_usage": True}}
+
+
+def _chunk_text(chunk) -> str:
+    _record_usage(chunk)
+    if not chunk.choices:
+        return ""
+    return chunk.choices[0].delta.content or ""
+
+
+def _stream_text(stream, generation) -> str:
+    """
+    Read a streamed chat completion until the reply starts with a complete
+    answer (generation.early_answer), then close the connection.
+    """
+    text = ""
+    with stream:
+        for chunk in stream:
+            text += _chunk_text(chunk)
+            answer = generation.early_answer(text.lower())
+            if answer is not None:
+                record(early_stop=1)
+                return answer
+    return unwrap_answer(text.strip().lower())
+
+
+async def _stream_text_async(stream, generation) -> str:
+    text = ""
+    async with stream:
+        async for chunk in stream:
+            text += _chunk_text(chunk)
+            answer = generation.early_answer(text.lower())
+            if answer is not None:
+                record(early_stop=1)
+                return answer
+    return unwrap_answer(text.strip().lower())
+
+
+def _chat(
+    client,
+    model_name: str,
+    messages: list,
+    retry_policy,
+    label: str,
+    raise_errors: bool = False,
+    input_bytes: int = 0,
+    generation=None,
+    rate_limiter=None,
+) -> str:
+    policy = retry_policy or DEFAULT_RETRY_POLICY
+    params = generation.openai_params(model_name) if generation is not None else {}
+    params.update(_stream_params(generation))
+
+    def attempt():
+        # 每次尝试（包括重试）都占一个限速名额
+        if rate_limiter is not None:
+            with timed("queue_sec"):
+                rate_limiter.acquire(model_name)
+        # 音频内联在请求里，每次重试都会重新发送
+        record(input_bytes=input_bytes)
+        with timed("model_sec"):
+            response = client.chat.completions.create(
+                model=model_name,
+                messages=messages,
+                **params,
+            )
+            if params.get("stream"):
+                return _stream_text(response, generation)
+
+        return _response_text(response)
+
+    try:
+        return policy.call(attempt, label=f"[OpenAI Proxy] {label}")
+    except Exception as e:
+        if raise_errors or isinstance(e, DailyQuotaExceeded):
+            raise
+        print(f"[OpenAI Proxy] giving up on {label}: {e}")
+        return "error"
+
+
+async def _chat_async(
+    client,
+    model_name: str,
+    messages: list,
+    retry_policy,
+    label: str,
+    raise_errors: bool = False,
+    input_bytes: int = 0,
+    generation=None,
+    rate_limiter=None,
+) -> str:
+    policy = retry_policy or DEFAULT_RETRY_POLICY
+    params = generation.openai_params(model_name) if generation is not None else {}
+    params.update(_stream_params(generation))
+
+    async def attempt():
+        if rate_limiter is not None:
+            with timed("queue_sec"):
+                await rate_limiter.acquire_async(model_name)
+        record(input_bytes=input_bytes)
+        with timed("model_sec"):
+            response = await client.chat.completions.create(
+                model=model_name,
+                messages=messages,
+                **params,
+            )
+            if params.get("stream"):
+                return await _stream_text_async(response, generation)
+        return _response_text(response)
+
+    try:
+        return await policy.call_async(attempt, label=f"[OpenAI Proxy] {label}")
+    except Exception as e:
+        if raise_errors or isinstance(e, DailyQuotaExceeded):
+            raise
+        print(f"[OpenAI Proxy] giving up on {label}: {e}")
+        return "error"
 
 
 def classify_audio_with_openai(
@@ -36,47 +275,71 @@ def classify_audio_with_openai(
     model_name: str,
     prompt: str,
     wav_path: str,
-    retries: int = 3,
-    wait_sec: int = 10,
+    retry_policy=None,
+    raise_errors: bool = False,
+    generation=None,
+    rate_limiter=None,
 ) -> str:
     """
     Input wav path, return model output text.
     (Works for both classification and score tasks.)
+
+    retry_policy: retry.RetryPolicy (DEFAULT_RETRY_POLICY if None).
+    raise_errors: re-raise the final error instead of returning "error".
+    generation: optional generation.GenerationProfile, sent as
+    temperature / max_tokens / reasoning_effort / response_format; with
+    generation.stream the completion is streamed and closed as soon as it
+    starts with an answer.
+    rate_limiter: optional rate_limiter.QuotaScheduler, acquired once per
+    attempt (a retried request takes another slot); DailyQuotaExceeded is
+    always re-raised.
     """
-    # read audio
-    with open(wav_path, "rb") as f:
-        audio_bytes = f.read()
+    # 只编码一次，重试时复用同一份 payload
+    messages = build_audio_messages(prompt, wav_path)
+    return _chat(
+        client, model_name, messages, retry_policy, os.path.basename(wav_path),
+        raise_errors, os.path.getsize(wav_path), generation, rate_limiter,
+    )
 
-    audio_base64 = base64.b64encode(audio_bytes).decode("utf-8")
 
-    for attempt in range(retries):
-        try:
-            response = client.chat.completions.create(
-                model=model_name,
-                messages=[
-                    {
-                        "role": "user",
-                        "content": [
-                            {"type": "text", "text": prompt},
-                            {
-                                "type": "input_audio",
-                                "input_audio": {
-                                    "data": audio_base64,
-                                    "format": "wav",
-                                },
-                            },
-                        ],
-                    }
-                ],
-            )
+def classify_audio_batch_with_openai(
+    client,
+    model_name: str,
+    prompt: str,
+    wav_paths: list,
+    retry_policy=None,
+    raise_errors: bool = False,
+    generation=None,
+    rate_limiter=None,
+) -> str:
+    """
+    Send several clips in one request; returns the raw answer text.
+    """
+    messages = build_batch_audio_messages(prompt, wav_paths)
+    return _chat(
+        client, model_name, messages, retry_policy, os.path.basename(wav_paths[0]),
+        raise_errors, sum(os.path.getsize(p) for p in wav_paths), generation, rate_limiter,
+    )
 
-            return response.choices[0].message.content.strip().lower()
 
-        except Exception as e:
-            print(
-                f"[OpenAI Proxy] request failed "
-                f"({attempt + 1}/{retries}): {e}"
-            )
-            time.sleep(wait_sec)
+async def classify_audio_with_openai_async(
+    client,
+    model_name: str,
+    prompt: str,
+    wav_path: str,
+    retry_policy=None,
+    raise_errors: bool = False,
+    generation=None,
+    rate_limiter=None,
+) -> str:
+    """
+    Async classify_audio_with_openai; `client` is an AsyncOpenAI client
+    (client_registry.get_client("openai_async", ...)).
+    """
+    # base64 编码放到线程里，不阻塞事件循环
+    messages = await asyncio.to_thread(build_audio_messages, prompt, wav_path)
+    return await _chat_async(
+        client, model_name, messages, retry_policy, os.path.basename(wav_path),
+        raise_errors, os.path.getsize(wav_path), generation, rate_limiter,
+    )
 
-    return "error"
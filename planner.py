@@ -0,0 +1,213 @@
+# planner.py
+
+import os
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+from evaluate import load_existing_results, run_tasks
+from metrics import print_summary, summarize
+from prompt_registry import get_prompt
+from rate_limiter import DailyQuotaExceeded
+from result_writer import close_writer
+from task import run_audio_batch_task
+
+
+@dataclass(frozen=True)
+class WorkItem:
+    svs_model: str
+    genre: str
+    model_name: str
+    variant: str
+    prompt: str
+    prompt_hash: str
+    key: str
+    wav_path: str
+    output_jsonl: str
+
+
+def output_jsonl_for(wav_dir: Path, model_name: str, variant: str, tag_model: bool, tag_variant: bool) -> str:
+    """
+    e.g. samples_for_gemini/suno_visinger2/suno_visinger2_rock.jsonl; the
+    model / variant suffixes are only added when the sweep has several.
+    """
+    name = f"{wav_dir.parent.name}_{wav_dir.name}"
+    if tag_model:
+        name += f"__{model_name}"
+    if tag_variant:
+        name += f"__{variant}"
+    return str(wav_dir.parent / f"{name}.jsonl")
+
+
+def plan_style_sweep(
+    svs_models: list,
+    genres: list,
+    model_names: list,
+    extra_prompt_map: dict | None = None,
+    variants: list = ("extra",),
+    root: str = "samples_for_gemini",
+    result_store=None,
+) -> tuple[list, list]:
+    """
+    Enumerate every (SVS model, genre, backend model, prompt variant, file)
+    vocal-style work item up front, skipping keys already in each output
+    jsonl (or result_store) and duplicate items. Prompts come from
+    prompt_registry (variants: its VARIANTS); extra_prompt_map None reads
+    genre_extra_prompts.json.
+
+    Returns (pending WorkItems, every output jsonl of the sweep).
+    """
+    items = []
+    outputs = []
+    seen = set()
+    for svs_model in svs_models:
+        for genre in genres:
+            wav_dir = Path(root) / f"suno_{svs_model}" / genre
+            if not wav_dir.exists():
+                print(f"[Planner] folder not found, skipped: {wav_dir}")
+                continue
+
+            fnames = [
+                f for f in sorted(os.listdir(wav_dir)) if f.endswith((".wav", ".mp3"))
+            ]
+            for variant in variants:
+                prompt = get_prompt("vocal_style", genre, variant, extra_prompt_map)
+                for model_name in model_names:
+                    output_jsonl = output_jsonl_for(
+                        wav_dir, model_name, variant, len(model_names) > 1, len(variants) > 1
+                    )
+                    outputs.append(output_jsonl)
+                    run = os.path.splitext(os.path.basename(output_jsonl))[0]
+                    if result_store is not None:
+                        result_store.sync_jsonl(
+                            run,
+                            output_jsonl,
+                            model=model_name,
+                            prompt_hash=prompt.hash,
+                            genre=genre,
+                        )
+                        done = result_store.done_keys(run)
+                    else:
+                        done = load_existing_results(output_jsonl)
+
+                    for fname in fnames:
+                        key = os.path.splitext(fname)[0]
+                        if key in done or (output_jsonl, key) in seen:
+                            continue
+                        seen.add((output_jsonl, key))
+                        items.append(
+                            WorkItem(
+                                svs_model=svs_model,
+                                genre=genre,
+                                model_name=model_name,
+                                variant=variant,
+                                prompt=prompt.text,
+                                prompt_hash=prompt.hash,
+                                key=key,
+                                wav_path=str(wav_dir / fname),
+                                output_jsonl=output_jsonl,
+                            )
+                        )
+    return items, outputs
+
+
+def run_plan(
+    items: list,
+    client,
+    backend: str = "gemini",
+    max_in_flight: int = 1,
+    batch_size: int = 1,
+    result_store=None,
+    concurrency=None,
+    **task_kwargs,
+) -> list:
+    """
+    Run all planned items through ONE shared worker pool (no stall at folder
+    boundaries). Results go to each item's output jsonl as they finish.
+    Stops cleanly on DailyQuotaExceeded. Returns the new result dicts.
+    concurrency: optional concurrency.AdaptiveConcurrency (see run_tasks).
+    """
+    # 同一个输出文件的条目才能打包进同一个请求
+    groups = {}
+    for item in items:
+        groups.setdefault(item.output_jsonl, []).append(item)
+    batches = []
+    for group in groups.values():
+        for i in range(0, len(group), max(batch_size, 1)):
+            batches.append((group[i:i + batch_size],))
+
+    quota_hit = threading.Event()
+
+    def run_batch(batch):
+        if quota_hit.is_set():
+            return []
+        first = batch[0]
+        try:
+            results = run_audio_batch_task(
+                backend=backend,
+                client=client,
+                model_name=first.model_name,
+                prompt=first.prompt,
+                wav_paths=[item.wav_path for item in batch],
+                output_jsonl=first.output_jsonl,
+                task_type="score",
+                **task_kwargs,
+            )
+        except DailyQuotaExceeded as e:
+            if not quota_hit.is_set():
+                quota_hit.set()
+                print(f"\n[Quota] {e}; stopping, rerun later to resume.")
+            return []
+        if result_store is not None:
+            result_store.put_many(
+                os.path.splitext(os.path.basename(first.output_jsonl))[0],
+                results,
+                model=first.model_name,
+                prompt_hash=first.prompt_hash,
+                genre=first.genre,
+            )
+        return results
+
+    new_results = []
+    start = time.perf_counter()
+    for results in run_tasks(
+        run_batch, batches, max_in_flight, desc="Sweep", concurrency=concurrency
+    ):
+        new_results.extend(results)
+    wall_sec = time.perf_counter() - start
+
+    if new_results:
+        print_summary(summarize(new_results, wall_sec))
+
+    for output_jsonl in groups:
+        close_writer(output_jsonl)
+        if result_store is not None and os.path.exists(output_jsonl):
+            result_store.mark_synced(
+                os.path.splitext(os.path.basename(output_jsonl))[0], output_jsonl
+            )
+    return new_results
+
+
+def summarize_outputs(output_jsonls: list, result_store=None) -> dict:
+    """
+    {output_jsonl: mean vocal-style score} over all results in each file.
+    """
+    summary = {}
+    for output_jsonl in output_jsonls:
+        run = os.path.splitext(os.path.basename(output_jsonl))[0]
+        if result_store is not None:
+            stats = result_store.stats(run)
+            num_scored, mean_score = stats["scored"], stats["mean_score"]
+        else:
+            scores = [
+                r["score"]
+                for r in load_existing_results(output_jsonl).values()
+                if isinstance(r.get("score"), (int, float)) and r["score"] > 0
+            ]
+            num_scored = len(scores)
+            mean_score = sum(scores) / num_scored if num_scored else 0.0
+
+        print(f"{run}: files {num_scored}, mean vocal-style score {mean_score:.2f}")
+        summary[output_jsonl] = mean_score
+    return summary
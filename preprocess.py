@@ -0,0 +1,107 @@
+# preprocess.py
+
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+from dataclasses import asdict, dataclass
+
+from hash_utils import file_sha256
+
+# 输出格式 -> ffmpeg 编码器
+CODECS = {
+    "mp3": "libmp3lame",
+    "ogg": "libopus",
+    "flac": "flac",
+    "wav": "pcm_s16le",
+}
+
+
+@dataclass(frozen=True)
+class PreprocessConfig:
+    """
+    What to do with each clip before it is sent to the model.
+
+    max_duration / offset: keep only [offset, offset + max_duration) seconds
+    (None keeps the whole clip). sample_rate None keeps the source rate.
+    bitrate is ignored for lossless codecs.
+    """
+
+    max_duration: float | None = 10.0
+    offset: float = 0.0
+    sample_rate: int | None = 16000
+    mono: bool = True
+    codec: str = "mp3"
+    bitrate: str = "64k"
+    cache_dir: str = "preprocess_cache"
+
+    def digest(self) -> str:
+        settings = asdict(self)
+        settings.pop("cache_dir")
+        return hashlib.sha256(
+            json.dumps(settings, sort_keys=True).encode("utf-8")
+        ).hexdigest()
+
+
+def build_ffmpeg_command(src_path: str, out_path: str, config: PreprocessConfig) -> list:
+    if config.codec not in CODECS:
+        raise ValueError(f"Unknown codec: {config.codec}")
+
+    cmd = ["ffmpeg", "-nostdin", "-loglevel", "error", "-y"]
+    if config.offset:
+        cmd += ["-ss", str(config.offset)]
+    cmd += ["-i", src_path, "-vn", "-map_metadata", "-1"]
+    if config.max_duration is not None:
+        cmd += ["-t", str(config.max_duration)]
+    if config.mono:
+        cmd += ["-ac", "1"]
+    if config.sample_rate is not None:
+        cmd += ["-ar", str(config.sample_rate)]
+    cmd += ["-c:a", CODECS[config.codec]]
+    if config.codec in ("mp3", "ogg"):
+        cmd += ["-b:a", config.bitrate]
+    cmd += ["-f", config.codec, out_path]
+    return cmd
+
+
+def preprocess_audio(src_path: str, config: PreprocessConfig) -> tuple[str, dict]:
+    """
+    Trim / resample / downmix / re-encode one clip, cached by source hash.
+
+    Returns (path_to_send, stats) where stats holds the source and output
+    sizes in bytes.
+    """
+    os.makedirs(config.cache_dir, exist_ok=True)
+    name = f"{file_sha256(src_path)[:20]}_{config.digest()[:10]}.{config.codec}"
+    out_path = os.path.join(config.cache_dir, name)
+
+    if not os.path.exists(out_path):
+        if shutil.which("ffmpeg") is None:
+            raise RuntimeError("ffmpeg not found on PATH (needed for audio preprocessing)")
+
+        # 先写临时文件再 rename，并发处理同一文件时不会读到半个文件
+        fd, tmp_path = tempfile.mkstemp(dir=config.cache_dir, suffix="." + config.codec)
+        os.close(fd)
+        try:
+            subprocess.run(
+                build_ffmpeg_command(src_path, tmp_path, config),
+                check=True,
+                capture_output=True,
+            )
+            os.replace(tmp_path, out_path)
+        except subprocess.CalledProcessError as e:
+            os.remove(tmp_path)
+            raise RuntimeError(
+                f"ffmpeg failed on {src_path}: {e.stderr.decode(errors='replace').strip()}"
+            ) from e
+
+    src_bytes = os.path.getsize(src_path)
+    out_bytes = os.path.getsize(out_path)
+    stats = {
+        "src_bytes": src_bytes,
+        "sent_bytes": out_bytes,
+        "reduction": 1 - out_bytes / src_bytes if src_bytes else 0.0,
+    }
+    return out_path, stats
@@ -1,5 +1,7 @@
 # prompt.py
 
+from functools import lru_cache
+
 GENRE_DESCRIPTIONS = {
     "blues": "emotional guitar-based music with slow rhythm and soulful vocals",
     "classical": "orchestral or instrumental music with structured composition and no modern beats",
@@ -23,6 +25,8 @@ GENRE_DESCRIPTIONS = {
 }
 
 
+# 构建函数都是纯函数：同样的参数直接返回缓存的字符串
+@lru_cache(maxsize=None)
 def build_genre_prompt() -> str:
     genre_lines = "\n".join(
         f"- {genre}: {desc}" for genre, desc in GENRE_DESCRIPTIONS.items()
@@ -39,6 +43,7 @@ def build_genre_prompt() -> str:
     )
     return prompt
 
+@lru_cache(maxsize=1024)
 def build_vocal_style_prompt(
     genre: str = "rock",
     extra_genre_prompt: str | None = None,
@@ -74,3 +79,23 @@ def build_vocal_style_prompt(
         "Output ONLY a single integer from 1 to 5.\n"
         "Do not include explanations or extra text."
     )
+
+
+@lru_cache(maxsize=1024)
+def build_batch_prompt(task_prompt: str, num_clips: int) -> str:
+    """
+    Wrap a single-clip prompt (build_genre_prompt / build_vocal_style_prompt)
+    so that one request answers it for `num_clips` labelled clips.
+    """
+    return (
+        f"You will be given {num_clips} audio clips, labelled Clip 1 to Clip {num_clips}. "
+        "Judge each clip independently; do not compare them with each other.\n\n"
+        "The task for EACH clip is:\n"
+        "-----\n"
+        f"{task_prompt.strip()}\n"
+        "-----\n\n"
+        f"Output exactly {num_clips} lines, one per clip, in the form "
+        "\"<clip number>: <answer>\" (for example \"1: ...\"), where <answer> "
+        "is exactly what the output rule above asks for that clip. "
+        "Do not include any other text."
+    )
@@ -1,12 +1,32 @@
 import json
 import os
+import threading
+
+# (abspath, size, mtime_ns) -> dict：文件没改就不重复读
+_CACHE = {}
+_LOCK = threading.Lock()
+
 
 def load_extra_genre_prompts(path: str) -> dict:
+    """
+    {genre: extra prompt} from a json file, read once per file version
+    (re-read only when its size / mtime change). Treat the result as read-only.
+    """
     if not os.path.exists(path):
         return {}
 
+    st = os.stat(path)
+    stamp = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    with _LOCK:
+        prompts = _CACHE.get(stamp)
+    if prompts is not None:
+        return prompts
+
     with open(path, "r", encoding="utf-8") as f:
-        return json.load(f)
+        prompts = json.load(f)
+    with _LOCK:
+        _CACHE[stamp] = prompts
+    return prompts
 
 
 def get_extra_genre_prompt(
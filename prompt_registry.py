@@ -0,0 +1,89 @@
+# prompt_registry.py
+
+import threading
+from dataclasses import dataclass
+from functools import lru_cache
+
+from hash_utils import text_sha256
+from prompt import build_genre_prompt, build_vocal_style_prompt
+from prompt_loader import get_extra_genre_prompt, load_extra_genre_prompts
+
+EXTRA_PROMPTS_PATH = "genre_extra_prompts.json"
+
+# 模板名 -> (genre, extra_genre_prompt) -> prompt 文本
+TEMPLATES = {
+    "vocal_style": lambda genre, extra: build_vocal_style_prompt(
+        genre=genre or "rock", extra_genre_prompt=extra or None
+    ),
+    "genre": lambda genre, extra: build_genre_prompt(),
+}
+
+# 变体名 -> 是否带上 genre_extra_prompts.json 里的补充说明
+VARIANTS = {
+    "extra": True,
+    "plain": False,
+}
+
+
+@dataclass(frozen=True)
+class CompiledPrompt:
+    template: str
+    genre: str | None
+    variant: str
+    text: str
+    hash: str
+
+
+_PROMPTS = {}
+_LOCK = threading.Lock()
+
+
+@lru_cache(maxsize=1024)
+def prompt_hash(text: str) -> str:
+    """
+    Stable id of a prompt: sha256 of its text, as stored in ResultStore's
+    prompt_hash column and used in response cache keys.
+    """
+    return text_sha256(text)
+
+
+def get_prompt(
+    template: str = "vocal_style",
+    genre: str | None = None,
+    variant: str = "extra",
+    extra_prompts: dict | None = None,
+) -> CompiledPrompt:
+    """
+    The compiled prompt for (template, genre, variant), built once per process.
+
+    variant "extra" appends the genre's snippet from extra_prompts (default:
+    genre_extra_prompts.json, read once per file version); "plain" leaves it
+    out. Editing the snippet file yields a new prompt (and hash) on the
+    next call.
+    """
+    if template not in TEMPLATES:
+        raise ValueError(f"Unknown prompt template: {template}")
+    if variant not in VARIANTS:
+        raise ValueError(f"Unknown prompt variant: {variant}")
+
+    genre = genre.lower() if genre else None
+    extra = ""
+    if VARIANTS[variant] and genre:
+        if extra_prompts is None:
+            extra_prompts = load_extra_genre_prompts(EXTRA_PROMPTS_PATH)
+        extra = get_extra_genre_prompt(genre, extra_prompts)
+
+    # extra 文本也进 key：补充说明改了就是另一个 prompt
+    cache_key = (template, genre, variant, extra)
+    with _LOCK:
+        compiled = _PROMPTS.get(cache_key)
+    if compiled is not None:
+        return compiled
+
+    text = TEMPLATES[template](genre, extra)
+    compiled = CompiledPrompt(
+        template=template, genre=genre, variant=variant, text=text, hash=prompt_hash(text)
+    )
+    with _LOCK:
+        _PROMPTS[cache_key] = compiled
+    return compiled
@@ -0,0 +1,189 @@
+# rate_limiter.py
+
+import asyncio
+import datetime
+import json
+import os
+import threading
+import time
+
+from retry import BAD_INPUT
+
+# 多个模型的 limiter 共用同一个 state 文件
+_STATE_LOCK = threading.Lock()
+
+
+class DailyQuotaExceeded(RuntimeError):
+    """Raised when a model has used up its requests-per-day budget."""
+
+    # 今天的额度用完了，重试也没用；评测循环捕获它后停下
+    retry_kind = BAD_INPUT
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: `rate` tokens per second, at most `capacity` banked.
+    """
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """
+        Take one token and return how many seconds the caller must wait for it.
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(
+                self.capacity, self.tokens + (now - self.updated) * self.rate
+            )
+            self.updated = now
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+    def acquire(self) -> None:
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self) -> None:
+        wait = self.reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+class RateLimiter:
+    """
+    Requests-per-minute pacing plus an optional requests-per-day budget.
+
+    The daily count resets at local midnight. With state_path the count is
+    persisted so restarting a run does not forget what was already spent.
+    """
+
+    def __init__(
+        self,
+        rpm: float | None = None,
+        rpd: int | None = None,
+        name: str = "",
+        state_path: str | None = None,
+    ):
+        self.name = name
+        self.rpd = rpd
+        self.state_path = state_path
+        self.bucket = TokenBucket(rpm / 60.0, capacity=1.0) if rpm else None
+        self.lock = threading.Lock()
+        self.day = datetime.date.today().isoformat()
+        self.used_today = 0
+        self._load_state()
+
+    def _load_state(self):
+        if not self.state_path or not os.path.exists(self.state_path):
+            return
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except Exception:
+            return
+        if state.get("date") == self.day:
+            self.used_today = state.get("counts", {}).get(self.name, 0)
+
+    def _save_state(self):
+        if not self.state_path:
+            return
+        with _STATE_LOCK:
+            self._write_state()
+
+    def _write_state(self):
+        state = {"date": self.day, "counts": {}}
+        if os.path.exists(self.state_path):
+            try:
+                with open(self.state_path, "r", encoding="utf-8") as f:
+                    old = json.load(f)
+                if old.get("date") == self.day:
+                    state["counts"] = old.get("counts", {})
+            except Exception:
+                pass
+        state["counts"][self.name] = self.used_today
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.state_path)
+
+    def _take_daily(self):
+        with self.lock:
+            today = datetime.date.today().isoformat()
+            if today != self.day:
+                self.day = today
+                self.used_today = 0
+            if self.rpd is not None and self.used_today >= self.rpd:
+                raise DailyQuotaExceeded(
+                    f"{self.name or 'model'}: daily budget of {self.rpd} requests used up"
+                )
+            self.used_today += 1
+            self._save_state()
+
+    def remaining_today(self) -> int | None:
+        if self.rpd is None:
+            return None
+        return max(self.rpd - self.used_today, 0)
+
+    def acquire(self) -> None:
+        """
+        Block until a request may be sent. Raises DailyQuotaExceeded when the
+        daily budget is exhausted, so callers can stop cleanly.
+        """
+        self._take_daily()
+        if self.bucket is not None:
+            self.bucket.acquire()
+
+    async def acquire_async(self) -> None:
+        self._take_daily()
+        if self.bucket is not None:
+            await self.bucket.acquire_async()
+
+
+class QuotaScheduler:
+    """
+    One RateLimiter per model, shared by every backend call site.
+
+    quotas: {model_name: {"rpm": ..., "rpd": ...}}; models not listed are
+    not throttled.
+    """
+
+    def __init__(self, quotas: dict, state_path: str | None = None):
+        self.quotas = quotas
+        self.state_path = state_path
+        self.limiters = {}
+        self.lock = threading.Lock()
+
+    def get(self, model_name: str) -> RateLimiter | None:
+        with self.lock:
+            if model_name not in self.limiters:
+                quota = self.quotas.get(model_name)
+                self.limiters[model_name] = (
+                    RateLimiter(
+                        rpm=quota.get("rpm"),
+                        rpd=quota.get("rpd"),
+                        name=model_name,
+                        state_path=self.state_path,
+                    )
+                    if quota
+                    else None
+                )
+            return self.limiters[model_name]
+
+    def acquire(self, model_name: str) -> None:
+        limiter = self.get(model_name)
+        if limiter is not None:
+            limiter.acquire()
+
+    async def acquire_async(self, model_name: str) -> None:
+        limiter = self.get(model_name)
+        if limiter is not None:
+            await limiter.acquire_async()
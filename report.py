@@ -0,0 +1,238 @@
+# report.py
+
+import argparse
+import glob
+import json
+import os
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+# 结果 jsonl 里可能出现的字段；pop 旧脚本用 "music" 当 key
+_FIELDS = ("key", "score", "pred", "true", "model", "genre")
+
+
+# -------- 读取 --------
+def _read_jsonl(path: str) -> list:
+    rows = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                rows.append(json.loads(line))
+            except Exception:
+                continue  # 被中断写了一半的行
+    return rows
+
+
+def _expand(paths) -> list:
+    if isinstance(paths, str):
+        paths = [paths]
+    files = []
+    for p in paths:
+        if os.path.isdir(p):
+            files.extend(sorted(glob.glob(os.path.join(p, "**", "*.jsonl"), recursive=True)))
+        else:
+            files.extend(sorted(glob.glob(p)) or [p])
+    return files
+
+
+def _normalize(df: pd.DataFrame) -> pd.DataFrame:
+    for col in _FIELDS:
+        if col not in df:
+            df[col] = None
+    df["score"] = pd.to_numeric(df["score"], errors="coerce")
+    # pop 的 true 是数字、pred 是字符串：统一成字符串再比较
+    for col in ("pred", "true"):
+        df[col] = df[col].where(df[col].isna(), df[col].astype(str).str.strip().str.lower())
+    df = df.drop_duplicates(["run", "key"], keep="last")
+    return df.reset_index(drop=True)
+
+
+def load_results(paths) -> pd.DataFrame:
+    """
+    One row per (run, key) from result jsonl files (paths, globs or folders
+    searched recursively). run is the file name without extension; later
+    lines win for a repeated key. Columns: run, key, score, pred, true,
+    model, genre (missing fields are null).
+    """
+    frames = []
+    for path in _expand(paths):
+        rows = _read_jsonl(path)
+        if not rows:
+            continue
+        df = pd.DataFrame.from_records(rows)
+        if "key" not in df and "music" in df:
+            df = df.rename(columns={"music": "key"})
+        df["run"] = os.path.splitext(os.path.basename(path))[0]
+        frames.append(df)
+    if not frames:
+        return _normalize(pd.DataFrame(columns=("run",) + _FIELDS))
+    return _normalize(pd.concat(frames, ignore_index=True, sort=False))
+
+
+def load_store(path: str = "results.sqlite", **filters) -> pd.DataFrame:
+    """
+    Same frame from a result_store.ResultStore database, e.g.
+    load_store(model="gemini-2.5-flash"); filters: run, model, prompt_hash, genre.
+    """
+    allowed = ("run", "model", "prompt_hash", "genre")
+    if any(f not in allowed for f in filters):
+        raise ValueError(f"filters must be among {allowed}")
+    where = " AND ".join(f"{f} = ?" for f in filters) or "1"
+    with sqlite3.connect(path) as conn:
+        df = pd.read_sql_query(
+            "SELECT run, key, score, pred, true_label AS true, model, genre"
+            f" FROM results WHERE {where}",
+            conn,
+            params=tuple(filters.values()),
+        )
+    return _normalize(df)
+
+
+# -------- 统计 --------
+def bootstrap_ci(values, n_boot: int = 1000, ci: float = 0.95, seed: int = 0, max_cells: int = 10_000_000):
+    """
+    Percentile bootstrap interval (low, high) of the mean of `values`.
+
+    Scores (1-5) and correct / wrong take only a few distinct values, so a
+    resample is drawn as multinomial counts over those values: same
+    distribution as resampling items, cost independent of the run size.
+    Otherwise resamples are index matrices of at most max_cells entries.
+    """
+    values = np.asarray(values, dtype=float)
+    n = len(values)
+    if n == 0:
+        return (np.nan, np.nan)
+    rng = np.random.default_rng(seed)
+    distinct, counts = np.unique(values, return_counts=True)
+    if len(distinct) <= 64:
+        means = rng.multinomial(n, counts / n, size=n_boot) @ distinct / n
+    else:
+        chunk = max(1, max_cells // n)
+        means = np.concatenate([
+            values[rng.integers(0, n, size=(min(chunk, n_boot - i), n))].mean(axis=1)
+            for i in range(0, n_boot, chunk)
+        ])
+    alpha = (1 - ci) / 2
+    low, high = np.quantile(means, [alpha, 1 - alpha])
+    return (float(low), float(high))
+
+
+def summarize_runs(df: pd.DataFrame, by="run", n_boot: int = 1000, ci: float = 0.95) -> pd.DataFrame:
+    """
+    Per group: items, scored, mean_score, labelled, correct, accuracy,
+    plus bootstrap CIs for mean_score and accuracy. Scores <= 0 (failed
+    calls) are left out of the mean; "error" predictions count as wrong,
+    as in the evaluate_* functions.
+    """
+    df = df.assign(
+        valid_score=df["score"].where(df["score"] > 0),
+        labelled=df["true"].notna() & df["pred"].notna(),
+    )
+    df["correct"] = df["labelled"] & (df["pred"] == df["true"])
+
+    grouped = df.groupby(by, dropna=False, sort=True)
+    table = pd.DataFrame({
+        "items": grouped.size(),
+        "scored": grouped["valid_score"].count(),
+        "mean_score": grouped["valid_score"].mean(),
+        "labelled": grouped["labelled"].sum(),
+        "correct": grouped["correct"].sum(),
+    })
+    table["accuracy"] = table["correct"] / table["labelled"].where(table["labelled"] > 0)
+
+    score_ci, acc_ci = [], []
+    for _, g in grouped:
+        score_ci.append(bootstrap_ci(g["valid_score"].dropna(), n_boot, ci))
+        acc_ci.append(bootstrap_ci(g.loc[g["labelled"], "correct"], n_boot, ci))
+    table["score_ci_low"], table["score_ci_high"] = zip(*score_ci) if score_ci else ((), ())
+    table["acc_ci_low"], table["acc_ci_high"] = zip(*acc_ci) if acc_ci else ((), ())
+    return table
+
+
+def _label_order(labels) -> list:
+    # pop 的 genre_id 是 "1".."10"：按数字排，不按字符串排
+    labels = list(labels)
+    if all(str(l).isdigit() for l in labels):
+        return sorted(labels, key=int)
+    return sorted(labels)
+
+
+def confusion_matrix(df: pd.DataFrame, labels=None) -> pd.DataFrame:
+    """
+    Counts of true (rows) x pred (columns) over the labelled rows of one
+    dataset. labels fixes the order (default: the true labels seen);
+    predictions outside it (e.g. "error") get their own columns.
+    """
+    labelled = df[df["true"].notna() & df["pred"].notna()]
+    matrix = pd.crosstab(labelled["true"], labelled["pred"])
+    labels = (
+        _label_order(matrix.index) if labels is None else [str(l).lower() for l in labels]
+    )
+    extra = _label_order(c for c in matrix.columns if c not in labels)
+    return matrix.reindex(index=labels, columns=labels + extra, fill_value=0)
+
+
+def accuracy_by_genre(df: pd.DataFrame, by="run", n_boot: int = 1000, ci: float = 0.95) -> pd.DataFrame:
+    """
+    Per (group, true label): labelled, correct, accuracy and its bootstrap CI.
+    """
+    keys = ([by] if isinstance(by, str) else list(by)) + ["true"]
+    table = summarize_runs(df[df["true"].notna()], by=keys, n_boot=n_boot, ci=ci)
+    return table[["labelled", "correct", "accuracy", "acc_ci_low", "acc_ci_high"]]
+
+
+def score_histogram(df: pd.DataFrame, by="run", normalize: bool = False) -> pd.DataFrame:
+    """
+    Counts (or fractions with normalize) of each valid score per group.
+    """
+    scored = df[df["score"] > 0]
+    return pd.crosstab(
+        [scored[c] for c in ([by] if isinstance(by, str) else by)],
+        scored["score"].astype(int),
+        normalize="index" if normalize else False,
+    )
+
+
+# -------- 命令行 --------
+def main():
+    parser = argparse.ArgumentParser(description="Report over result jsonl files or results.sqlite")
+    parser.add_argument("paths", nargs="*", help="jsonl files, globs or folders")
+    parser.add_argument("--store", help="read a result_store sqlite instead")
+    parser.add_argument("--by", nargs="+", default=["run"], help="group columns (run model genre ...)")
+    parser.add_argument("--confusion", action="store_true")
+    parser.add_argument("--hist", action="store_true")
+    parser.add_argument("--n-boot", type=int, default=1000)
+    parser.add_argument("--csv", help="also write the summary table here")
+    args = parser.parse_args()
+
+    df = load_store(args.store) if args.store else load_results(args.paths)
+    if df.empty:
+        print("No results found.")
+        return
+
+    pd.set_option("display.width", 200)
+    pd.set_option("display.max_columns", 20)
+    by = args.by[0] if len(args.by) == 1 else args.by
+    table = summarize_runs(df, by=by, n_boot=args.n_boot)
+    print(table.round(3).to_string())
+    if args.csv:
+        table.to_csv(args.csv)
+
+    if df["true"].notna().any():
+        print("\nPer-genre accuracy:")
+        print(accuracy_by_genre(df, by=by, n_boot=args.n_boot).round(3).to_string())
+        if args.confusion:
+            # 每个 run 一张：不同数据集的标签空间不一样
+            for run, g in df[df["true"].notna()].groupby("run"):
+                print(f"\nConfusion matrix {run} (rows: true, columns: pred):")
+                print(confusion_matrix(g).to_string())
+
+    if args.hist and (df["score"] > 0).any():
+        print("\nScore histogram:")
+        print(score_histogram(df, by=by).to_string())
+
+
+if __name__ == "__main__":
+    main()
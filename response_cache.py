@@ -0,0 +1,88 @@
+# response_cache.py
+
+import json
+import sqlite3
+import threading
+import time
+
+from hash_utils import file_sha256, text_sha256
+from prompt_registry import prompt_hash
+
+
+def response_key(backend: str, model_name: str, prompt: str, wav_path: str, generation=None) -> str:
+    """
+    Cache key: (backend, model, prompt hash, audio content hash), plus the
+    generation profile when one is set (keys without one are unchanged).
+    """
+    parts = [backend, model_name, prompt_hash(prompt), file_sha256(wav_path)]
+    if generation is not None:
+        parts.append(generation.digest())
+    return text_sha256(json.dumps(parts))
+
+
+class ResponseCache:
+    """
+    On-disk (SQLite) cache of raw model outputs.
+
+    Holds at most `max_entries` rows; the least recently used rows are
+    evicted first. Safe to share between worker threads.
+    """
+
+    def __init__(self, path: str = "response_cache.sqlite", max_entries: int = 100_000):
+        self.path = path
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY,"
+            " output TEXT NOT NULL,"
+            " created REAL NOT NULL,"
+            " last_used REAL NOT NULL)"
+        )
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS responses_last_used ON responses(last_used)"
+        )
+        self.conn.commit()
+
+    def get(self, key: str) -> str | None:
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT output FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            self.conn.execute(
+                "UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key)
+            )
+            self.conn.commit()
+        return row[0]
+
+    def put(self, key: str, output: str) -> None:
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses (key, output, created, last_used)"
+                " VALUES (?, ?, ?, ?)",
+                (key, output, now, now),
+            )
+            self._evict()
+            self.conn.commit()
+
+    def _evict(self):
+        (count,) = self.conn.execute("SELECT COUNT(*) FROM responses").fetchone()
+        excess = count - self.max_entries
+        if excess > 0:
+            self.conn.execute(
+                "DELETE FROM responses WHERE key IN ("
+                " SELECT key FROM responses ORDER BY last_used LIMIT ?)",
+                (excess,),
+            )
+
+    def __len__(self) -> int:
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def close(self) -> None:
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,281 @@
+# result_store.py
+
+import json
+import os
+import sqlite3
+import threading
+
+from dataset_adapters import record_key
+
+# record 里单独建列（可索引 / 可聚合）的字段
+_COLUMNS = ("model", "prompt_hash", "genre")
+
+
+class ResultStore:
+    """
+    Indexed (SQLite) store of evaluation results, one row per (run, key).
+
+    `run` names one result set, normally the output jsonl name without
+    extension (e.g. "suno_visinger2_rock"). Per-run totals are kept in a
+    side table and updated on every put, so "already done?" checks and
+    run summaries never rescan the records.
+    """
+
+    def __init__(self, path: str = "results.sqlite"):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS results (
+                run TEXT NOT NULL,
+                key TEXT NOT NULL,
+                model TEXT,
+                prompt_hash TEXT,
+                genre TEXT,
+                score INTEGER,
+                pred TEXT,
+                true_label TEXT,
+                record TEXT NOT NULL,
+                PRIMARY KEY (run, key)
+            );
+            CREATE INDEX IF NOT EXISTS results_model ON results(model);
+            CREATE INDEX IF NOT EXISTS results_genre ON results(genre);
+            CREATE INDEX IF NOT EXISTS results_prompt ON results(prompt_hash);
+
+            CREATE TABLE IF NOT EXISTS run_stats (
+                run TEXT PRIMARY KEY,
+                total INTEGER NOT NULL DEFAULT 0,
+                scored INTEGER NOT NULL DEFAULT 0,
+                score_sum INTEGER NOT NULL DEFAULT 0,
+                labelled INTEGER NOT NULL DEFAULT 0,
+                correct INTEGER NOT NULL DEFAULT 0
+            );
+
+            -- 记录每个 run 上次同步时 jsonl 的路径/大小/修改时间
+            CREATE TABLE IF NOT EXISTS sources (
+                run TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                path TEXT
+            );
+            """
+        )
+        # 旧库的 sources 没有 path 列：补上（path 为空的 run 下次同步时整体重导）
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(sources)")}
+        if "path" not in columns:
+            self.conn.execute("ALTER TABLE sources ADD COLUMN path TEXT")
+        self.conn.commit()
+
+    # -------- 单条 --------
+    def has(self, run: str, key: str) -> bool:
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT 1 FROM results WHERE run = ? AND key = ?", (run, key)
+            ).fetchone()
+        return row is not None
+
+    def done_keys(self, run: str) -> set:
+        # 分类失败（pred = "error"）的条目不算完成，断点续传时重新请求
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT key FROM results WHERE run = ? AND (pred IS NULL OR pred != 'error')",
+                (run,),
+            )
+            return {key for (key,) in rows}
+
+    def put(self, run: str, record: dict, **meta) -> None:
+        """
+        Insert or replace one result. meta may set model / prompt_hash / genre
+        (falling back to the same fields in the record).
+        """
+        with self.lock:
+            self._put(run, record, meta)
+            self.conn.commit()
+
+    def put_many(self, run: str, records, **meta) -> int:
+        n = 0
+        with self.lock:
+            for record in records:
+                self._put(run, record, meta)
+                n += 1
+            self.conn.commit()
+        return n
+
+    @staticmethod
+    def _stat_row(score, pred, true_label) -> tuple:
+        scored = isinstance(score, int) and score > 0
+        labelled = pred is not None and true_label is not None
+        return (
+            1,
+            int(scored),
+            score if scored else 0,
+            int(labelled),
+            int(labelled and pred == true_label),
+        )
+
+    def _put(self, run: str, record: dict, meta: dict):
+        key = record_key(record)
+        score = record.get("score")
+        pred = record.get("pred")
+        true_label = record.get("true")
+        true_label = None if true_label is None else str(true_label)
+        columns = [meta.get(c, record.get(c)) for c in _COLUMNS]
+
+        delta = list(self._stat_row(score, pred, true_label))
+        old = self.conn.execute(
+            "SELECT score, pred, true_label FROM results WHERE run = ? AND key = ?",
+            (run, key),
+        ).fetchone()
+        if old is not None:
+            delta = [a - b for a, b in zip(delta, self._stat_row(*old))]
+
+        self.conn.execute(
+            "INSERT OR REPLACE INTO results"
+            " (run, key, model, prompt_hash, genre, score, pred, true_label, record)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                run,
+                key,
+                *columns,
+                score if isinstance(score, int) else None,
+                pred,
+                true_label,
+                json.dumps(record, ensure_ascii=False),
+            ),
+        )
+        self.conn.execute(
+            "INSERT INTO run_stats (run, total, scored, score_sum, labelled, correct)"
+            " VALUES (?, ?, ?, ?, ?, ?)"
+            " ON CONFLICT(run) DO UPDATE SET"
+            " total = total + excluded.total,"
+            " scored = scored + excluded.scored,"
+            " score_sum = score_sum + excluded.score_sum,"
+            " labelled = labelled + excluded.labelled,"
+            " correct = correct + excluded.correct",
+            (run, *delta),
+        )
+
+    # -------- 聚合 --------
+    def stats(self, run: str) -> dict:
+        """
+        O(1) totals for one run: total, scored, mean_score, labelled, correct, accuracy.
+        """
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT total, scored, score_sum, labelled, correct"
+                " FROM run_stats WHERE run = ?",
+                (run,),
+            ).fetchone()
+        total, scored, score_sum, labelled, correct = row or (0, 0, 0, 0, 0)
+        return {
+            "total": total,
+            "scored": scored,
+            "mean_score": score_sum / scored if scored else 0.0,
+            "labelled": labelled,
+            "correct": correct,
+            "accuracy": correct / labelled if labelled else 0.0,
+        }
+
+    def aggregate(self, group_by: str = "run", **filters) -> list:
+        """
+        Per-group totals over all runs, e.g. aggregate("genre", model="gemini-2.5-flash").
+        group_by / filter names: run, model, prompt_hash, genre.
+        """
+        allowed = ("run",) + _COLUMNS
+        if group_by not in allowed or any(f not in allowed for f in filters):
+            raise ValueError(f"group_by / filters must be among {allowed}")
+
+        where = " AND ".join(f"{f} = ?" for f in filters) or "1"
+        sql = (
+            f"SELECT {group_by}, COUNT(*),"
+            " SUM(score > 0), AVG(CASE WHEN score > 0 THEN score END),"
+            " SUM(pred IS NOT NULL AND true_label IS NOT NULL),"
+            " SUM(pred = true_label)"
+            f" FROM results WHERE {where} GROUP BY {group_by} ORDER BY {group_by}"
+        )
+        with self.lock:
+            rows = self.conn.execute(sql, tuple(filters.values())).fetchall()
+
+        return [
+            {
+                group_by: group,
+                "total": total,
+                "scored": scored or 0,
+                "mean_score": mean or 0.0,
+                "labelled": labelled or 0,
+                "correct": correct or 0,
+                "accuracy": (correct or 0) / labelled if labelled else 0.0,
+            }
+            for group, total, scored, mean, labelled, correct in rows
+        ]
+
+    # -------- jsonl 导入 / 导出 --------
+    def sync_jsonl(self, run: str, jsonl_path: str, **meta) -> int:
+        """
+        Make `run` mirror jsonl_path. When the file changed since the last
+        sync (path / size / mtime) the run's rows are dropped and the file
+        is imported again, so records deleted or edited in the jsonl (or a
+        different file with the same run name) never linger as "done"; a
+        missing file empties the run. Returns the number of records imported.
+        """
+        path = os.path.abspath(jsonl_path)
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT path, size, mtime_ns FROM sources WHERE run = ?", (run,)
+            ).fetchone()
+        if not os.path.exists(jsonl_path):
+            if row is not None:
+                self.clear_run(run)
+            return 0
+        st = os.stat(jsonl_path)
+        if row == (path, st.st_size, st.st_mtime_ns):
+            return 0
+        self.clear_run(run)
+        n = self.import_jsonl(run, jsonl_path, **meta)
+        self.mark_synced(run, jsonl_path)
+        return n
+
+    def mark_synced(self, run: str, jsonl_path: str) -> None:
+        st = os.stat(jsonl_path)
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO sources (run, size, mtime_ns, path) VALUES (?, ?, ?, ?)",
+                (run, st.st_size, st.st_mtime_ns, os.path.abspath(jsonl_path)),
+            )
+            self.conn.commit()
+
+    def clear_run(self, run: str) -> None:
+        """Drop every row, total and sync record of one run."""
+        with self.lock:
+            for table in ("results", "run_stats", "sources"):
+                self.conn.execute(f"DELETE FROM {table} WHERE run = ?", (run,))
+            self.conn.commit()
+
+    def import_jsonl(self, run: str, jsonl_path: str, **meta) -> int:
+        def records():
+            with open(jsonl_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        data = json.loads(line)
+                    except Exception:
+                        continue
+                    # 旧的 pop 结果只有 "music"（文件名），同样按 record_key 取 key
+                    if record_key(data) is not None:
+                        yield data
+
+        return self.put_many(run, records(), **meta)
+
+    def export_jsonl(self, run: str, jsonl_path: str) -> int:
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT record FROM results WHERE run = ? ORDER BY key", (run,)
+            ).fetchall()
+        with open(jsonl_path, "w", encoding="utf-8") as f:
+            for (record,) in rows:
+                f.write(record + "\n")
+        return len(rows)
+
+    def close(self) -> None:
+        with self.lock:
+            self.conn.close()
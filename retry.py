@@ -0,0 +1,160 @@
+# retry.py
+
+import asyncio
+import random
+import time
+
+from metrics import record
+
+# 错误类型：quota / overload / transient 可以重试，bad_input 重试也没用
+QUOTA = "quota"
+OVERLOAD = "overload"
+TRANSIENT = "transient"
+BAD_INPUT = "bad_input"
+
+RETRYABLE = {QUOTA, OVERLOAD, TRANSIENT}
+
+# key 失效 / 没有权限 / 没有这个模型：请求本身没问题，是这个 endpoint 坏了
+ENDPOINT_FAULT_CODES = {401, 403, 404}
+
+
+def _status_code(exc) -> int | None:
+    # google.genai.errors.APIError -> .code, openai.APIStatusError -> .status_code
+    for attr in ("code", "status_code"):
+        code = getattr(exc, attr, None)
+        if isinstance(code, int):
+            return code
+    return None
+
+
+def classify_error(exc: BaseException) -> str:
+    """
+    Map an exception from either backend to QUOTA / OVERLOAD / TRANSIENT / BAD_INPUT.
+
+    Exceptions may force a kind with a `retry_kind` attribute.
+    """
+    kind = getattr(exc, "retry_kind", None)
+    if kind is not None:
+        return kind
+
+    code = _status_code(exc)
+    text = str(exc)
+    if code == 429 or "RESOURCE_EXHAUSTED" in text:
+        return QUOTA
+    if code is not None and code >= 500:
+        return OVERLOAD
+    if code is not None and 400 <= code < 500 and code != 408:
+        return BAD_INPUT
+    if isinstance(exc, (FileNotFoundError, IsADirectoryError, ValueError, TypeError)):
+        return BAD_INPUT
+    # 连接断开、超时等
+    return TRANSIENT
+
+
+def is_endpoint_fault(exc: BaseException) -> bool:
+    """
+    True for auth / permission / not-found errors (ENDPOINT_FAULT_CODES):
+    classify_error calls them BAD_INPUT, but another key or base URL may
+    well serve the same request.
+    """
+    return _status_code(exc) in ENDPOINT_FAULT_CODES
+
+
+class RetryPolicy:
+    """
+    Exponential backoff with full jitter and one total deadline per item.
+
+    delay(attempt) = uniform(0, min(max_delay, base * 2 ** attempt)), where base
+    is quota_delay for 429s and base_delay otherwise. A retry is skipped when
+    its sleep would overrun the deadline.
+    """
+
+    def __init__(
+        self,
+        max_attempts: int = 4,
+        base_delay: float = 2.0,
+        quota_delay: float = 15.0,
+        max_delay: float = 60.0,
+        deadline: float = 180.0,
+        jitter: bool = True,
+    ):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.quota_delay = quota_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.jitter = jitter
+
+    def delay(self, attempt: int, kind: str) -> float:
+        base = self.quota_delay if kind == QUOTA else self.base_delay
+        cap = min(self.max_delay, base * 2 ** attempt)
+        return random.uniform(0, cap) if self.jitter else cap
+
+    def deadline_at(self) -> float:
+        return time.monotonic() + self.deadline
+
+    def next_delay(self, attempt: int, exc: BaseException, deadline_at: float) -> float | None:
+        """
+        Seconds to wait before the next attempt, or None to give up.
+        `attempt` is 0-based (the attempt that just failed).
+        """
+        kind = classify_error(exc)
+        if kind not in RETRYABLE or attempt + 1 >= self.max_attempts:
+            return None
+        wait = self.delay(attempt, kind)
+        if time.monotonic() + wait >= deadline_at:
+            return None
+        return wait
+
+    def call(self, fn, label: str = "", deadline_at: float | None = None):
+        """
+        Call fn() until it succeeds; re-raises the last error on give-up.
+        """
+        if deadline_at is None:
+            deadline_at = self.deadline_at()
+
+        attempt = 0
+        while True:
+            try:
+                return fn()
+            except Exception as e:
+                if classify_error(e) in (QUOTA, OVERLOAD):
+                    record(throttled=1)
+                wait = self.next_delay(attempt, e, deadline_at)
+                if wait is None:
+                    raise
+                print(
+                    f"[Retry] {label} {classify_error(e)} error "
+                    f"({attempt + 1}/{self.max_attempts}): {e}; retrying in {wait:.1f}s"
+                )
+                record(retries=1)
+                time.sleep(wait)
+                attempt += 1
+
+    async def call_async(self, fn, label: str = "", deadline_at: float | None = None):
+        """
+        Like call(), for a coroutine function; backs off with asyncio.sleep.
+        """
+        if deadline_at is None:
+            deadline_at = self.deadline_at()
+
+        attempt = 0
+        while True:
+            try:
+                return await fn()
+            except Exception as e:
+                if classify_error(e) in (QUOTA, OVERLOAD):
+                    record(throttled=1)
+                wait = self.next_delay(attempt, e, deadline_at)
+                if wait is None:
+                    raise
+                print(
+                    f"[Retry] {label} {classify_error(e)} error "
+                    f"({attempt + 1}/{self.max_attempts}): {e}; retrying in {wait:.1f}s"
+                )
+                record(retries=1)
+                await asyncio.sleep(wait)
+                attempt += 1
+
+
+DEFAULT_RETRY_POLICY = RetryPolicy()
@@ -0,0 +1,240 @@
+# router.py
+
+import random
+import threading
+import time
+
+from gemini_client import classify_audio_batch_with_gemini, classify_audio_with_gemini
+from metrics import record, timed
+from openai_client import classify_audio_batch_with_openai, classify_audio_with_openai
+from rate_limiter import DailyQuotaExceeded
+from retry import (
+    BAD_INPUT,
+    DEFAULT_RETRY_POLICY,
+    OVERLOAD,
+    QUOTA,
+    RetryPolicy,
+    classify_error,
+    is_endpoint_fault,
+)
+
+# 每个 endpoint 内部只试一次，失败后由 Router 换 endpoint 重试
+_SINGLE_ATTEMPT = RetryPolicy(max_attempts=1)
+
+
+class Endpoint:
+    """
+    One API key + base URL (or the native Gemini backend).
+
+    model_name overrides the requested model (relays sometimes rename
+    models); rate_limiter / upload_cache / context_cache are per key, so
+    they live here.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        backend: str,
+        client,
+        weight: float = 1.0,
+        model_name: str | None = None,
+        rate_limiter=None,
+        upload_cache=None,
+        context_cache=None,
+    ):
+        self.name = name
+        self.backend = backend
+        self.client = client
+        self.weight = weight
+        self.model_name = model_name
+        self.rate_limiter = rate_limiter
+        self.upload_cache = upload_cache
+        self.context_cache = context_cache
+
+        # 健康状态
+        self.failures = 0
+        self.down_until = 0.0
+        self.exhausted = False
+
+    def healthy(self, now: float) -> bool:
+        return not self.exhausted and self.down_until <= now
+
+
+class Router:
+    """
+    Spread requests over several endpoints by weight, with health tracking.
+
+    Quota (429) and overload (5xx) errors take an endpoint out of rotation
+    for cooldown_sec, doubling on each consecutive failure up to
+    max_cooldown_sec; a success puts it back to full health. Auth /
+    permission / not-found errors (401 / 403 / 404: dead key, model missing
+    on that relay) take it out for max_cooldown_sec and the item goes to
+    another endpoint; only payload errors (400, 413, ...) fail the item.
+    An endpoint whose daily budget is spent is dropped until the process
+    restarts.
+
+    Pass a Router as `client` with backend="router" to task.classify_audio.
+    """
+
+    def __init__(
+        self,
+        endpoints: list,
+        cooldown_sec: float = 30.0,
+        max_cooldown_sec: float = 600.0,
+        retry_policy=None,
+    ):
+        if not endpoints:
+            raise ValueError("Router needs at least one endpoint")
+        self.endpoints = endpoints
+        self.cooldown_sec = cooldown_sec
+        self.max_cooldown_sec = max_cooldown_sec
+        self.retry_policy = retry_policy or DEFAULT_RETRY_POLICY
+        self.lock = threading.Lock()
+
+    # -------- 选择 / 健康状态 --------
+    def pick(self) -> Endpoint | None:
+        """
+        Weighted random healthy endpoint; None if all are cooling down.
+        Raises DailyQuotaExceeded once every endpoint is exhausted.
+        """
+        with self.lock:
+            now = time.monotonic()
+            if all(e.exhausted for e in self.endpoints):
+                raise DailyQuotaExceeded("all router endpoints used up their daily budget")
+            healthy = [e for e in self.endpoints if e.healthy(now)]
+            if not healthy:
+                return None
+            return random.choices(healthy, weights=[e.weight for e in healthy])[0]
+
+    def has_healthy(self) -> bool:
+        with self.lock:
+            now = time.monotonic()
+            return any(e.healthy(now) for e in self.endpoints)
+
+    def next_recovery(self) -> float:
+        with self.lock:
+            pending = [e.down_until for e in self.endpoints if not e.exhausted]
+        return max(min(pending) - time.monotonic(), 0.0) if pending else 0.0
+
+    def report_success(self, endpoint: Endpoint) -> None:
+        with self.lock:
+            endpoint.failures = 0
+            endpoint.down_until = 0.0
+
+    def report_failure(self, endpoint: Endpoint, kind: str) -> None:
+        with self.lock:
+            endpoint.failures += 1
+            if kind in (QUOTA, OVERLOAD) or endpoint.failures >= 3:
+                cooldown = min(
+                    self.max_cooldown_sec,
+                    self.cooldown_sec * 2 ** (endpoint.failures - 1),
+                )
+                endpoint.down_until = time.monotonic() + cooldown
+                print(
+                    f"[Router] {endpoint.name}: {kind} error, "
+                    f"out of rotation for {cooldown:.0f}s"
+                )
+
+    def mark_broken(self, endpoint: Endpoint, e) -> None:
+        # key 失效 / 没有模型：短时间内不会自己好，直接按最长冷却移出
+        with self.lock:
+            endpoint.failures += 1
+            endpoint.down_until = time.monotonic() + self.max_cooldown_sec
+        print(
+            f"[Router] {endpoint.name}: endpoint error ({e}), "
+            f"out of rotation for {self.max_cooldown_sec:.0f}s"
+        )
+
+    def mark_exhausted(self, endpoint: Endpoint) -> None:
+        with self.lock:
+            endpoint.exhausted = True
+        print(f"[Router] {endpoint.name}: daily budget used up, removed from rotation")
+
+    # -------- 请求 --------
+    def _call(self, endpoint: Endpoint, model_name: str, prompt: str, wav_paths: list, batch: bool, generation=None) -> str:
+        model_name = endpoint.model_name or model_name
+        if endpoint.backend == "gemini":
+            fn = classify_audio_batch_with_gemini if batch else classify_audio_with_gemini
+            extra = {"upload_cache": endpoint.upload_cache, "context_cache": endpoint.context_cache}
+        elif endpoint.backend == "openai":
+            fn = classify_audio_batch_with_openai if batch else classify_audio_with_openai
+            extra = {}
+        else:
+            raise ValueError(f"Unknown backend: {endpoint.backend}")
+
+        audio = {"wav_paths": wav_paths} if batch else {"wav_path": wav_paths[0]}
+        return fn(
+            client=endpoint.client,
+            model_name=model_name,
+            prompt=prompt,
+            retry_policy=_SINGLE_ATTEMPT,
+            raise_errors=True,
+            generation=generation,
+            # 每次尝试（换 endpoint 重试也算）都占这个 key 的一个名额
+            rate_limiter=endpoint.rate_limiter,
+            **audio,
+            **extra,
+        )
+
+    def classify(
+        self,
+        model_name: str,
+        prompt: str,
+        wav_paths: list,
+        batch: bool = False,
+        generation=None,
+        rate_limiter=None,
+    ) -> str:
+        """
+        Send one request, failing over between endpoints under the router's
+        retry policy (attempt count + total deadline). Returns "error" on give-up.
+        generation: optional generation.GenerationProfile for every endpoint.
+        rate_limiter: optional overall rate_limiter.QuotaScheduler on top of
+        the endpoints' own, acquired for every attempt.
+        """
+        policy = self.retry_policy
+        deadline_at = policy.deadline_at()
+        attempt = 0
+        while True:
+            endpoint = self.pick()
+            if endpoint is None:
+                # 全部在冷却：等最早恢复的那个
+                wait = self.next_recovery()
+                if time.monotonic() + wait >= deadline_at:
+                    print(f"[Router] no healthy endpoint before deadline: {wav_paths[0]}")
+                    return "error"
+                time.sleep(wait)
+                continue
+
+            if rate_limiter is not None:
+                with timed("queue_sec"):
+                    rate_limiter.acquire(model_name)
+            try:
+                output = self._call(endpoint, model_name, prompt, wav_paths, batch, generation)
+            except DailyQuotaExceeded:
+                self.mark_exhausted(endpoint)
+                continue
+            except Exception as e:
+                if is_endpoint_fault(e):
+                    # 401 / 403 / 404 是 endpoint 的问题：换一个，不算这条的失败
+                    self.mark_broken(endpoint, e)
+                    continue
+                kind = classify_error(e)
+                if kind == BAD_INPUT:
+                    print(f"[Router] bad input {wav_paths[0]}: {e}")
+                    return "error"
+                # 429 / 5xx 已在 endpoint 那次 RetryPolicy.call 里记过 throttled
+                self.report_failure(endpoint, kind)
+                attempt += 1
+                if attempt >= policy.max_attempts or time.monotonic() >= deadline_at:
+                    print(f"[Router] giving up on {wav_paths[0]}: {e}")
+                    return "error"
+                print(f"[Router] {endpoint.name} failed ({kind}): {e}; trying another endpoint")
+                record(retries=1)
+                if not self.has_healthy():
+                    # 没有别的可用 endpoint 时照常退避
+                    time.sleep(min(policy.delay(attempt - 1, kind), max(deadline_at - time.monotonic(), 0)))
+                continue
+
+            self.report_success(endpoint)
+            return output
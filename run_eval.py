@@ -1,20 +1,161 @@
 # run_eval.py
 
+import functools
 import os
-from gemini_client import init_gemini_client
-from openai_client import init_openai_client
+from batch_api import get_batch_backend
+from client_registry import get_client
+from concurrency import AdaptiveConcurrency
+from context_cache import ContextCache
+from generation import SCORE_PROFILE
 from prompt import build_vocal_style_prompt
+from prompt_registry import get_prompt
 from pathlib import Path
 from evaluate import evaluate_style_score_folder
 from task import run_audio_task
 from prompt_loader import load_extra_genre_prompts, get_extra_genre_prompt
+from planner import plan_style_sweep, run_plan, summarize_outputs
+from rate_limiter import QuotaScheduler
+from upload_cache import UploadCache
+from response_cache import ResponseCache
+from preprocess import PreprocessConfig
+from retry import RetryPolicy
+from result_store import ResultStore
+from router import Endpoint, Router
 
 MODEL_NAME = "gemini-2.5-flash"
 # MODEL_NAME = "gemini-2.5-flash-lite"
 # MODEL_NAME = "gemini-2.5-pro"
 
 # 指定使用哪一套API系统
-BACKEND = "openai"  # "gemini" or "openai"
+BACKEND = "openai"  # "gemini", "openai" or "router"
+
+# BACKEND = "router" 时使用的多个 key / endpoint，按 weight 分配请求；
+# 某个 endpoint 429 / 5xx 后暂时移出轮转，当天额度用完则停用
+ENDPOINTS = [
+    {"name": "furion", "backend": "openai", "api_key_env": "GEMINI_API_KEY",
+     "base_url": "https://www.furion-tech.com/v1", "weight": 1},
+    # {"name": "google", "backend": "gemini", "api_key_env": "GEMINI_API_KEY_2", "weight": 1},
+]
+
+# 同时在途的请求数（1 = 顺序执行）
+MAX_IN_FLIGHT = 4
+
+# 自适应并发（AIMD）：延迟正常、没有 429/5xx 时逐步加并发，出错减半、变慢小幅回退
+# None 表示固定用 MAX_IN_FLIGHT；例：AdaptiveConcurrency(initial=MAX_IN_FLIGHT, max_limit=32)
+CONCURRENCY = None
+
+# True：单线程 asyncio 发请求（client.aio / AsyncOpenAI），MAX_IN_FLIGHT 可以开到几百
+# 只用于 run_style_score_folder（遍历多风格的 run_plan 仍走线程池），且要求 BATCH_SIZE = 1
+USE_ASYNC = False
+
+# 每个请求打包的音频条数（1 = 一条一个请求）
+BATCH_SIZE = 1
+
+# 每个模型的请求配额：rpm = 每分钟请求数，rpd = 每天请求数（None 表示不限）
+# gemini 2.5 flash / lite 免费档一天 20 次（见 README）
+QUOTAS = {
+    "gemini-2.5-flash": {"rpm": 10, "rpd": 20},
+    "gemini-2.5-flash-lite": {"rpm": 15, "rpd": 20},
+    "gemini-2.5-pro": {"rpm": 5, "rpd": None},
+}
+
+# 下面的限速器 / 缓存 / 索引库都带状态文件：第一次用到时才创建，import run_eval 不会落盘
+
+# 当天已用次数记录在 quota_state.json，重启脚本后继续累计
+# router 模式下每个 endpoint 各自限速（见 make_client），这里不再统一排队
+@functools.cache
+def get_rate_limiter():
+    if BACKEND == "router":
+        return None
+    return QuotaScheduler(QUOTAS, state_path="quota_state.json")
+
+# gemini 后端：按文件内容 hash 复用已上传的文件，过期前不重复上传
+@functools.cache
+def get_upload_cache():
+    return UploadCache("upload_cache.json")
+
+# gemini 后端：同一文件夹共用的长 prompt 按 (模型, prompt hash) 建一次上下文缓存，
+# 之后每个请求只带缓存名 + 音频；缓存 TTL 15 分钟，用着时自动续期。
+# prompt 太短（低于模型的最小缓存 token 数）或模型不支持时自动改回内联发送；None 表示不用
+# 例：ContextCache(ttl_sec=900)
+CONTEXT_CACHE = None
+
+# 模型输出缓存：相同 (backend, model, prompt, 音频) 直接复用，不消耗配额
+@functools.cache
+def get_response_cache():
+    return ResponseCache("response_cache.sqlite", max_entries=100_000)
+
+# 结果索引库：断点续传 / 汇总统计不再每次重读整个 jsonl（jsonl 仍照常输出）
+@functools.cache
+def get_result_store():
+    return ResultStore("results.sqlite")
+
+# 失败重试：指数退避 + 抖动；429 用更长的基础等待；单条最多 deadline 秒
+RETRY_POLICY = RetryPolicy(max_attempts=4, base_delay=2, quota_delay=15, deadline=180)
+
+# 上传前的音频预处理（裁剪 / 重采样 / 单声道 / 压缩），None 表示原样上传
+# 例：PreprocessConfig(max_duration=10, sample_rate=16000, mono=True, codec="mp3")
+PREPROCESS = None
+
+# 生成参数：关掉思考、答案最多 16 token、temperature 0、只允许回答 "1".."5"
+# （2.5 pro 不能关思考，自动用最低预算 128）；None 表示用模型默认配置
+GENERATION = SCORE_PROFILE
+
+# True：run_style_score_folder 把整个文件夹的待评测文件打包成一个离线 Batch API 任务
+# （不占 RPM、更便宜，但结果要几分钟到 24 小时才回来；中断后重跑会接着等同一个任务）
+# 只支持 BACKEND = "gemini" / "openai"，不走 USE_ASYNC
+OFFLINE_BATCH = False
+
+# 连接池大小：不小于 MAX_IN_FLIGHT
+POOL_SIZE = max(MAX_IN_FLIGHT, CONCURRENCY.max_limit if CONCURRENCY else 0, 8)
+
+_ROUTER = None
+
+def make_router():
+    # 全程共用一个 Router，endpoint 的健康状态才不会丢
+    global _ROUTER
+    if _ROUTER is None:
+        endpoints = []
+        for ep in ENDPOINTS:
+            client = get_client(
+                ep["backend"],
+                api_key=os.environ[ep["api_key_env"]],
+                base_url=ep.get("base_url"),
+                pool_size=POOL_SIZE,
+            )
+            endpoints.append(
+                Endpoint(
+                    name=ep["name"],
+                    backend=ep["backend"],
+                    client=client,
+                    weight=ep.get("weight", 1),
+                    model_name=ep.get("model_name"),
+                    rate_limiter=QuotaScheduler(
+                        QUOTAS, state_path=f"quota_state_{ep['name']}.json"
+                    ),
+                    # 上传的文件属于某个 key：每个 endpoint 一个缓存文件
+                    upload_cache=(
+                        UploadCache(f"upload_cache_{ep['name']}.json")
+                        if ep["backend"] == "gemini" else None
+                    ),
+                    context_cache=CONTEXT_CACHE if ep["backend"] == "gemini" else None,
+                )
+            )
+        _ROUTER = Router(endpoints, retry_policy=RETRY_POLICY)
+    return _ROUTER
+
+def make_client(use_async=False):
+    # 同一 (backend, base_url, key) 全程只建一个带连接池的 client
+    if BACKEND == "router":
+        return make_router()
+    if BACKEND == "openai":
+        return get_client(
+            "openai_async" if use_async else "openai",
+            api_key=os.environ["GEMINI_API_KEY"],
+            base_url="https://www.furion-tech.com/v1",
+            pool_size=POOL_SIZE,
+        )
+    return get_client("gemini", pool_size=POOL_SIZE)
 
 def run_single_evaluation():
     # 常见bug: windows的\路径分隔符在Python中是转义符，导致文件找不到！！
@@ -26,7 +167,7 @@ def run_single_evaluation():
     GENRE = os.path.basename(os.path.dirname(wav_path))
     print("评测GENRE：", GENRE)
 
-    client = init_gemini_client()
+    client = get_client("gemini")
     # prompt = build_vocal_style_prompt(genre="rock")
     # 附加参数
     # extra_genre_prompt=(
@@ -34,15 +175,8 @@ def run_single_evaluation():
     #     "Vocals may sound aggressive, strained, raspy, noisy, or intentionally distorted. "
     #     "Such characteristics are typical and should be considered positively when scoring."
     # )
-    extra_prompt_map = load_extra_genre_prompts(
-        "genre_extra_prompts.json"
-    )
-
-    extra_genre_prompt = get_extra_genre_prompt(
-        GENRE, extra_prompt_map
-    )
-
-    prompt = build_vocal_style_prompt(genre=GENRE, extra_genre_prompt=extra_genre_prompt)
+    # 带 genre_extra_prompts.json 补充说明的 prompt（同一进程内只构建一次）
+    prompt = get_prompt("vocal_style", GENRE, variant="extra").text
     # print("Prompt:\n", prompt)
 
     res = run_audio_task(
@@ -52,6 +186,12 @@ def run_single_evaluation():
         wav_path=wav_path,
         output_jsonl=None,
         task_type="score",
+        rate_limiter=get_rate_limiter(),
+        upload_cache=get_upload_cache(),
+        context_cache=CONTEXT_CACHE,
+        response_cache=get_response_cache(),
+        retry_policy=RETRY_POLICY,
+        generation=GENERATION,
     )
 
     print(res["score"])
@@ -76,17 +216,17 @@ def run_style_score_folder(
     )
     print("输出jsonl：", output_jsonl)
 
-    if BACKEND == "openai":
-        client = init_openai_client(
-            api_key=os.environ["GEMINI_API_KEY"],
-            base_url="https://www.furion-tech.com/v1",
-        )
-    else:
-        client = init_gemini_client()
+    client = make_client(use_async=USE_ASYNC)
 
     prompt = build_vocal_style_prompt(genre=genre, extra_genre_prompt=extra_genre_prompt)
     # print("Prompt:\n", prompt)
 
+    batch_api = None
+    if OFFLINE_BATCH:
+        batch_api = get_batch_backend(
+            BACKEND, client, upload_cache=get_upload_cache(), retry_policy=RETRY_POLICY
+        )
+
     mean_score = evaluate_style_score_folder(
         wav_dir=str(wav_dir),
         client=client,
@@ -94,6 +234,20 @@ def run_style_score_folder(
         prompt=prompt,
         output_jsonl=str(output_jsonl),
         backend=BACKEND,
+        max_in_flight=MAX_IN_FLIGHT,
+        batch_size=BATCH_SIZE,
+        use_async=USE_ASYNC,
+        concurrency=CONCURRENCY,
+        result_store=get_result_store(),
+        genre=genre,
+        preprocess=PREPROCESS,
+        rate_limiter=get_rate_limiter(),
+        upload_cache=get_upload_cache(),
+        context_cache=CONTEXT_CACHE,
+        response_cache=get_response_cache(),
+        retry_policy=RETRY_POLICY,
+        generation=GENERATION,
+        batch_api=batch_api,
     )
 
     return mean_score
@@ -121,32 +275,40 @@ def eval_genre_folder():
         extra_genre_prompt=extra_genre_prompt,
     )
 
-# 遍历模型和风格
-def eval_by_models_and_genres(svs_models, genres):
-    for model in svs_models:
-        for genre in genres:
-            print("=" * 40)
-            print("评测：", genre)
-
-            wav_dir = f"samples_for_gemini/suno_{model}/{genre}"
-            # wav_dir = "samples_rock_train/suno_visinger2/rock"
-
-            extra_prompt_map = load_extra_genre_prompts(
-                "genre_extra_prompts.json"
-            )
+# 遍历模型和风格：先规划出全部任务，再用同一个线程池跑完
+def eval_by_models_and_genres(svs_models, genres, model_names=None, variants=("extra",)):
+    if model_names is None:
+        model_names = [MODEL_NAME]
 
-            extra_genre_prompt = get_extra_genre_prompt(
-                genre, extra_prompt_map
-            )
+    # prompt 由 prompt_registry 按 (genre, variant) 构建并缓存，补充说明读 genre_extra_prompts.json
+    items, outputs = plan_style_sweep(
+        svs_models=svs_models,
+        genres=genres,
+        model_names=model_names,
+        variants=variants,
+        result_store=get_result_store(),
+    )
+    print(f"待评测：{len(items)} 条，输出 {len(outputs)} 个 jsonl")
 
-            prompt = build_vocal_style_prompt(genre=genre, extra_genre_prompt=extra_genre_prompt)
-            # print("Prompt:\n", prompt)
+    run_plan(
+        items,
+        client=make_client(),
+        backend=BACKEND,
+        max_in_flight=MAX_IN_FLIGHT,
+        batch_size=BATCH_SIZE,
+        concurrency=CONCURRENCY,
+        result_store=get_result_store(),
+        preprocess=PREPROCESS,
+        rate_limiter=get_rate_limiter(),
+        upload_cache=get_upload_cache(),
+        context_cache=CONTEXT_CACHE,
+        response_cache=get_response_cache(),
+        retry_policy=RETRY_POLICY,
+        generation=GENERATION,
+    )
 
-            run_style_score_folder(
-                wav_dir=wav_dir,
-                genre=genre,
-                extra_genre_prompt=extra_genre_prompt,
-        )
+    print("=" * 40)
+    return summarize_outputs(outputs, result_store=get_result_store())
 
 if __name__ == "__main__":
     # main()
@@ -0,0 +1,207 @@
+# shard.py
+
+import argparse
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import gemini_gtzan_eval
+import gemini_pop_eval
+from client_registry import get_client
+from dataset_adapters import record_key
+from evaluate import evaluate_style_score_folder
+from prompt_loader import load_extra_genre_prompts
+from prompt_registry import get_prompt
+
+# 支持分片的数据集
+KINDS = ("gtzan", "pop", "style")
+
+
+def shard_path(output_jsonl: str, index: int, num_shards: int) -> str:
+    """
+    e.g. preds.jsonl -> preds.shard01-of-04.jsonl
+    """
+    root, ext = os.path.splitext(output_jsonl)
+    return f"{root}.shard{index:02d}-of-{num_shards:02d}{ext or '.jsonl'}"
+
+
+# -------- 单个分片（在子进程或另一台机器上跑） --------
+def run_shard(kind: str, index: int, num_shards: int, output_jsonl: str, **kwargs):
+    """
+    Evaluate the items whose key hashes to shard `index` of `num_shards`,
+    writing (and resuming) shard_path(output_jsonl, index, num_shards).
+
+    kind "gtzan": wav_dir. kind "pop": pop_jsonl, audio_folder.
+    kind "style": wav_dir, model_name, prompt, backend (+ api_key, base_url
+    and evaluate_style_score_folder keyword arguments). Clients are built
+    inside the shard process; they cannot be shared between processes.
+    """
+    path = shard_path(output_jsonl, index, num_shards)
+    shard = (index, num_shards)
+
+    if kind == "gtzan":
+        return gemini_gtzan_eval.evaluate_folder(kwargs["wav_dir"], path, shard=shard)
+
+    if kind == "pop":
+        return gemini_pop_eval.evaluate_from_jsonl(
+            kwargs["pop_jsonl"], kwargs["audio_folder"], path, shard=shard
+        )
+
+    if kind == "style":
+        backend = kwargs.pop("backend", "gemini")
+        client = get_client(
+            backend,
+            api_key=kwargs.pop("api_key", None),
+            base_url=kwargs.pop("base_url", None),
+        )
+        return evaluate_style_score_folder(
+            client=client, backend=backend, output_jsonl=path, shard=shard, **kwargs
+        )
+
+    raise ValueError(f"Unknown dataset kind: {kind}")
+
+
+def run_all_shards(kind: str, num_shards: int, output_jsonl: str, processes: int | None = None, **kwargs) -> float:
+    """
+    Run every shard in its own process (at most `processes` at once), then
+    merge them into output_jsonl. Each process has its own rate limiter, so
+    per-process rpm settings add up.
+    """
+    with ProcessPoolExecutor(max_workers=processes or num_shards) as pool:
+        futures = [
+            pool.submit(run_shard, kind, i, num_shards, output_jsonl, **kwargs)
+            for i in range(num_shards)
+        ]
+        for future in futures:
+            future.result()
+    return merge_shards(kind, output_jsonl, num_shards)
+
+
+# -------- 合并 --------
+def _is_error(record: dict) -> bool:
+    return record.get("pred") == "error" or record.get("score") == -1
+
+
+def _read_records(path: str) -> list:
+    records = []
+    if not os.path.exists(path):
+        print(f"[Shard] missing shard file, skipped: {path}")
+        return records
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except Exception:
+                continue  # 被中断写了一半的行
+    return records
+
+
+def merge_records(records: list) -> dict:
+    """
+    {key: record}, one per key. A successful record wins over an "error"
+    one (e.g. a shard re-run on another machine); otherwise the last wins.
+    Old pop shards keyed by "music" merge with new ones keyed by "key".
+    """
+    merged = {}
+    for record in records:
+        key = record_key(record)
+        if key is None:
+            continue
+        if key in merged and _is_error(record) and not _is_error(merged[key]):
+            continue
+        merged[key] = record
+    return merged
+
+
+def merge_shards(kind: str, output_jsonl: str, num_shards: int) -> float:
+    """
+    Merge the shard files of output_jsonl into output_jsonl itself (sorted
+    by key), then report what the single-process evaluation would:
+    accuracy for gtzan / pop, mean vocal-style score for style. Records
+    already in output_jsonl (an earlier merge or an unsharded run) are kept;
+    shard results replace them key by key.
+    """
+    # 分片只跳过自己分片文件里的 key：输出里已有的结果要先读进来，否则会被覆盖掉
+    records = _read_records(output_jsonl) if os.path.exists(output_jsonl) else []
+    for i in range(num_shards):
+        records.extend(_read_records(shard_path(output_jsonl, i, num_shards)))
+    merged = merge_records(records)
+
+    tmp_path = output_jsonl + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for key in sorted(merged):
+            f.write(json.dumps(merged[key], ensure_ascii=False) + "\n")
+    os.replace(tmp_path, output_jsonl)
+    print(f"[Shard] merged {len(records)} records from {num_shards} shards -> {len(merged)} keys")
+
+    if kind == "style":
+        scores = [
+            r["score"] for r in merged.values()
+            if isinstance(r.get("score"), (int, float)) and r["score"] > 0
+        ]
+        mean_score = sum(scores) / len(scores) if scores else 0.0
+        print(f"\nTotal files: {len(scores)}, Mean vocal-style score: {mean_score:.1f}")
+        return mean_score
+
+    total = len(merged)
+    correct = sum(1 for r in merged.values() if str(r.get("pred")) == str(r.get("true")))
+    acc = correct / total if total > 0 else 0.0
+    print(f"\nTotal: {total}, Correct: {correct}, Accuracy: {acc:.2%}")
+    return acc
+
+
+# -------- 命令行 --------
+def _shard_kwargs(args) -> dict:
+    if args.kind == "gtzan":
+        return {"wav_dir": args.wav_dir}
+    if args.kind == "pop":
+        return {"pop_jsonl": args.pop_jsonl, "audio_folder": args.audio_folder}
+
+    genre = args.genre or os.path.basename(os.path.normpath(args.wav_dir))
+    extra_prompts = load_extra_genre_prompts(args.extra_prompts)
+    prompt = get_prompt("vocal_style", genre, args.variant, extra_prompts)
+    return {
+        "wav_dir": args.wav_dir,
+        "model_name": args.model,
+        "prompt": prompt.text,
+        "backend": args.backend,
+        "base_url": args.base_url,
+        "max_in_flight": args.max_in_flight,
+        "genre": genre,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Sharded evaluation: split a dataset by key hash, run shards, merge results"
+    )
+    parser.add_argument("command", choices=("run", "merge"))
+    parser.add_argument("kind", choices=KINDS)
+    parser.add_argument("--output", required=True, help="merged jsonl; shard files sit next to it")
+    parser.add_argument("--num-shards", type=int, required=True)
+    parser.add_argument("--shard", type=int, help="run only this shard (e.g. one per machine)")
+    parser.add_argument("--processes", type=int, help="local processes when running all shards")
+    parser.add_argument("--wav-dir", help="gtzan / style folder")
+    parser.add_argument("--pop-jsonl", default="pop_test.jsonl")
+    parser.add_argument("--audio-folder", default="pop_test")
+    parser.add_argument("--genre", help="style: defaults to the folder name")
+    parser.add_argument("--model", default="gemini-2.5-flash")
+    parser.add_argument("--backend", default="gemini", choices=("gemini", "openai"))
+    parser.add_argument("--base-url")
+    parser.add_argument("--max-in-flight", type=int, default=1)
+    parser.add_argument("--extra-prompts", default="genre_extra_prompts.json")
+    parser.add_argument("--variant", default="extra", choices=("extra", "plain"))
+    args = parser.parse_args()
+
+    if args.command == "merge":
+        merge_shards(args.kind, args.output, args.num_shards)
+    elif args.shard is not None:
+        run_shard(args.kind, args.shard, args.num_shards, args.output, **_shard_kwargs(args))
+    else:
+        run_all_shards(
+            args.kind, args.num_shards, args.output, args.processes, **_shard_kwargs(args)
+        )
+
+
+if __name__ == "__main__":
+    main()
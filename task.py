@@ -1,10 +1,24 @@
 # task.py
 
-import json
+import asyncio
 import os
+import re
 
-from gemini_client import classify_audio_with_gemini
-from openai_client import classify_audio_with_openai
+from gemini_client import (
+    classify_audio_batch_with_gemini,
+    classify_audio_with_gemini,
+    classify_audio_with_gemini_async,
+)
+from metrics import RequestMetrics, collect, timed
+from openai_client import (
+    classify_audio_batch_with_openai,
+    classify_audio_with_openai,
+    classify_audio_with_openai_async,
+)
+from preprocess import preprocess_audio
+from prompt import build_batch_prompt
+from response_cache import response_key
+from result_writer import get_writer
 
 
 def classify_audio(
@@ -13,29 +27,83 @@ def classify_audio(
     model_name: str,
     prompt: str,
     wav_path: str,
+    rate_limiter=None,
+    upload_cache=None,
+    response_cache=None,
+    retry_policy=None,
+    metrics=None,
+    generation=None,
+    context_cache=None,
 ):
     """
     Unified audio classification interface.
+
+    backend: "gemini", "openai", or "router" (client is a router.Router that
+    spreads requests over several keys / endpoints).
+
+    rate_limiter: optional rate_limiter.QuotaScheduler; every attempt
+    (retries included) waits for its model's budget, and DailyQuotaExceeded
+    is raised once it is spent.
+    retry_policy: optional retry.RetryPolicy shared by both backends.
+    upload_cache: optional upload_cache.UploadCache (gemini backend only).
+    response_cache: optional response_cache.ResponseCache; a hit skips the
+    network (and the rate limiter) entirely.
+    metrics: optional metrics.RequestMetrics, filled with queue / upload /
+    model time, retries, bytes sent and token usage for this request.
+    generation: optional generation.GenerationProfile (thinking budget,
+    output cap, temperature, response schema) for both backends.
+    context_cache: optional context_cache.ContextCache (gemini backend only;
+    router endpoints carry their own): the prompt is cached once per
+    model and each request only references it.
     """
+    with collect(metrics), timed("total_sec"):
+        cache_key = None
+        if response_cache is not None:
+            cache_key = response_key(backend, model_name, prompt, wav_path, generation)
+            cached = response_cache.get(cache_key)
+            if cached is not None:
+                if metrics is not None:
+                    metrics.cache_hit = True
+                return cached
 
-    if backend == "gemini":
-        return classify_audio_with_gemini(
-            client=client,
-            model_name=model_name,
-            prompt=prompt,
-            wav_path=wav_path,
-        )
+        if backend == "gemini":
+            output = classify_audio_with_gemini(
+                client=client,
+                model_name=model_name,
+                prompt=prompt,
+                wav_path=wav_path,
+                retry_policy=retry_policy,
+                upload_cache=upload_cache,
+                generation=generation,
+                context_cache=context_cache,
+                rate_limiter=rate_limiter,
+            )
 
-    elif backend == "openai":
-        return classify_audio_with_openai(
-            client=client,
-            model_name=model_name,
-            prompt=prompt,
-            wav_path=wav_path,
-        )
+        elif backend == "openai":
+            output = classify_audio_with_openai(
+                client=client,
+                model_name=model_name,
+                prompt=prompt,
+                wav_path=wav_path,
+                retry_policy=retry_policy,
+                generation=generation,
+                rate_limiter=rate_limiter,
+            )
 
-    else:
-        raise ValueError(f"Unknown backend: {backend}")
+        elif backend == "router":
+            # client 是 router.Router：按权重分发到多个 key / endpoint
+            output = client.classify(
+                model_name, prompt, [wav_path], generation=generation, rate_limiter=rate_limiter
+            )
+
+        else:
+            raise ValueError(f"Unknown backend: {backend}")
+
+        # 失败结果不缓存，下次重跑还会再请求
+        if cache_key is not None and output != "error":
+            response_cache.put(cache_key, output)
+
+        return output
 
 # 评估任务
 def run_audio_task(
@@ -47,21 +115,190 @@ def run_audio_task(
     true_label: str | None = None,
     task_type: str = "classification",  # "classification" or "score"
     backend: str = "gemini",
+    preprocess=None,
+    **backend_kwargs,
 ) -> dict:
     """
     Run a single audio task (genre classification or vocal-style scoring).
+
+    preprocess: optional preprocess.PreprocessConfig; the clip is trimmed /
+    resampled / re-encoded before sending and the byte sizes are recorded
+    under result["preprocess"].
+    backend_kwargs (rate_limiter, upload_cache, response_cache, retry_policy,
+    generation, context_cache) are passed through to classify_audio. Per-request timings / retries /
+    bytes / tokens are recorded under result["metrics"].
     """
 
     key = os.path.splitext(os.path.basename(wav_path))[0]
 
+    send_path, preprocess_stats = wav_path, None
+    if preprocess is not None:
+        send_path, preprocess_stats = preprocess_audio(wav_path, preprocess)
+
+    metrics = RequestMetrics()
     raw_output = classify_audio(
         backend=backend,
         client=client,
         model_name=model_name,
         prompt=prompt,
-        wav_path=wav_path,
+        wav_path=send_path,
+        metrics=metrics,
+        **backend_kwargs,
+    )
+
+    result = build_result(key, raw_output, task_type, true_label)
+    result["metrics"] = metrics.to_dict()
+
+    if preprocess_stats is not None:
+        result["preprocess"] = preprocess_stats
+
+    # -------- optional write --------
+    if output_jsonl is not None:
+        write_result(output_jsonl, result)
+
+    return result
+
+
+async def classify_audio_async(
+    backend: str,
+    client,
+    model_name: str,
+    prompt: str,
+    wav_path: str,
+    rate_limiter=None,
+    upload_cache=None,
+    response_cache=None,
+    retry_policy=None,
+    metrics=None,
+    generation=None,
+    context_cache=None,
+):
+    """
+    Async classify_audio: waits (rate limiter, backoff) with asyncio.sleep
+    instead of blocking a thread.
+
+    client: genai.Client for "gemini" (uses client.aio), AsyncOpenAI for
+    "openai" (client_registry.get_client("openai_async")). A "router" client
+    is still synchronous and runs in a worker thread.
+    """
+    with collect(metrics), timed("total_sec"):
+        cache_key = None
+        if response_cache is not None:
+            # response_key 要读完整个文件算哈希，放到线程里，别卡住事件循环
+            cache_key = await asyncio.to_thread(
+                response_key, backend, model_name, prompt, wav_path, generation
+            )
+            cached = response_cache.get(cache_key)
+            if cached is not None:
+                if metrics is not None:
+                    metrics.cache_hit = True
+                return cached
+
+        if backend == "gemini":
+            output = await classify_audio_with_gemini_async(
+                client=client,
+                model_name=model_name,
+                prompt=prompt,
+                wav_path=wav_path,
+                retry_policy=retry_policy,
+                upload_cache=upload_cache,
+                generation=generation,
+                context_cache=context_cache,
+                rate_limiter=rate_limiter,
+            )
+
+        elif backend == "openai":
+            output = await classify_audio_with_openai_async(
+                client=client,
+                model_name=model_name,
+                prompt=prompt,
+                wav_path=wav_path,
+                retry_policy=retry_policy,
+                generation=generation,
+                rate_limiter=rate_limiter,
+            )
+
+        elif backend == "router":
+            output = await asyncio.to_thread(
+                client.classify, model_name, prompt, [wav_path],
+                generation=generation, rate_limiter=rate_limiter,
+            )
+
+        else:
+            raise ValueError(f"Unknown backend: {backend}")
+
+        if cache_key is not None and output != "error":
+            response_cache.put(cache_key, output)
+
+        return output
+
+
+async def run_audio_task_async(
+    client,
+    model_name: str,
+    prompt: str,
+    wav_path: str,
+    output_jsonl: str | None = None,
+    true_label: str | None = None,
+    task_type: str = "classification",
+    backend: str = "gemini",
+    preprocess=None,
+    **backend_kwargs,
+) -> dict:
+    """
+    Async run_audio_task (same arguments and result record). ffmpeg
+    preprocessing runs in a worker thread.
+    """
+    key = os.path.splitext(os.path.basename(wav_path))[0]
+
+    send_path, preprocess_stats = wav_path, None
+    if preprocess is not None:
+        send_path, preprocess_stats = await asyncio.to_thread(
+            preprocess_audio, wav_path, preprocess
+        )
+
+    metrics = RequestMetrics()
+    raw_output = await classify_audio_async(
+        backend=backend,
+        client=client,
+        model_name=model_name,
+        prompt=prompt,
+        wav_path=send_path,
+        metrics=metrics,
+        **backend_kwargs,
     )
 
+    result = build_result(key, raw_output, task_type, true_label)
+    result["metrics"] = metrics.to_dict()
+
+    if preprocess_stats is not None:
+        result["preprocess"] = preprocess_stats
+
+    if output_jsonl is not None:
+        write_result(output_jsonl, result)
+
+    return result
+
+
+# "4", "4.", "**4**", "\"4\"" 都算；"4 or 5"、"score: 4" 之类不算
+_SCORE = re.compile(r"^\W*(\d+)\W*$")
+
+
+def parse_score(raw_output: str) -> int:
+    """
+    The integer in a score answer, tolerating surrounding punctuation /
+    markdown; -1 if there is no single integer.
+    """
+    m = _SCORE.match(raw_output or "")
+    return int(m.group(1)) if m else -1
+
+
+def build_result(
+    key: str,
+    raw_output: str,
+    task_type: str,
+    true_label: str | None = None,
+) -> dict:
     # -------- classification task --------
     if task_type == "classification":
         result = {
@@ -72,10 +309,7 @@ def run_audio_task(
 
     # -------- score task --------
     elif task_type == "score":
-        try:
-            score = int(raw_output)
-        except Exception:
-            score = -1
+        score = parse_score(raw_output)
 
         result = {
             "key": key,
@@ -88,9 +322,198 @@ def run_audio_task(
     else:
         raise ValueError(f"Unknown task_type: {task_type}")
 
-    # -------- optional write --------
-    if output_jsonl is not None:
-        with open(output_jsonl, "a", encoding="utf-8") as f:
-            f.write(json.dumps(result, ensure_ascii=False) + "\n")
-
     return result
+
+
+def write_result(output_jsonl: str, result: dict) -> None:
+    # 同一个 jsonl 的所有线程共用一个 ResultWriter（单个句柄、整行写入）
+    get_writer(output_jsonl).write(result)
+
+
+def classify_audio_batch(
+    backend: str,
+    client,
+    model_name: str,
+    prompt: str,
+    wav_paths: list,
+    rate_limiter=None,
+    upload_cache=None,
+    retry_policy=None,
+    metrics=None,
+    generation=None,
+    context_cache=None,
+) -> str:
+    """
+    Send several clips in ONE request (one rate-limiter slot).
+    `prompt` must already be a batch prompt (prompt.build_batch_prompt),
+    and `generation` already widened for it (GenerationProfile.for_batch).
+    """
+    with collect(metrics), timed("total_sec"):
+        if backend == "gemini":
+            return classify_audio_batch_with_gemini(
+                client=client,
+                model_name=model_name,
+                prompt=prompt,
+                wav_paths=wav_paths,
+                retry_policy=retry_policy,
+                upload_cache=upload_cache,
+                generation=generation,
+                context_cache=context_cache,
+                rate_limiter=rate_limiter,
+            )
+
+        elif backend == "openai":
+            return classify_audio_batch_with_openai(
+                client=client,
+                model_name=model_name,
+                prompt=prompt,
+                wav_paths=wav_paths,
+                retry_policy=retry_policy,
+                generation=generation,
+                rate_limiter=rate_limiter,
+            )
+
+        elif backend == "router":
+            return client.classify(
+                model_name, prompt, wav_paths, batch=True, generation=generation, rate_limiter=rate_limiter
+            )
+
+        else:
+            raise ValueError(f"Unknown backend: {backend}")
+
+
+_ANSWER_LINE = re.compile(r"^\W*(?:clip\s*)?(\d+)[\s*]*[:.)\-]\s*(.+?)\W*$", re.IGNORECASE)
+
+
+def parse_batch_answers(raw_output: str, num_clips: int) -> dict:
+    """
+    Parse "<i>: <answer>" lines into {i: answer} (1-based, valid indices only).
+    """
+    answers = {}
+    for line in raw_output.splitlines():
+        m = _ANSWER_LINE.match(line.strip())
+        if m is None:
+            continue
+        idx = int(m.group(1))
+        if 1 <= idx <= num_clips and idx not in answers:
+            answers[idx] = m.group(2).strip().lower()
+    return answers
+
+
+def _is_valid_answer(answer: str | None, task_type: str, generation=None) -> bool:
+    if not answer or answer == "error":
+        return False
+    # 批量请求不带 response schema：答案是否在允许的取值里要在这里查
+    if generation is not None and generation.choices:
+        return answer in generation.choices
+    if task_type == "score":
+        return answer.isdigit() and 1 <= int(answer) <= 5
+    return True
+
+
+# 批量评估任务：一个请求里放多个音频
+def run_audio_batch_task(
+    client,
+    model_name: str,
+    prompt: str,
+    wav_paths: list,
+    output_jsonl: str | None = None,
+    true_labels: list | None = None,
+    task_type: str = "classification",
+    backend: str = "gemini",
+    preprocess=None,
+    **backend_kwargs,
+) -> list:
+    """
+    Score / classify several clips with one model request.
+
+    `prompt` is the ordinary single-clip prompt; it is wrapped with
+    build_batch_prompt here. Clips whose answer is missing, unparseable or
+    not one of generation.choices fall back to run_audio_task (one request
+    each). Returns one result dict
+    per clip, in input order.
+    """
+    if true_labels is None:
+        true_labels = [None] * len(wav_paths)
+
+    send_paths, all_stats = [], []
+    for wav_path in wav_paths:
+        send_path, stats = wav_path, None
+        if preprocess is not None:
+            send_path, stats = preprocess_audio(wav_path, preprocess)
+        send_paths.append(send_path)
+        all_stats.append(stats)
+
+    # 已在 response cache 里的片段不再占用批量请求
+    answers = {}
+    response_cache = backend_kwargs.get("response_cache")
+    generation = backend_kwargs.get("generation")
+    if response_cache is not None:
+        for i, send_path in enumerate(send_paths):
+            cached = response_cache.get(
+                response_key(backend, model_name, prompt, send_path, generation)
+            )
+            if cached is not None:
+                answers[i] = cached
+
+    pending = [i for i in range(len(wav_paths)) if i not in answers]
+    batch_metrics = RequestMetrics()
+    if len(pending) > 1:
+        raw_output = classify_audio_batch(
+            backend=backend,
+            client=client,
+            model_name=model_name,
+            prompt=build_batch_prompt(prompt, len(pending)),
+            wav_paths=[send_paths[i] for i in pending],
+            rate_limiter=backend_kwargs.get("rate_limiter"),
+            upload_cache=backend_kwargs.get("upload_cache"),
+            retry_policy=backend_kwargs.get("retry_policy"),
+            metrics=batch_metrics,
+            generation=None if generation is None else generation.for_batch(len(pending)),
+            context_cache=backend_kwargs.get("context_cache"),
+        )
+        parsed = parse_batch_answers(raw_output, len(pending))
+        for n, i in enumerate(pending, start=1):
+            if n in parsed:
+                answers[i] = parsed[n]
+
+    results = []
+    for i, wav_path in enumerate(wav_paths):
+        answer = answers.get(i)
+        if not _is_valid_answer(answer, task_type, generation):
+            # 解析失败（或只剩一条）：单独请求这一条
+            results.append(
+                run_audio_task(
+                    client=client,
+                    model_name=model_name,
+                    prompt=prompt,
+                    wav_path=wav_path,
+                    output_jsonl=output_jsonl,
+                    true_label=true_labels[i],
+                    task_type=task_type,
+                    backend=backend,
+                    preprocess=preprocess,
+                    **backend_kwargs,
+                )
+            )
+            continue
+
+        key = os.path.splitext(os.path.basename(wav_path))[0]
+        result = build_result(key, answer, task_type, true_labels[i])
+        if i in pending:
+            # 同一批的条目共用这次请求的计量，summary 时按 batch_size 分摊
+            result["metrics"] = {**batch_metrics.to_dict(), "batch_size": len(pending)}
+            # 和单条请求同一个 key：重跑时批量、单条都能命中
+            if response_cache is not None:
+                response_cache.put(
+                    response_key(backend, model_name, prompt, send_paths[i], generation), answer
+                )
+        else:
+            result["metrics"] = {**RequestMetrics().to_dict(), "cache_hit": True}
+        if all_stats[i] is not None:
+            result["preprocess"] = all_stats[i]
+        if output_jsonl is not None:
+            write_result(output_jsonl, result)
+        results.append(result)
+
+    return results
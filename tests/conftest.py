@@ -0,0 +1,26 @@
+import os
+import sys
+import wave
+
+import pytest
+
+# 模块都在仓库根目录（没有包）
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def write_wav(path, seconds: float = 0.1, sample_rate: int = 16000) -> str:
+    with wave.open(str(path), "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        f.writeframes(b"\x00\x00" * int(seconds * sample_rate))
+    return str(path)
+
+
+@pytest.fixture
+def clips(tmp_path):
+    """Three short silent wavs of different lengths (different content hashes) as [(key, path)]."""
+    return [
+        (f"clip_{i}", write_wav(tmp_path / f"clip_{i}.wav", seconds=0.1 + 0.01 * i))
+        for i in range(3)
+    ]
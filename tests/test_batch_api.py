@@ -0,0 +1,73 @@
+import json
+import os
+
+import pytest
+
+from batch_api import OpenAIBatchBackend, _state_path, run_batch_job
+from client_registry import get_client
+from mock_server import MockConfig, MockServer
+
+
+def _result(key, raw_output):
+    return {"key": key, "pred": raw_output}
+
+
+def _read(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+@pytest.fixture
+def server():
+    with MockServer(MockConfig(latency=0, batch_latency=0.4)) as s:
+        yield s
+
+
+def _backend(server, **kwargs):
+    client = get_client("openai", api_key="mock", base_url=server.url + "/v1")
+    return OpenAIBatchBackend(client, poll_interval=0.05, **kwargs)
+
+
+def test_interrupted_job_is_collected_on_the_next_run(server, clips, tmp_path):
+    output = str(tmp_path / "out.jsonl")
+    assert run_batch_job(_backend(server, timeout=0), "m", "p", clips, output, _result) == []
+    saved = json.load(open(_state_path(output)))
+    assert saved["model"] == "m" and saved["keys"] == [k for k, _ in clips]
+
+    records = run_batch_job(_backend(server), "m", "p", clips, output, _result)
+
+    assert sorted(r["key"] for r in records) == [k for k, _ in clips]
+    assert server.state.stats["batch_jobs"] == 1
+    assert not os.path.exists(_state_path(output))
+    assert len(_read(output)) == len(clips)
+
+
+def test_items_the_saved_job_does_not_cover_go_out_as_a_new_job(server, clips, tmp_path):
+    output = str(tmp_path / "out.jsonl")
+    run_batch_job(_backend(server, timeout=0), "m", "p", clips[:2], output, _result)
+
+    records = run_batch_job(_backend(server), "m", "p", clips, output, _result)
+
+    assert sorted(r["key"] for r in records) == [k for k, _ in clips]
+    assert server.state.stats["batch_jobs"] == 2
+
+
+@pytest.mark.parametrize("model, prompt", [("other-model", "p"), ("m", "another prompt")])
+def test_saved_job_for_another_model_or_prompt_is_not_collected(server, clips, tmp_path, model, prompt):
+    output = str(tmp_path / "out.jsonl")
+    run_batch_job(_backend(server, timeout=0), "m", "p", clips, output, _result)
+
+    records = run_batch_job(_backend(server), model, prompt, clips, output, _result)
+
+    assert len(records) == len(clips)
+    assert server.state.stats["batch_jobs"] == 2
+    assert len(_read(output)) == len(clips)
+
+
+def test_failed_items_get_one_follow_up_job_then_error(clips, tmp_path):
+    output = str(tmp_path / "out.jsonl")
+    with MockServer(MockConfig(latency=0, batch_latency=0.1, error_rate=1.0)) as server:
+        records = run_batch_job(_backend(server), "m", "p", clips, output, _result, retries=1)
+
+        assert server.state.stats["batch_jobs"] == 2
+    assert [r["pred"] for r in records] == ["error"] * len(clips)
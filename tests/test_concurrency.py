@@ -0,0 +1,96 @@
+import asyncio
+import threading
+
+from concurrency import AdaptiveConcurrency, release_for_results
+
+
+def test_limit_grows_after_a_full_healthy_window():
+    c = AdaptiveConcurrency(initial=2, max_limit=4, latency_target=1.0)
+    slots = [c.try_acquire(), c.try_acquire()]
+    assert c.try_acquire() is None
+
+    for started in slots:
+        c.release(started, latency=0.1)
+
+    assert c.limit == 3
+
+
+def test_limit_does_not_grow_when_it_was_never_used_up():
+    c = AdaptiveConcurrency(initial=4, max_limit=8, latency_target=1.0)
+    for _ in range(8):
+        c.release(c.acquire(), latency=0.1)
+
+    assert c.limit == 4
+
+
+def test_errors_halve_the_limit_once_per_burst():
+    c = AdaptiveConcurrency(initial=8, latency_target=1.0)
+    slots = [c.acquire() for _ in range(4)]
+
+    for started in slots:
+        c.release(started, throttled=True)
+
+    assert c.limit == 4
+    c.release(c.acquire(), throttled=True)
+    assert c.limit == 2
+
+
+def test_slow_replies_back_off_and_never_drop_below_min():
+    c = AdaptiveConcurrency(initial=2, min_limit=2, latency_target=0.5, latency_backoff=0.5)
+    c.release(c.acquire(), latency=5.0)
+
+    assert c.limit == 2
+
+
+def test_release_for_results_reads_request_metrics():
+    c = AdaptiveConcurrency(initial=4, latency_target=1.0)
+    started = c.acquire()
+    release_for_results(c, started, [{"metrics": {"throttled": 1, "model_sec": 0.1}}])
+
+    assert c.limit == 2 and c.in_flight == 0
+
+
+def test_async_waiters_never_exceed_the_limit():
+    c = AdaptiveConcurrency(initial=3, max_limit=3)
+    peak = 0
+
+    async def job():
+        nonlocal peak
+        started = await c.acquire_async()
+        peak = max(peak, c.in_flight)
+        await asyncio.sleep(0.005)
+        c.release(started)
+
+    async def main():
+        await asyncio.wait_for(asyncio.gather(*(job() for _ in range(30))), 5)
+
+    asyncio.run(main())
+    assert peak == 3
+    assert c.in_flight == 0 and not c.async_waiters
+
+
+def test_async_waiter_is_woken_by_a_release_from_another_thread():
+    c = AdaptiveConcurrency(initial=1, max_limit=1)
+    held = c.acquire()
+
+    async def main():
+        threading.Timer(0.05, c.release, args=(held,)).start()
+        return await asyncio.wait_for(c.acquire_async(), 2)
+
+    assert asyncio.run(main()) > held
+
+
+def test_cancelled_waiter_passes_its_wakeup_on():
+    c = AdaptiveConcurrency(initial=1, max_limit=1)
+
+    async def main():
+        held = c.acquire()
+        first = asyncio.ensure_future(c.acquire_async())
+        second = asyncio.ensure_future(c.acquire_async())
+        await asyncio.sleep(0.01)
+        c.release(held)
+        first.cancel()
+        await asyncio.wait_for(second, 2)
+
+    asyncio.run(main())
+    assert c.in_flight == 1
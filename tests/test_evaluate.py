@@ -0,0 +1,48 @@
+import json
+
+import pytest
+
+from client_registry import get_client
+from conftest import write_wav
+from dataset_adapters import GTZANDataset
+from evaluate import evaluate_dataset
+from mock_server import MockConfig, MockServer
+from result_store import ResultStore
+from retry import RetryPolicy
+
+PROMPT = "Which genre is this clip? Answer with one of: blues, rock."
+
+
+@pytest.fixture
+def gtzan(tmp_path):
+    wav_dir = tmp_path / "gtzan"
+    wav_dir.mkdir()
+    for i, genre in enumerate(["blues", "blues", "rock"]):
+        write_wav(wav_dir / f"{genre}.0000{i}.wav", seconds=0.1 + 0.01 * i)
+    return GTZANDataset(str(wav_dir))
+
+
+@pytest.mark.parametrize("with_store", [False, True])
+def test_failed_clips_are_retried_on_resume(gtzan, tmp_path, with_store):
+    output = str(tmp_path / "preds.jsonl")
+    store = ResultStore(str(tmp_path / "results.sqlite")) if with_store else None
+
+    def run(error_rate):
+        with MockServer(MockConfig(latency=0, error_rate=error_rate)) as server:
+            client = get_client("openai", api_key="mock", base_url=server.url + "/v1")
+            evaluate_dataset(
+                gtzan, client, "m", PROMPT, output, backend="openai",
+                result_store=store, retry_policy=RetryPolicy(max_attempts=1),
+            )
+            return server.state.stats["chat"]
+
+    assert run(error_rate=1.0) == 3
+    assert run(error_rate=0.0) == 3
+    assert run(error_rate=0.0) == 0
+
+    with open(output, "r", encoding="utf-8") as f:
+        preds = {}
+        for line in f:
+            record = json.loads(line)
+            preds[record["key"]] = record["pred"]
+    assert "error" not in preds.values()
@@ -0,0 +1,67 @@
+import pytest
+
+from generation import GenerationProfile, genre_profile, score_profile, unwrap_answer
+
+SCORE = score_profile(stream=True)
+
+
+@pytest.mark.parametrize(
+    "text, answer",
+    [
+        ("4", None),                  # 还没看到分隔符，可能是 "45"
+        ("4\n", "4"),
+        ("4. the vocals are", "4"),
+        ("**3** because", "3"),
+        ('{"answer": "5"', "5"),
+        ("6 ", None),                 # 不在 choices 里
+        ("score: 4", None),
+        ("", None),
+    ],
+)
+def test_early_answer_needs_a_complete_allowed_word(text, answer):
+    assert SCORE.early_answer(text) == answer
+
+
+def test_early_answer_matches_genres_but_not_longer_words():
+    genres = genre_profile(["Rock", "Pop"])
+
+    assert genres.early_answer("rock, mostly") == "rock"
+    assert genres.early_answer("rocks ") is None
+    assert genres.early_answer("pop") is None
+
+
+def test_early_answer_without_choices_never_stops():
+    assert GenerationProfile().early_answer("4\n") is None
+
+
+def test_batch_profile_drops_choices_and_streaming():
+    batch = SCORE.for_batch(3)
+
+    assert batch.choices is None and not batch.stream
+    assert batch.max_output_tokens == (SCORE.max_output_tokens + 4) * 3
+
+
+def test_unwrap_answer():
+    assert unwrap_answer('{"answer": "3"}') == "3"
+    assert unwrap_answer("3") == "3"
+    assert unwrap_answer("{not json") == "{not json"
+
+
+@pytest.mark.parametrize(
+    "model, effort, max_tokens",
+    [
+        ("gemini-2.5-flash", "none", 16),
+        ("gemini-2.5-pro", "low", 16 + 1024),  # pro 至少 128 的思考落在 low 档
+    ],
+)
+def test_openai_max_tokens_leaves_room_for_the_effort_budget(model, effort, max_tokens):
+    params = SCORE.openai_params(model)
+
+    assert params["reasoning_effort"] == effort
+    assert params["max_tokens"] == max_tokens
+
+
+def test_openai_params_follow_the_thinking_budget():
+    assert GenerationProfile(thinking_budget=5000).openai_params("m")["reasoning_effort"] == "medium"
+    assert GenerationProfile(thinking_budget=30000).openai_params("m")["reasoning_effort"] == "high"
+    assert "max_tokens" not in GenerationProfile(thinking_budget=None).openai_params("m")
@@ -0,0 +1,44 @@
+import base64
+from types import SimpleNamespace
+
+import pytest
+
+from openai_client import _input_audio_format, _response_text, encode_audio_base64
+from retry import BAD_INPUT, classify_error
+
+
+def _reply(content, finish_reason="stop"):
+    message = SimpleNamespace(content=content)
+    return SimpleNamespace(choices=[SimpleNamespace(message=message, finish_reason=finish_reason)], usage=None)
+
+
+def test_reply_text_is_lowercased_and_unwrapped():
+    assert _response_text(_reply(' {"answer": "Rock"} ')) == "rock"
+
+
+def test_empty_reply_is_a_bad_answer_not_a_retry():
+    with pytest.raises(ValueError) as e:
+        _response_text(_reply(None, finish_reason="length"))
+
+    assert classify_error(e.value) == BAD_INPUT
+    assert "length" in str(e.value)
+
+
+@pytest.mark.parametrize("path, fmt", [("a.wav", "wav"), ("b.WAVE", "wav"), ("c.mp3", "mp3")])
+def test_input_audio_formats(path, fmt):
+    assert _input_audio_format(path) == fmt
+
+
+@pytest.mark.parametrize("path", ["a.flac", "b.ogg", "c"])
+def test_other_formats_are_rejected(path):
+    with pytest.raises(ValueError):
+        _input_audio_format(path)
+
+
+def test_encode_audio_base64_round_trips(clips, tmp_path):
+    _, path = clips[0]
+    with open(path, "rb") as f:
+        assert base64.b64decode(encode_audio_base64(path)) == f.read()
+    empty = tmp_path / "empty.wav"
+    empty.write_bytes(b"")
+    assert encode_audio_base64(str(empty)) == ""
@@ -0,0 +1,85 @@
+import json
+import os
+
+import pytest
+
+from result_store import ResultStore
+
+
+def _write(path, records):
+    with open(path, "w", encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps(record) + "\n")
+    return str(path)
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = ResultStore(str(tmp_path / "results.sqlite"))
+    yield store
+    store.close()
+
+
+def test_sync_imports_once_until_the_file_changes(store, tmp_path):
+    path = _write(tmp_path / "run.jsonl", [{"key": "a", "score": 3}, {"key": "b", "score": 5}])
+
+    assert store.sync_jsonl("run", path) == 2
+    assert store.sync_jsonl("run", path) == 0
+    assert store.done_keys("run") == {"a", "b"}
+    assert store.stats("run")["mean_score"] == 4.0
+
+
+def test_records_removed_from_the_jsonl_are_no_longer_done(store, tmp_path):
+    path = _write(tmp_path / "run.jsonl", [{"key": "a", "score": 3}, {"key": "b", "score": 5}])
+    store.sync_jsonl("run", path)
+
+    _write(path, [{"key": "a", "score": 2}])
+    os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 1))
+
+    assert store.sync_jsonl("run", path) == 1
+    assert store.done_keys("run") == {"a"}
+    assert store.stats("run")["total"] == 1
+    assert store.stats("run")["mean_score"] == 2.0
+
+
+def test_missing_file_empties_the_run(store, tmp_path):
+    path = _write(tmp_path / "run.jsonl", [{"key": "a", "score": 3}])
+    store.sync_jsonl("run", path)
+    os.remove(path)
+
+    assert store.sync_jsonl("run", path) == 0
+    assert store.done_keys("run") == set()
+    assert store.stats("run")["total"] == 0
+
+
+def test_same_run_name_from_another_folder_replaces_the_old_rows(store, tmp_path):
+    os.makedirs(tmp_path / "x")
+    os.makedirs(tmp_path / "y")
+    first = _write(tmp_path / "x" / "run.jsonl", [{"key": "a"}])
+    second = _write(tmp_path / "y" / "run.jsonl", [{"key": "b"}])
+
+    store.sync_jsonl("run", first)
+    store.sync_jsonl("run", second)
+
+    assert store.done_keys("run") == {"b"}
+
+
+def test_legacy_pop_records_are_keyed_by_file_name(store, tmp_path):
+    path = _write(
+        tmp_path / "pop.jsonl",
+        [{"music": "pop_0001.wav", "pred": "3", "true": 3}, {"no_key": 1}],
+    )
+
+    assert store.sync_jsonl("pop", path) == 1
+    assert store.done_keys("pop") == {"pop_0001"}
+    assert store.stats("pop")["accuracy"] == 1.0
+
+
+def test_put_keeps_run_totals_in_step(store):
+    store.put("run", {"key": "a", "pred": "rock", "true": "rock"})
+    store.put("run", {"key": "a", "pred": "pop", "true": "rock"})
+    store.put("run", {"key": "b", "score": 4})
+
+    stats = store.stats("run")
+    assert (stats["total"], stats["labelled"], stats["correct"], stats["scored"]) == (2, 1, 0, 1)
+    assert store.has("run", "b") and not store.has("other", "b")
@@ -0,0 +1,72 @@
+import pytest
+
+from metrics import RequestMetrics, collect
+from router import _SINGLE_ATTEMPT, Endpoint, Router
+from retry import RetryPolicy
+
+
+class StatusError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+class StubRouter(Router):
+    """Router whose endpoints answer from `behaviour` instead of the network."""
+
+    def __init__(self, behaviour, **kwargs):
+        endpoints = [Endpoint(name=name, backend="openai", client=None) for name in behaviour]
+        super().__init__(endpoints, retry_policy=RetryPolicy(max_attempts=3, deadline=5), **kwargs)
+        self.behaviour = behaviour
+        self.calls = {name: 0 for name in behaviour}
+
+    def _call(self, endpoint, model_name, prompt, wav_paths, batch, generation=None):
+        # 和真的 client 一样：每个 endpoint 只试一次
+        return _SINGLE_ATTEMPT.call(lambda: self._answer(endpoint))
+
+    def _answer(self, endpoint):
+        self.calls[endpoint.name] += 1
+        result = self.behaviour[endpoint.name]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+@pytest.mark.parametrize("code", [401, 403, 404])
+def test_auth_and_not_found_errors_move_the_item_to_another_endpoint(code):
+    router = StubRouter({"dead": StatusError(code), "ok": "3"})
+
+    outputs = [router.classify("m", "p", [f"clip_{i}.wav"]) for i in range(10)]
+
+    assert outputs == ["3"] * 10
+    dead = router.endpoints[0]
+    assert router.calls["dead"] == 1
+    assert dead.failures == 1 and dead.down_until > 0
+
+
+@pytest.mark.parametrize("code", [400, 413])
+def test_payload_errors_fail_only_the_item(code):
+    router = StubRouter({"only": StatusError(code)})
+
+    assert router.classify("m", "p", ["clip.wav"]) == "error"
+    assert router.calls["only"] == 1
+    assert router.endpoints[0].failures == 0
+
+
+def test_every_endpoint_broken_gives_up_at_the_deadline():
+    router = StubRouter({"a": StatusError(401), "b": StatusError(404)}, max_cooldown_sec=60)
+
+    assert router.classify("m", "p", ["clip.wav"]) == "error"
+    assert router.calls == {"a": 1, "b": 1}
+
+
+def test_a_throttled_attempt_is_counted_once():
+    router = StubRouter({"busy": StatusError(503), "ok": "3"}, cooldown_sec=60)
+    metrics = RequestMetrics()
+
+    with collect(metrics):
+        outputs = [router.classify("m", "p", [f"clip_{i}.wav"]) for i in range(5)]
+
+    assert outputs == ["3"] * 5
+    assert router.calls["busy"] == 1
+    assert metrics.values["throttled"] == 1 and metrics.values["retries"] == 1
@@ -0,0 +1,80 @@
+import json
+
+from hash_utils import in_shard
+from shard import merge_records, merge_shards, shard_path
+
+
+def test_successful_record_wins_over_an_error_in_either_order():
+    ok = {"key": "a", "pred": "rock", "true": "rock"}
+    error = {"key": "a", "pred": "error", "true": "rock"}
+
+    assert merge_records([ok, error])["a"] is ok
+    assert merge_records([error, ok])["a"] is ok
+
+
+def test_last_record_wins_otherwise():
+    first = {"key": "a", "score": 2}
+    second = {"key": "a", "score": 4}
+    failed = {"key": "b", "score": -1}
+    failed_again = {"key": "b", "score": -1, "retry": True}
+
+    merged = merge_records([first, second, failed, failed_again])
+
+    assert merged["a"] is second
+    assert merged["b"] is failed_again
+
+
+def test_old_music_records_merge_with_new_key_records():
+    merged = merge_records([
+        {"music": "pop_0001.wav", "pred": "error", "true": 3},
+        {"key": "pop_0001", "pred": "3", "true": 3},
+        {"no_key": True},
+    ])
+
+    assert list(merged) == ["pop_0001"]
+    assert merged["pop_0001"]["pred"] == "3"
+
+
+def test_shards_partition_the_keys():
+    keys = [f"clip_{i}" for i in range(200)]
+    owners = [[i for i in range(4) if in_shard(key, (i, 4))] for key in keys]
+
+    assert all(len(o) == 1 for o in owners)
+    assert {o[0] for o in owners} == {0, 1, 2, 3}
+
+
+def test_merge_shards_writes_sorted_output_and_accuracy(tmp_path):
+    output = str(tmp_path / "preds.jsonl")
+    shards = [
+        [{"key": "b", "pred": "pop", "true": "pop"}, {"key": "a", "pred": "error", "true": "rock"}],
+        [{"key": "a", "pred": "rock", "true": "rock"}, {"key": "c", "pred": "jazz", "true": "pop"}],
+    ]
+    for i, records in enumerate(shards):
+        with open(shard_path(output, i, 2), "w", encoding="utf-8") as f:
+            f.writelines(json.dumps(r) + "\n" for r in records)
+            f.write('{"key": "half a li')  # 被中断写了一半的行
+
+    acc = merge_shards("gtzan", output, 2)
+
+    with open(output, "r", encoding="utf-8") as f:
+        assert [json.loads(line)["key"] for line in f] == ["a", "b", "c"]
+    assert acc == 2 / 3
+
+
+def test_shard_path():
+    assert shard_path("out/preds.jsonl", 1, 4) == "out/preds.shard01-of-04.jsonl"
+
+
+def test_merge_keeps_results_already_in_the_output(tmp_path):
+    output = str(tmp_path / "preds.jsonl")
+    with open(output, "w", encoding="utf-8") as f:
+        f.write(json.dumps({"key": "old", "pred": "rock", "true": "rock"}) + "\n")
+        f.write(json.dumps({"key": "b", "pred": "jazz", "true": "pop"}) + "\n")
+    with open(shard_path(output, 0, 1), "w", encoding="utf-8") as f:
+        f.write(json.dumps({"key": "b", "pred": "pop", "true": "pop"}) + "\n")
+
+    assert merge_shards("gtzan", output, 1) == 1.0
+
+    with open(output, "r", encoding="utf-8") as f:
+        merged = {r["key"]: r["pred"] for r in map(json.loads, f)}
+    assert merged == {"old": "rock", "b": "pop"}
@@ -0,0 +1,25 @@
+from client_registry import get_client
+from mock_server import MockConfig, MockServer
+from response_cache import ResponseCache
+from retry import RetryPolicy
+from task import run_audio_batch_task
+
+PROMPT = "Rate the vocal style from 1 to 5. Answer with the number only."
+
+
+def test_batch_answers_are_cached_for_the_next_run(clips, tmp_path):
+    cache = ResponseCache(str(tmp_path / "responses.sqlite"))
+    paths = [path for _, path in clips]
+    with MockServer(MockConfig(latency=0)) as server:
+        client = get_client("openai", api_key="mock", base_url=server.url + "/v1")
+        kwargs = dict(
+            task_type="score", backend="openai", response_cache=cache,
+            retry_policy=RetryPolicy(max_attempts=1),
+        )
+
+        first = run_audio_batch_task(client, "m", PROMPT, paths, **kwargs)
+        second = run_audio_batch_task(client, "m", PROMPT, paths, **kwargs)
+
+        assert server.state.stats["chat"] == 1
+    assert [r["score"] for r in second] == [r["score"] for r in first]
+    assert all(r["metrics"]["cache_hit"] for r in second)
@@ -0,0 +1,82 @@
+# upload_cache.py
+
+import datetime
+import json
+import os
+import threading
+
+from google.genai import types
+
+# Files API 上传的文件默认保存 48 小时
+DEFAULT_TTL_SEC = 48 * 3600
+
+
+def _now() -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+class UploadCache:
+    """
+    Persistent map from file content hash to an uploaded Gemini file handle.
+
+    Uploaded files belong to one API key / project, so keep one cache file
+    per key. Entries are reused until `safety_margin_sec` before they expire.
+    """
+
+    def __init__(self, path: str = "upload_cache.json", safety_margin_sec: int = 600):
+        self.path = path
+        self.safety_margin = datetime.timedelta(seconds=safety_margin_sec)
+        self.lock = threading.Lock()
+        self.entries = {}
+        if os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    self.entries = json.load(f)
+            except Exception:
+                self.entries = {}
+
+    def _save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.entries, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, self.path)
+
+    def get(self, digest: str):
+        """
+        Return a file handle usable in `contents`, or None if missing/expired.
+        """
+        with self.lock:
+            entry = self.entries.get(digest)
+            if entry is None:
+                return None
+            expires = datetime.datetime.fromisoformat(entry["expiration_time"])
+            if expires - self.safety_margin <= _now():
+                del self.entries[digest]
+                self._save()
+                return None
+        return types.File(
+            name=entry["name"],
+            uri=entry["uri"],
+            mime_type=entry["mime_type"],
+        )
+
+    def put(self, digest: str, uploaded) -> None:
+        expires = getattr(uploaded, "expiration_time", None)
+        if expires is None:
+            expires = _now() + datetime.timedelta(seconds=DEFAULT_TTL_SEC)
+        elif expires.tzinfo is None:
+            expires = expires.replace(tzinfo=datetime.timezone.utc)
+
+        with self.lock:
+            self.entries[digest] = {
+                "name": uploaded.name,
+                "uri": uploaded.uri,
+                "mime_type": uploaded.mime_type,
+                "expiration_time": expires.isoformat(),
+            }
+            self._save()
+
+    def invalidate(self, digest: str) -> None:
+        with self.lock:
+            if self.entries.pop(digest, None) is not None:
+                self._save()